@@ -0,0 +1,182 @@
+import collections
+
+import numpy as np
+
+from analytics import CORE_EMOTIONS
+from prompts import get_story_phase
+
+# Cross-story aggregates kept up to date as each turn is persisted. Every
+# aggregate is a named counter over a few low-cardinality dimensions (genre,
+# provider, phase, emotion, trait, turn number), stored as one
+# (metric, dims, value) row that each turn adds to. The number of rows is
+# bounded by those dimensions, not by the number of stories, so reading them
+# all for the dashboard costs the same however much data has been collected.
+#
+# Each turn's increments are written as one row keyed by (story_id,
+# turn_number), and the backends record the keys they have applied, so a
+# write retried after it committed but timed out is not counted twice.
+#
+# Simulated stories are counted under their own metric names, prefixed with
+# SIMULATED_PREFIX, and the dashboard only adds them in when asked to.
+
+AGGREGATE_TABLE = "aggregate_counts"
+DIM_SEPARATOR = "|"
+OTHER_EMOTION = "other"
+SIMULATED_PREFIX = "simulated:"
+EMOTION_LABELS = CORE_EMOTIONS + [OTHER_EMOTION]
+
+
+def _emotion(mood):
+    # Anything outside the core emotions shares one bucket, so the dimensions stay bounded
+    mood = (mood or "").strip().lower()
+    return mood if mood in CORE_EMOTIONS else OTHER_EMOTION
+
+
+def _dims(*values):
+    return DIM_SEPARATOR.join(str(value) for value in values)
+
+
+def turn_increments(story_state, turn_data):
+    """Counter increments for one persisted turn, keyed by (metric, dims)"""
+    genre = story_state.get("genre") or "unknown"
+    # Story counts go to the model the reader chose, turn counts to the model
+    # that wrote the turn, which differs after a failover
+    chosen = story_state.get("model_choice") or "unknown"
+    provider = turn_data.get("provider") or chosen
+    story = _dims(genre, chosen)
+    turn = _dims(genre, provider)
+    current_turn = turn_data["turn_number"] - 1
+    phase = get_story_phase(current_turn, story_state["total_turns"])
+    character_mood = _emotion(turn_data["character_mood"])
+
+    increments = collections.Counter()
+    increments["turns", turn] += 1
+    if provider != chosen:
+        increments["failover_turns", story] += 1
+    if turn_data["turn_number"] == 1:
+        increments["stories", story] += 1
+    if turn_data.get("validation_error"):
+        increments["validation_errors", turn] += 1
+    if turn_data["is_final"]:
+        increments["completed_stories", story] += 1
+        if character_mood == _emotion(story_state.get("target_emotion")):
+            increments["target_reached", story] += 1
+    increments["character_mood", _dims(genre, phase, character_mood)] += 1
+    increments["user_mood", _dims(genre, phase, _emotion(turn_data["user_mood"]))] += 1
+
+    # The arcs already hold this turn, so the previous mood is the one before it
+    previous_mood = story_state.get("character_mood_arc", {}).get(current_turn - 1)
+    if previous_mood is not None:
+        increments["transition", _dims(_emotion(previous_mood), character_mood)] += 1
+
+    increments["score_turns", _dims(turn_data["turn_number"])] += 1
+    for trait, score in (turn_data.get("personality_scores") or {}).items():
+        increments["score_sum", _dims(trait, turn_data["turn_number"])] += score
+    if story_state.get("simulated"):
+        return collections.Counter({(SIMULATED_PREFIX + metric, dims): value for (metric, dims), value in increments.items()})
+    return increments
+
+
+def increment_rows(increments):
+    """aggregate_counts rows for a dict of increments"""
+    return [{"metric": metric, "dims": dims, "value": value} for (metric, dims), value in increments.items() if value]
+
+
+def turn_row(story_id, turn_number, increments):
+    """The aggregate write for one turn, applied at most once per (story_id, turn_number)"""
+    return {"story_id": story_id, "turn_number": turn_number, "increments": increment_rows(increments)}
+
+
+def unique_turn_rows(rows):
+    """Turn rows with repeated (story_id, turn_number) keys dropped, keeping the first"""
+    seen = set()
+    unique = []
+    for row in rows:
+        key = (row["story_id"], row["turn_number"])
+        if key not in seen:
+            seen.add(key)
+            unique.append(row)
+    return unique
+
+
+def merge_rows(rows):
+    """Collapse aggregate_counts rows with the same key, summing their values"""
+    merged = collections.Counter()
+    for row in rows:
+        merged[row["metric"], row["dims"]] += row["value"]
+    return increment_rows(merged)
+
+
+class AggregateView:
+    """The dashboard's read-only view of the aggregate_counts rows.
+
+    Counts from simulated stories are left out unless include_simulated is
+    set, in which case they are added to the readers' counts.
+    """
+
+    def __init__(self, rows, include_simulated=False):
+        self.metrics = collections.defaultdict(dict)
+        for row in rows:
+            metric = row["metric"]
+            if metric.startswith(SIMULATED_PREFIX):
+                if not include_simulated:
+                    continue
+                metric = metric[len(SIMULATED_PREFIX):]
+            counts = self.metrics[metric]
+            key = tuple(row["dims"].split(DIM_SEPARATOR))
+            counts[key] = counts.get(key, 0) + row["value"]
+
+    def total(self, metric):
+        return sum(self.metrics[metric].values())
+
+    def story_stats(self):
+        """Per (genre, provider) counts and rates, one dict per pair.
+
+        Stories, completions and failover turns are counted for the provider
+        the reader chose; turns and validation errors for the provider that
+        wrote them.
+        """
+        stats = []
+        for genre, provider in sorted(self.metrics["turns"].keys() | self.metrics["stories"].keys()):
+            key = (genre, provider)
+            turns = self.metrics["turns"].get(key, 0)
+            completed = self.metrics["completed_stories"].get(key, 0)
+            stats.append({
+                "genre": genre,
+                "provider": provider,
+                "stories": self.metrics["stories"].get(key, 0),
+                "completed": completed,
+                "turns": turns,
+                "failover_turns": self.metrics["failover_turns"].get(key, 0),
+                "validation_error_rate": self.metrics["validation_errors"].get(key, 0) / turns if turns else 0.0,
+                "target_reached_rate": self.metrics["target_reached"].get(key, 0) / completed if completed else None,
+            })
+        return stats
+
+    def transition_matrix(self):
+        """Counts of character mood transitions, rows from and columns to, in EMOTION_LABELS order"""
+        index = {emotion: i for i, emotion in enumerate(EMOTION_LABELS)}
+        matrix = np.zeros((len(EMOTION_LABELS), len(EMOTION_LABELS)))
+        for (from_emotion, to_emotion), count in self.metrics["transition"].items():
+            matrix[index.get(from_emotion, index[OTHER_EMOTION]), index.get(to_emotion, index[OTHER_EMOTION])] += count
+        return matrix
+
+    def mood_distribution(self, metric="character_mood", genre=None):
+        """{phase: {emotion: count}} for one genre, or all genres together"""
+        distribution = collections.defaultdict(collections.Counter)
+        for (mood_genre, phase, emotion), count in self.metrics[metric].items():
+            if genre is None or mood_genre == genre:
+                distribution[phase][emotion] += count
+        return distribution
+
+    def genres(self):
+        return sorted({genre for genre, _ in self.metrics["turns"]})
+
+    def score_trajectories(self):
+        """{trait: [(turn number, mean score), ...]} over every story"""
+        trajectories = collections.defaultdict(list)
+        for (trait, turn_number), total in sorted(self.metrics["score_sum"].items(), key=lambda item: (item[0][0], int(item[0][1]))):
+            turns = self.metrics["score_turns"].get((turn_number,), 0)
+            if turns:
+                trajectories[trait].append((int(turn_number), total / turns))
+        return trajectories
@@ -0,0 +1,152 @@
+import functools
+
+import numpy as np
+
+# Post-story analytics computed on arrays. A finished story's page is rerun
+# on every button press, so the figure and phase counts are memoised on a
+# snapshot of the arcs and only built once per story.
+
+# The 10 core emotions in plotting order, bottom to top
+CORE_EMOTIONS = ['joy', 'anticipation', 'trust', 'surprise', 'neutral', 'confusion', 'fear', 'sadness', 'disgust', 'anger']
+EMOTION_TO_NUM = {emotion: i for i, emotion in enumerate(CORE_EMOTIONS)}
+NEUTRAL_NUM = EMOTION_TO_NUM['neutral']
+
+# Sorted emotion names and their plot positions, for encoding with searchsorted
+_SORTED_EMOTIONS = np.array(sorted(CORE_EMOTIONS))
+_SORTED_NUMS = np.array([EMOTION_TO_NUM[emotion] for emotion in _SORTED_EMOTIONS], dtype=float)
+
+
+def arc_snapshot(story_state):
+    """Hashable copy of everything the story analytics depend on"""
+    return (
+        tuple(sorted(story_state.get("character_mood_arc", {}).items())),
+        tuple(sorted(story_state.get("user_mood_arc", {}).items())),
+        tuple(sorted(story_state.get("validation_errors", {}).items())),
+        (story_state.get("target_emotion") or "neutral").lower(),
+        story_state.get("total_turns", 10),
+    )
+
+
+def encode_moods(moods):
+    """Plot positions of a sequence of mood names, NaN where a mood is missing or not a core emotion"""
+    names = np.char.lower(np.array([mood or "" for mood in moods], dtype=str))
+    if not names.size:
+        return np.empty(0)
+    index = np.minimum(np.searchsorted(_SORTED_EMOTIONS, names), len(_SORTED_EMOTIONS) - 1)
+    return np.where(_SORTED_EMOTIONS[index] == names, _SORTED_NUMS[index], np.nan)
+
+
+def ideal_arc(turns, initial_num, target_num):
+    """Straight line from the initial to the target mood over the turns, snapped to the nearest emotion"""
+    turns = np.asarray(turns, dtype=float)
+    if turns.size <= 1:
+        return np.full(turns.size, float(initial_num))
+    last_turn = turns.max() if turns.max() > 0 else 1
+    ideal = initial_num + (target_num - initial_num) * (turns / last_turn)
+    # Nearest whole position, ties to the lower one
+    return np.clip(np.ceil(ideal - 0.5), 0, len(CORE_EMOTIONS) - 1)
+
+
+def mood_series(snapshot):
+    """Arrays of the turns that have a valid mood, with both moods' names and positions"""
+    character_arc, user_arc, validation_errors, _, _ = snapshot
+    character_moods, user_moods = dict(character_arc), dict(user_arc)
+    turns = np.array(sorted(character_moods.keys() | user_moods.keys()), dtype=int)
+    character = [character_moods.get(turn) for turn in turns]
+    user = [user_moods.get(turn) for turn in turns]
+    character_num, user_num = encode_moods(character), encode_moods(user)
+    keep = ~(np.isnan(character_num) & np.isnan(user_num))
+    errors = dict(validation_errors)
+    return {
+        "turn": turns[keep],
+        "character_mood": np.array([(mood or "").lower() for mood in character], dtype=object)[keep],
+        "user_mood": np.array([(mood or "").lower() for mood in user], dtype=object)[keep],
+        "character_mood_num": character_num[keep],
+        "user_mood_num": user_num[keep],
+        "has_error": np.isin(turns[keep], list(errors)),
+        "error": np.array([errors.get(turn, 'None') for turn in turns[keep]], dtype=object),
+        "all_turns": turns,
+    }
+
+
+@functools.lru_cache(maxsize=256)
+def mood_figure(snapshot):
+    """Mood progression figure for an arc snapshot, or None without plottable moods"""
+    import plotly.graph_objects as go
+
+    series = mood_series(snapshot)
+    if not series["turn"].size:
+        return None
+    target_emotion = snapshot[3]
+    initial_num = EMOTION_TO_NUM.get(series["character_mood"][0], NEUTRAL_NUM)
+    target_num = EMOTION_TO_NUM.get(target_emotion, NEUTRAL_NUM)
+    all_turns = series["all_turns"]
+
+    fig = go.Figure()
+
+    # Character Mood Trace
+    fig.add_trace(go.Scatter(
+        x=series["turn"],
+        y=series["character_mood_num"],
+        mode='lines+markers',
+        name='Character Mood',
+        text=[mood.capitalize() for mood in series["character_mood"]],
+        marker=dict(color=np.where(series["has_error"], 'red', 'blue'), size=10),
+        hovertemplate='Character: %{text}<br>Turn: %{x}<br>Error: %{customdata}<extra></extra>',
+        customdata=series["error"]  # Add error message to hover
+    ))
+
+    # User Mood Trace
+    fig.add_trace(go.Scatter(
+        x=series["turn"],
+        y=series["user_mood_num"],
+        mode='lines+markers',
+        name='User Mood (Model)',
+        text=[mood.capitalize() for mood in series["user_mood"]],
+        marker=dict(color='green', size=10),
+        hovertemplate='User: %{text}<br>Turn: %{x}<extra></extra>'
+    ))
+
+    # Ideal Character Mood Trace
+    fig.add_trace(go.Scatter(
+        x=all_turns,
+        y=ideal_arc(all_turns, initial_num, target_num),
+        mode='lines',
+        name='Ideal Character Mood (Conceptual)',
+        line=dict(color='gray', dash='dot'),
+        hovertemplate='Ideal: %{y}<br>Turn: %{x}<extra></extra>'
+    ))
+
+    # Update y-axis to show emotion names
+    fig.update_layout(
+        yaxis=dict(
+            tickvals=list(range(len(CORE_EMOTIONS))),
+            ticktext=[emotion.capitalize() for emotion in CORE_EMOTIONS]
+        ),
+        title='Emotional Progression and Validation',
+        xaxis_title='Turn Number',
+        yaxis_title='Mood',
+        hovermode='closest'
+    )
+    return fig
+
+
+def story_phases(turns, total_turns):
+    """Story phase of each turn, as EmotionalValidator.get_phase_for_turn assigns them"""
+    turns = np.asarray(turns)
+    return np.select(
+        [turns < total_turns // 3, turns < (total_turns * 2) // 3, turns <= total_turns],
+        ["beginning", "middle", "climax"],
+        default="final"
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def phase_counts(snapshot):
+    """Number of character mood turns in each story phase, most common first"""
+    import pandas as pd
+
+    character_arc, total_turns = snapshot[0], snapshot[4]
+    phases, counts = np.unique(story_phases([turn for turn, _ in character_arc], total_turns), return_counts=True)
+    order = np.argsort(-counts, kind="stable")
+    return pd.Series(counts[order], index=phases[order], name="count")
@@ -0,0 +1,212 @@
+"""Offline end-to-end benchmark of complete stories.
+
+Drives the headless story engine through whole 10- and 17-turn stories
+against deterministic fake LLM and storage backends and reports per-turn
+CPU time, wall time, allocations and prompt sizes.
+
+    python benchmark.py                          # run and compare with the baseline if there is one
+    python benchmark.py --save-baseline          # run and store the results as the new baseline
+    python benchmark.py --llm-latency 0.8 --storage-latency 0.05
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from emotional_validator import EmotionalValidator
+from fake_backends import FakeLLMClients, FakeStorageBackend
+from speculation import extract_options
+from story_engine import StoryEngine, new_story_state
+from telemetry import Telemetry
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+FALLBACK_REPLIES = [
+    "I want to understand what is happening here",
+    "Let's go together and help them",
+    "I stay quiet and think about it",
+    "I take the risk and explore the unknown path",
+]
+COMPARED_METRICS = ("wall_ms", "cpu_ms", "alloc_peak_kb")
+
+
+def story_details(total_turns, index=0):
+    return {
+        "name": f"Reader{index}",
+        "pronouns": "they/them",
+        "age": 25 + index % 40,
+        "genre": ["fantasy", "mystery", "dreamlike", "sci-fi"][index % 4],
+        "current_emotion": "sadness",
+        "target_emotion": "joy",
+        "total_turns": total_turns,
+        "started": True,
+    }
+
+
+def choose_reply(question, turn):
+    """Deterministic user reply: one of the question's options when it offers any"""
+    options = extract_options(question)
+    if options:
+        return options[turn % len(options)]
+    return FALLBACK_REPLIES[turn % len(FALLBACK_REPLIES)]
+
+
+def play_story(engine, total_turns, index=0, on_turn=None):
+    """Play a complete story and return the turn data of every turn.
+
+    on_turn, if given, is a context manager factory wrapped around each
+    turn (reply included) so callers can measure it.
+    """
+    story_state = new_story_state(**story_details(total_turns, index))
+    turns = []
+    question = None
+    measure = on_turn or contextlib.nullcontext
+    while story_state["turn_count"] < total_turns:
+        turn = story_state["turn_count"]
+        with measure() as measurement:
+            if question is not None:
+                engine.respond(story_state, choose_reply(question, turn))
+            turn_data = engine.play_turn(story_state, final=turn == total_turns - 1)
+        if turn_data is None:
+            raise RuntimeError(f"Turn {turn} produced no response")
+        if measurement is not None:
+            turn_data["measurement"] = measurement
+        question = turn_data["question"]
+        turns.append(turn_data)
+    return turns
+
+
+@contextlib.contextmanager
+def measure_time():
+    measurement = {}
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    yield measurement
+    measurement["wall_ms"] = (time.perf_counter() - wall_start) * 1000
+    measurement["cpu_ms"] = (time.process_time() - cpu_start) * 1000
+
+
+@contextlib.contextmanager
+def measure_allocations():
+    measurement = {}
+    tracemalloc.reset_peak()
+    current_start, _ = tracemalloc.get_traced_memory()
+    yield measurement
+    current, peak = tracemalloc.get_traced_memory()
+    measurement["alloc_peak_kb"] = (peak - current_start) / 1024
+    measurement["alloc_net_kb"] = (current - current_start) / 1024
+
+
+def make_engine(args, telemetry):
+    llm = FakeLLMClients(latency=args.llm_latency, jitter=args.llm_jitter, seed=args.seed)
+    storage = FakeStorageBackend(latency=args.storage_latency)
+    return StoryEngine(llm, validator=EmotionalValidator(), storage=storage, telemetry=telemetry), llm
+
+
+def benchmark_length(args, total_turns):
+    """Per-turn medians over args.repeat stories of one length"""
+    telemetry = Telemetry()
+    engine, llm = make_engine(args, telemetry)
+    timings = []
+    try:
+        # Warm-up story so imports and first-use caches are not measured
+        play_story(engine, total_turns, index=-1)
+        for repeat in range(args.repeat):
+            timings.append(play_story(engine, total_turns, index=repeat, on_turn=measure_time))
+
+        # Allocations are measured in a separate pass, tracing slows everything else down
+        tracemalloc.start()
+        try:
+            allocations = play_story(engine, total_turns, index=0, on_turn=measure_allocations)
+        finally:
+            tracemalloc.stop()
+    finally:
+        llm.close()
+
+    turns = []
+    for turn in range(total_turns):
+        report = timings[0][turn]["prompt_report"]
+        turns.append({
+            "turn": turn,
+            "wall_ms": statistics.median(story[turn]["measurement"]["wall_ms"] for story in timings),
+            "cpu_ms": statistics.median(story[turn]["measurement"]["cpu_ms"] for story in timings),
+            "alloc_peak_kb": allocations[turn]["measurement"]["alloc_peak_kb"],
+            "alloc_net_kb": allocations[turn]["measurement"]["alloc_net_kb"],
+            "prompt_chars": report["prefix_chars"] + report["suffix_chars"],
+            "prefix_tokens": report["prefix_tokens"],
+            "suffix_tokens": report["suffix_tokens"],
+        })
+    totals = {metric: sum(turn[metric] for turn in turns) for metric in ("wall_ms", "cpu_ms", "alloc_peak_kb")}
+    totals["max_suffix_tokens"] = max(turn["suffix_tokens"] for turn in turns)
+    return {"turns": turns, "totals": totals, "stages": telemetry.summary()}
+
+
+def print_report(total_turns, result):
+    print(f"\n{total_turns}-turn story")
+    print(f"{'turn':>4} {'wall ms':>9} {'cpu ms':>8} {'peak KiB':>9} {'net KiB':>8} {'prompt chars':>12} {'prefix tok':>10} {'suffix tok':>10}")
+    for turn in result["turns"]:
+        print(f"{turn['turn']:>4} {turn['wall_ms']:>9.2f} {turn['cpu_ms']:>8.2f} {turn['alloc_peak_kb']:>9.1f} "
+              f"{turn['alloc_net_kb']:>8.1f} {turn['prompt_chars']:>12} {turn['prefix_tokens']:>10} {turn['suffix_tokens']:>10}")
+    totals = result["totals"]
+    print(f"total wall {totals['wall_ms']:.2f} ms, cpu {totals['cpu_ms']:.2f} ms, peak allocations {totals['alloc_peak_kb']:.1f} KiB")
+    print("stage p50/p95 ms: " + ", ".join(f"{row['stage']} {row['p50_ms']}/{row['p95_ms']}" for row in result["stages"]))
+
+
+def compare(results, baseline, threshold):
+    """Print changes against the baseline; return the regressions beyond the threshold"""
+    regressions = []
+    print(f"\nCompared with baseline ({baseline.get('created', 'unknown date')}):")
+    for length, result in results.items():
+        base = baseline.get("results", {}).get(length)
+        if not base:
+            print(f"  {length}-turn: no baseline")
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = base["totals"][metric], result["totals"][metric]
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append((length, metric, change))
+            print(f"  {length}-turn {metric}: {before:.2f} -> {after:.2f} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 17], help="story lengths in turns")
+    parser.add_argument("--repeat", type=int, default=5, help="timed stories per length")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="fake LLM seconds per call")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="extra random fake LLM seconds per call")
+    parser.add_argument("--storage-latency", type=float, default=0.0, help="fake storage seconds per call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to compare with or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="relative slowdown reported as a regression")
+    parser.add_argument("--verbose", action="store_true", help="show the engine's debug output")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for total_turns in args.lengths:
+        # The validator and parser print debug lines on every turn
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            result = benchmark_length(args, total_turns)
+        results[str(total_turns)] = result
+        print_report(total_turns, result)
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": vars(args), "results": results}, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Build optimised genre backgrounds from the originals in static/backgrounds.
+
+For every original this writes resized WebP variants at several widths into
+static/build/, named by a hash of their content, plus a tiny blurred
+placeholder inlined in the manifest. AVIF can be added with --formats, but
+at the same quality it came out larger than WebP for these backgrounds. The
+app serves the variants through Streamlit's static file serving at
+app/static/build/; since names change whenever content does, those paths can
+be cached forever (Cache-Control: public, max-age=31536000, immutable) by the
+proxy in front of the app.
+
+    python build_assets.py
+    python build_assets.py --widths 480 960 1600 --quality 70
+
+The output is committed, so deploys serve it without a build step; rerun
+this and commit static/build/ whenever a background changes.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import sys
+
+from PIL import Image, ImageFilter
+
+SOURCE_DIR = os.path.join("static", "backgrounds")
+BUILD_DIR = os.path.join("static", "build")
+MANIFEST_PATH = os.path.join(BUILD_DIR, "manifest.json")
+DEFAULT_WIDTHS = (640, 1280, 1920)
+PLACEHOLDER_WIDTH = 24
+SOURCE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Background file name for each genre key used by the app, "home" is the start screen
+ASSET_NAMES = {
+    "home": "home",
+    "fantasy": "fantasy",
+    "mystery": "mystery",
+    "dreamlike": "dreamlike",
+    "sci-fi": "scifi",
+    "horror": "horror",
+    "romance": "romance",
+    "comedy": "comedy",
+    "adventure": "adventure",
+}
+
+MIME_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+
+
+def available_formats(requested):
+    """Requested formats this Pillow build can encode"""
+    try:
+        import pillow_avif  # noqa: F401  Registers the AVIF codec with older Pillow versions
+    except ImportError:
+        pass
+    Image.init()
+    formats = []
+    for image_format in requested:
+        if image_format.upper() not in Image.SAVE:
+            print(f"{image_format.upper()} encoding is not available in this Pillow build, skipping those variants")
+            continue
+        formats.append(image_format)
+    return formats
+
+
+def encode(image, image_format, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format.upper(), quality=quality, **({"method": 6} if image_format == "webp" else {}))
+    return buffer.getvalue()
+
+
+def write_hashed(name, width, image_format, data):
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    filename = f"{name}.{width}w.{digest}.{image_format}"
+    path = os.path.join(BUILD_DIR, filename)
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    return filename
+
+
+def placeholder_data_uri(image):
+    """A few hundred bytes of blurred WebP shown while the real background loads"""
+    height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    tiny = image.resize((PLACEHOLDER_WIDTH, height), Image.LANCZOS).filter(ImageFilter.GaussianBlur(1))
+    return "data:image/webp;base64," + base64.b64encode(encode(tiny, "webp", 40)).decode("ascii")
+
+
+def build_background(key, source_path, widths, formats, quality):
+    with Image.open(source_path) as original:
+        image = original.convert("RGB")
+    entry = {
+        "source": os.path.basename(source_path),
+        "width": image.width,
+        "height": image.height,
+        "placeholder": placeholder_data_uri(image),
+        "variants": {image_format: [] for image_format in formats},
+    }
+    # Never upscale; an original narrower than every width gets one variant at its own size
+    target_widths = sorted({min(width, image.width) for width in widths})
+    for width in target_widths:
+        resized = image if width == image.width else image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        for image_format in formats:
+            filename = write_hashed(ASSET_NAMES[key], width, image_format, encode(resized, image_format, quality))
+            entry["variants"][image_format].append({"width": width, "file": filename})
+    return entry
+
+
+def find_source(name):
+    for extension in SOURCE_EXTENSIONS:
+        path = os.path.join(SOURCE_DIR, name + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--widths", type=int, nargs="+", default=list(DEFAULT_WIDTHS))
+    parser.add_argument("--formats", nargs="+", default=["webp"], choices=sorted(MIME_TYPES))
+    parser.add_argument("--quality", type=int, default=72)
+    args = parser.parse_args(argv)
+
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    formats = available_formats(args.formats)
+    manifest = {"mime_types": {image_format: MIME_TYPES[image_format] for image_format in formats}, "backgrounds": {}}
+    written = set()
+    for key, name in ASSET_NAMES.items():
+        source_path = find_source(name)
+        if source_path is None:
+            print(f"No original found for '{key}' in {SOURCE_DIR}, skipping")
+            continue
+        entry = build_background(key, source_path, args.widths, formats, args.quality)
+        manifest["backgrounds"][key] = entry
+        sizes = []
+        for image_format, variants in entry["variants"].items():
+            for variant in variants:
+                written.add(variant["file"])
+                sizes.append(f"{variant['width']}w {image_format} {os.path.getsize(os.path.join(BUILD_DIR, variant['file'])) // 1024} KiB")
+        print(f"{key}: {os.path.getsize(source_path) // 1024} KiB original -> {', '.join(sizes)}")
+
+    # Remove variants left over from earlier builds
+    for filename in os.listdir(BUILD_DIR):
+        if filename != os.path.basename(MANIFEST_PATH) and filename not in written:
+            os.remove(os.path.join(BUILD_DIR, filename))
+
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote {MANIFEST_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
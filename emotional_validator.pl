@@ -10,6 +10,8 @@ emotion_category(surprise, neutral).
 emotion_category(disgust, negative).
 emotion_category(trust, positive).
 emotion_category(anticipation, positive).
+emotion_category(neutral, neutral).
+emotion_category(confusion, neutral).
 
 % Emotional intensity levels
 intensity_level(low, 1).
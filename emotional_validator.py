@@ -1,18 +1,31 @@
+import numpy as np
+
+from prolog_rules import DEFAULT_RULES_PATH, load_rules
+
+# Per-turn error codes, combined as bit flags
+ERROR_NONE = 0
+ERROR_INVALID_MOOD = 1
+ERROR_INVALID_TRANSITION = 2
+ERROR_PHASE_MISMATCH = 4
+ERROR_INVALID_SCORES = 8
+ERROR_STORY_PHASE = 16      # Mood not allowed in the story phase by valid_emotional_progression
+
+# Mood codes that are not one of the emotions
+INVALID_CODE = -1   # Missing or unknown mood
+PAD_CODE = -2       # Padding after the end of a shorter arc in a batch
+
+# Story phases prompts.get_story_phase assigns, in order
+STORY_PHASES = ["beginning", "middle", "climax"]
+
+
 class EmotionalValidator:
-    def __init__(self):
-        # Define core emotion categories - 10 specific emotions
-        self.emotion_categories = {
-            'joy': 'positive',      # Happiness, delight
-            'sadness': 'negative',  # Grief, sorrow
-            'anger': 'negative',    # Rage, frustration
-            'fear': 'negative',     # Anxiety, terror
-            'trust': 'positive',    # Confidence, faith
-            'surprise': 'neutral',  # Amazement, wonder
-            'anticipation': 'positive', # Expectation, hope
-            'disgust': 'negative',  # Aversion, repulsion
-            'neutral': 'neutral',   # Balanced, calm
-            'confusion': 'neutral'  # Uncertainty, doubt
-        }
+    def __init__(self, rules_path=DEFAULT_RULES_PATH):
+        # Emotion categories, transitions and per-phase emotions come from the Prolog rule file
+        rules = load_rules(rules_path)
+        self.emotion_categories = rules['emotion_categories']
+        self.valid_transitions = rules['valid_transitions']
+        self.phase_progressions = rules['phase_progressions']
+        self.phase_emotions = rules['phase_emotions']
 
         # Define valid phase progressions based on turn ranges
         # These are flexible guidelines for validation
@@ -24,13 +37,63 @@ class EmotionalValidator:
             (11, 12, 'target emotion') # This range is for reaching the target emotion in longer stories
         ]
 
-        # Define basic valid transitions between emotion categories (simplified)
-        self.valid_category_transitions = {
-            'positive': ['positive', 'neutral', 'surprise', 'anticipation'],
-            'negative': ['negative', 'neutral', 'surprise', 'fear', 'anger', 'sadness', 'disgust'],
-            'neutral': list(self.emotion_categories.values()), # Can transition to any category from neutral
+        # Category each phase expects the character mood to be in, if any
+        self.phase_expectations = {
+            'target emotion': 'positive'
         }
 
+        self.compile_tables()
+
+    def compile_tables(self):
+        """Precompute the lookup tables used by every validation path"""
+        # Emotions as small integer codes
+        self.emotions = list(self.emotion_categories)
+        self.emotion_codes = {emotion: code for code, emotion in enumerate(self.emotions)}
+        self.categories = [self.emotion_categories[emotion] for emotion in self.emotions]
+
+        # transition_valid[previous, current] for every pair of emotions
+        n = len(self.emotions)
+        self.transition_valid = np.zeros((n, n), dtype=bool)
+        for previous, allowed in self.valid_transitions.items():
+            for current in allowed:
+                self.transition_valid[self.emotion_codes[previous], self.emotion_codes[current]] = True
+
+        # story_phase_ok[story phase][emotion]; story phases without a rule allow any emotion
+        self.story_phase_ok = {}
+        for phase, allowed in self.phase_emotions.items():
+            self.story_phase_ok[phase] = np.isin(self.emotions, allowed)
+        # The same table indexed by position in STORY_PHASES, for the batch path
+        self.story_phase_table = np.ones((len(STORY_PHASES), n), dtype=bool)
+        for index, phase in enumerate(STORY_PHASES):
+            if phase in self.story_phase_ok:
+                self.story_phase_table[index] = self.story_phase_ok[phase]
+
+        # phase_ok[turn, emotion] is False where the mood misses the phase expectation;
+        # turns past the last range reuse the final row, which has no expectation
+        self.max_phase_turn = max(end for _, end, _ in self.phase_ranges) + 1
+        self.phase_ok = np.ones((self.max_phase_turn + 1, n), dtype=bool)
+        self.phase_names = [None] * (self.max_phase_turn + 1)
+        for start, end, phase_name in self.phase_ranges:
+            for turn in range(start, end + 1):
+                self.phase_names[turn] = phase_name
+                expected = self.phase_expectations.get(phase_name)
+                if expected:
+                    self.phase_ok[turn] = [category == expected for category in self.categories]
+
+    def encode_mood(self, mood):
+        """Integer code of a mood, or INVALID_CODE"""
+        if not isinstance(mood, str):
+            return INVALID_CODE
+        return self.emotion_codes.get(mood.strip().lower(), INVALID_CODE)
+
+    def encode_arcs(self, arcs):
+        """Encode mood arcs (lists of mood strings) into a padded (n_arcs, n_turns) int8 array"""
+        n_turns = max((len(arc) for arc in arcs), default=0)
+        codes = np.full((len(arcs), n_turns), PAD_CODE, dtype=np.int8)
+        for i, arc in enumerate(arcs):
+            codes[i, :len(arc)] = [self.encode_mood(mood) for mood in arc]
+        return codes
+
     def get_phase_for_turn(self, turn_number, total_turns):
          # Determine story phase based on turn number and total turns
         if turn_number < total_turns // 3:
@@ -42,68 +105,69 @@ class EmotionalValidator:
         else:
             return "final" # For turns beyond the initial total_turns in long stories
 
+    def check_turn(self, turn_number, mood_code, previous_code=INVALID_CODE, personality_scores=None, story_phase=None):
+        """Error flags for one turn given the previous turn's mood code, in constant time"""
+        if mood_code < 0:
+            errors = ERROR_INVALID_MOOD
+        else:
+            errors = ERROR_NONE
+            if previous_code >= 0 and not self.transition_valid[previous_code, mood_code]:
+                errors |= ERROR_INVALID_TRANSITION
+            if not self.phase_ok[min(max(turn_number, 0), self.max_phase_turn), mood_code]:
+                errors |= ERROR_PHASE_MISMATCH
+            if story_phase in self.story_phase_ok and not self.story_phase_ok[story_phase][mood_code]:
+                errors |= ERROR_STORY_PHASE
+        if personality_scores is not None and not self.scores_valid(personality_scores):
+            errors |= ERROR_INVALID_SCORES
+        return errors
+
+    def scores_valid(self, personality_scores):
+        if not isinstance(personality_scores, list) or len(personality_scores) != 6:
+            return False
+        return all(isinstance(score, (int, float)) and -5 <= score <= 5 for score in personality_scores)
 
     def validate_turn(self, turn_number, character_mood_arc, story_phase, personality_scores, is_final):
         """Validate a single story turn and its progression from the previous turn"""
         try:
-            print(f"Validating turn: {turn_number}, Story Phase: {story_phase}")
-
             current_mood = character_mood_arc.get(turn_number)
+            mood_code = self.encode_mood(current_mood)
+            previous_code = self.encode_mood(character_mood_arc.get(turn_number - 1)) if turn_number > 0 else INVALID_CODE
+            errors = self.check_turn(turn_number, mood_code, previous_code, personality_scores, story_phase)
 
             # 1. Validate current character mood
-            if not isinstance(current_mood, str) or current_mood.lower() not in self.emotion_categories:
-                 valid_emotions_list = ', '.join(self.emotion_categories.keys())
+            if errors & ERROR_INVALID_MOOD:
+                 valid_emotions_list = ', '.join(self.emotions)
                  error_msg = f"Invalid character mood '{current_mood}'. Must be one of: {valid_emotions_list}."
                  print(f"Validation Error (Turn {turn_number}): {error_msg}")
                  return error_msg
 
             # 2. Validate emotional progression (if not the first turn)
-            if turn_number > 0:
-                previous_mood = character_mood_arc.get(turn_number - 1)
-
-                if previous_mood and current_mood:
-                     previous_mood_lower = previous_mood.lower()
-                     current_mood_lower = current_mood.lower()
-
-                     prev_category = self.emotion_categories.get(previous_mood_lower, 'neutral')
-                     curr_category = self.emotion_categories.get(current_mood_lower, 'neutral')
-
-                     # Basic category transition check
-                     if curr_category not in self.valid_category_transitions.get(prev_category, []):
-                          error_msg = f"Invalid emotional transition from '{previous_mood}' ({prev_category}) to '{current_mood}' ({curr_category})."
-                          print(f"Validation Error (Turn {turn_number}): {error_msg}")
-                          # return error_msg # We will log this but not return as error for now
+            if errors & ERROR_INVALID_TRANSITION:
+                 previous_mood = character_mood_arc.get(turn_number - 1)
+                 error_msg = f"Invalid emotional transition from '{previous_mood}' ({self.categories[previous_code]}) to '{current_mood}' ({self.categories[mood_code]})."
+                 print(f"Validation Error (Turn {turn_number}): {error_msg}")
+                 # return error_msg # We will log this but not return as error for now
 
             # 3. Validate against flexible phase guidelines (for character mood)
-            current_mood_lower = current_mood.lower()
-            expected_phase_category = None
-
-            for start, end, phase_name in self.phase_ranges:
-                 if start <= turn_number <= end:
-                      # For simplicity, let's assume 'initial', 'transitional', 'target emotion' phases
-                      # have associated emotional expectations.
-                      # This part needs to be refined based on specific emotional rules for each phase.
-                      # For now, we'll just check if the mood's category aligns with a simplified expectation.
-                      # Example: In 'target emotion' phase, character mood should ideally be 'positive'
-                      if phase_name == 'target emotion' and self.emotion_categories.get(current_mood_lower) != 'positive':
-                          error_msg = f"Mood '{current_mood}' ({self.emotion_categories.get(current_mood_lower, 'unknown')}) doesn't align with the '{phase_name}' phase expectation (ideally positive).";
-                          print(f"Validation Error (Turn {turn_number}): {error_msg}")
-                          # return error_msg # Log but don't strictly enforce for now
+            if errors & ERROR_PHASE_MISMATCH:
+                 phase_name = self.phase_names[min(turn_number, self.max_phase_turn)]
+                 error_msg = f"Mood '{current_mood}' ({self.categories[mood_code]}) doesn't align with the '{phase_name}' phase expectation (ideally {self.phase_expectations[phase_name]})."
+                 print(f"Validation Error (Turn {turn_number}): {error_msg}")
+                 # return error_msg # Log but don't strictly enforce for now
+
+            if errors & ERROR_STORY_PHASE:
+                 allowed = ', '.join(self.phase_emotions[story_phase])
+                 error_msg = f"Mood '{current_mood}' is not expected in the {story_phase} phase (allowed: {allowed})."
+                 print(f"Validation Error (Turn {turn_number}): {error_msg}")
+                 # return error_msg # Log but don't strictly enforce for now
 
             # 4. Validate personality scores (basic check)
-            if not isinstance(personality_scores, list) or len(personality_scores) != 6:
-                 error_msg = f"Invalid personality scores format or count."
+            if errors & ERROR_INVALID_SCORES:
+                 error_msg = f"Invalid personality scores: {personality_scores}. Expected 6 values between -5 and 5."
                  print(f"Validation Error (Turn {turn_number}): {error_msg}")
                  # return error_msg # Log but don't strictly enforce for now
-            else:
-                 for score in personality_scores:
-                     if not isinstance(score, (int, float)) or score < -5 or score > 5:
-                         error_msg = f"Invalid personality score value: {score}. Must be between -5 and 5."
-                         print(f"Validation Error (Turn {turn_number}): {error_msg}")
-                         # return error_msg # Log but don't strictly enforce for now
 
             # If no strict errors were found, return None
-            print(f"Validation for turn {turn_number} completed with no strict errors.")
             return None # Return None if validation passes (or only logs warnings)
 
         except Exception as e:
@@ -111,14 +175,66 @@ class EmotionalValidator:
             print(f"Validation Error (Turn {turn_number}): {error_msg}")
             return error_msg # Return error message in case of unexpected exceptions
 
-    # We will keep these methods but update them to work with the mood arc dictionary
-    # and potentially implement more sophisticated rules later.
+    def validate_arcs(self, mood_codes, personality_scores=None, first_turn=0, total_turns=None):
+        """Validate many arcs at once and return per-turn error flags.
+
+        mood_codes is an (n_arcs, n_turns) array from encode_arcs, with turn
+        number first_turn + column. personality_scores, if given, is an
+        (n_arcs, n_turns, 6) numeric array. total_turns, a number or one per
+        arc, assigns each turn its story phase as the live path does and
+        enables the ERROR_STORY_PHASE check. Padding turns get ERROR_NONE.
+        """
+        codes = np.asarray(mood_codes, dtype=np.int64)
+        n_arcs, n_turns = codes.shape
+        errors = np.zeros((n_arcs, n_turns), dtype=np.uint8)
+        padding = codes == PAD_CODE
+        valid = codes >= 0
+        errors[codes == INVALID_CODE] |= ERROR_INVALID_MOOD
+
+        safe_codes = np.where(valid, codes, 0)
+        if n_turns > 1:
+            both_valid = valid[:, :-1] & valid[:, 1:]
+            bad_transition = both_valid & ~self.transition_valid[safe_codes[:, :-1], safe_codes[:, 1:]]
+            errors[:, 1:] |= np.where(bad_transition, ERROR_INVALID_TRANSITION, 0).astype(np.uint8)
+
+        turns = np.arange(first_turn, first_turn + n_turns)
+        turn_rows = np.clip(turns, 0, self.max_phase_turn)
+        bad_phase = valid & ~self.phase_ok[turn_rows[np.newaxis, :], safe_codes]
+        errors |= np.where(bad_phase, ERROR_PHASE_MISMATCH, 0).astype(np.uint8)
+
+        if total_turns is not None:
+            phases = self.story_phase_indices(turns, total_turns, n_arcs)
+            bad_story_phase = valid & ~self.story_phase_table[phases, safe_codes]
+            errors |= np.where(bad_story_phase, ERROR_STORY_PHASE, 0).astype(np.uint8)
+
+        if personality_scores is not None:
+            scores = np.asarray(personality_scores, dtype=float)
+            bad_scores = (scores.shape[-1] != 6) | np.any(~np.isfinite(scores) | (scores < -5) | (scores > 5), axis=-1)
+            errors |= np.where(bad_scores & ~padding, ERROR_INVALID_SCORES, 0).astype(np.uint8)
+
+        errors[padding] = ERROR_NONE
+        return errors
+
+    def story_phase_indices(self, turns, total_turns, n_arcs=1):
+        """(n_arcs, n_turns) positions in STORY_PHASES, matching prompts.get_story_phase"""
+        totals = np.broadcast_to(np.asarray(total_turns, dtype=np.int64).reshape(-1, 1), (n_arcs, 1))
+        turns = np.asarray(turns)[np.newaxis, :]
+        return np.select([turns < totals // 3, turns < (totals * 2) // 3], [0, 1], default=2)
+
+    def _arc_codes(self, character_mood_arc):
+        turns = sorted(character_mood_arc)
+        return turns, self.encode_arcs([[character_mood_arc[turn] for turn in turns]])
 
     def validate_emotional_progression(self, character_mood_arc):
         """Validate emotional progression across the entire character arc"""
         try:
-            print(f"Validating emotional progression for arc with {len(character_mood_arc)} turns")
-            # Implement arc-level validation rules here later
+            if not character_mood_arc:
+                return None
+            turns, codes = self._arc_codes(character_mood_arc)
+            errors = self.validate_arcs(codes, first_turn=turns[0])[0]
+            bad_turns = [turns[i] for i in np.flatnonzero(errors & ERROR_INVALID_TRANSITION)]
+            if bad_turns:
+                return f"Invalid emotional transitions at turns: {', '.join(str(turn) for turn in bad_turns)}."
             return None # Return None if validation passes
         except Exception as e:
             error_msg = f"Error during emotional arc validation: {str(e)}";
@@ -128,8 +244,19 @@ class EmotionalValidator:
     def validate_character_arc(self, character_mood_arc):
         """Validate the entire character arc for overall coherence"""
         try:
-            print(f"Validating character arc coherence for {len(character_mood_arc)} turns")
-            # Implement overall arc coherence rules here later
+            if not character_mood_arc:
+                return None
+            turns, codes = self._arc_codes(character_mood_arc)
+            errors = self.validate_arcs(codes, first_turn=turns[0])[0]
+            invalid_turns = [turns[i] for i in np.flatnonzero(errors & ERROR_INVALID_MOOD)]
+            phase_turns = [turns[i] for i in np.flatnonzero(errors & ERROR_PHASE_MISMATCH)]
+            problems = []
+            if invalid_turns:
+                problems.append(f"invalid moods at turns {', '.join(str(turn) for turn in invalid_turns)}")
+            if phase_turns:
+                problems.append(f"moods missing the phase expectation at turns {', '.join(str(turn) for turn in phase_turns)}")
+            if problems:
+                return f"Character arc is not coherent: {'; '.join(problems)}."
             return None # Return None if validation passes
         except Exception as e:
             error_msg = f"Error during character arc coherence validation: {str(e)}";
@@ -139,7 +266,7 @@ class EmotionalValidator:
 # Example usage:
 if __name__ == "__main__":
     validator = EmotionalValidator()
-    
+
     # Test a single turn
     turn_valid = validator.validate_turn(
         turn_number=1,
@@ -149,9 +276,11 @@ if __name__ == "__main__":
         is_final=False
     )
     print(f"Turn valid: {turn_valid}")
-    
+
     # Test emotional progression
-    turn1 = "turn(1, joy, trust, beginning, [0,0,0,0,0,0], false)"
-    turn2 = "turn(2, anticipation, joy, middle, [1,1,0,0,0,0], false)"
     progression_valid = validator.validate_emotional_progression({1: "joy", 2: "anticipation"})
-    print(f"Progression valid: {progression_valid}") 
\ No newline at end of file
+    print(f"Progression valid: {progression_valid}")
+
+    # Validate several stored arcs at once
+    codes = validator.encode_arcs([["joy", "sadness", "neutral"], ["fear", "anger"], ["joy", "happy"]])
+    print(f"Batch errors:\n{validator.validate_arcs(codes, total_turns=10)}")
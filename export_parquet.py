@@ -0,0 +1,354 @@
+"""Incremental Parquet export of the research dataset.
+
+Copies the stories, emotional_data and mood_validations tables from the
+SQLite database or Supabase into Parquet files with typed columns: moods
+and story phases are dictionary-encoded, personality scores are fixed-size
+int8 lists in STORY_TRAITS order, timestamps are timestamps. Files are
+partitioned by date and genre:
+
+    <out>/emotional_data/date=2025-05-01/genre=fantasy/part-000000012001-0.parquet
+
+Stories written by simulate.py have simulated set; join the turn tables to
+the stories on story_id to leave them out.
+
+Each run only reads rows from a little below the last exported id of each
+table, kept in <out>/export_state.json, and adds new files next to the old
+ones. Ids are handed out before a transaction commits, so a row can become
+visible after rows with higher ids were exported; the last --overlap ids
+below the mark are read again and any row not exported yet is written then.
+The state keeps the exported ids in that window, so no row is written twice.
+
+    python export_parquet.py --source sqlite --sqlite-path woven.db
+    python export_parquet.py --source supabase --out research_export    # reads SUPABASE_URL and SUPABASE_KEY
+
+Read the export back with memory-mapped files, e.g.
+
+    from export_parquet import read_export
+    turns = read_export("research_export", "emotional_data", genre="fantasy").to_pandas()
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs
+
+from story_schema import STORY_TRAITS
+
+DEFAULT_OUT = "research_export"
+STATE_FILE = "export_state.json"
+SUPABASE_PAGE_SIZE = 1000  # PostgREST's default cap on rows per request
+DEFAULT_OVERLAP = 1000  # Ids below the mark read again for rows that committed late
+
+# Free-text moods from the models have more distinct values than int8 indices allow
+CATEGORY = pa.dictionary(pa.int16(), pa.string())
+SCORES = pa.list_(pa.int8(), len(STORY_TRAITS))
+TIMESTAMP = pa.timestamp("us")
+
+# The contact address is left out of the research dataset; it is also added
+# to the story row after it has been exported, so it would usually be empty.
+EXPORT_SCHEMAS = {
+    "stories": pa.schema([
+        ("id", pa.int64()),
+        ("name", pa.string()),
+        ("total_turns", pa.int16()),
+        ("start_time", TIMESTAMP),
+        ("simulated", pa.bool_()),
+    ]),
+    "emotional_data": pa.schema([
+        ("id", pa.int64()),
+        ("story_id", pa.int64()),
+        ("turn_number", pa.int16()),
+        ("character_mood", CATEGORY),
+        ("user_mood", CATEGORY),
+        ("story_summary", pa.string()),
+        ("question", pa.string()),
+        ("personality_scores", SCORES),
+        ("story_phase", CATEGORY),
+        ("is_final", pa.bool_()),
+        ("provider", CATEGORY),
+        ("timestamp", TIMESTAMP),
+    ]).with_metadata({"personality_traits": json.dumps(STORY_TRAITS)}),
+    "mood_validations": pa.schema([
+        ("id", pa.int64()),
+        ("story_id", pa.int64()),
+        ("arc_valid", pa.bool_()),
+        ("comments", pa.string()),
+        ("timestamp", TIMESTAMP),
+    ]),
+}
+# Column each table's date partition is taken from
+DATE_COLUMNS = {"stories": "start_time", "emotional_data": "timestamp", "mood_validations": "timestamp"}
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.date32()), ("genre", pa.string())]), flavor="hive")
+
+
+class SQLiteSource:
+    """Rows of the node-local database, opened read-only"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def read_batch(self, table, after_id, limit):
+        """Up to limit rows with ids above after_id in id order, each with its story's genre"""
+        if table == "stories":
+            query = "SELECT * FROM stories WHERE id > ? ORDER BY id LIMIT ?"
+        else:
+            query = (
+                f"SELECT t.*, s.genre AS genre FROM {table} t LEFT JOIN stories s ON s.id = t.story_id "
+                "WHERE t.id > ? ORDER BY t.id LIMIT ?"
+            )
+        cursor = self.conn.execute(query, (after_id, limit))
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def close(self):
+        self.conn.close()
+
+
+class SupabaseSource:
+    """Rows of the hosted tables, read in pages with a keyset on id"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def read_batch(self, table, after_id, limit):
+        rows = []
+        while len(rows) < limit:
+            page = (
+                self.client.table(table).select("*").gt("id", after_id).order("id")
+                .limit(min(SUPABASE_PAGE_SIZE, limit - len(rows))).execute().data
+            )
+            rows.extend(page)
+            if len(page) < SUPABASE_PAGE_SIZE:
+                break
+            after_id = page[-1]["id"]
+        if table != "stories":
+            self._add_genres(rows)
+        return rows
+
+    def _add_genres(self, rows):
+        story_ids = sorted({row["story_id"] for row in rows if row.get("story_id") is not None})
+        genres = {}
+        for start in range(0, len(story_ids), SUPABASE_PAGE_SIZE):
+            result = self.client.table("stories").select("id, genre").in_("id", story_ids[start:start + SUPABASE_PAGE_SIZE]).execute()
+            genres.update((story["id"], story["genre"]) for story in result.data)
+        for row in rows:
+            row["genre"] = genres.get(row.get("story_id"))
+
+    def close(self):
+        pass
+
+
+def parse_timestamp(value):
+    """Naive datetime for an ISO timestamp string, converting aware ones to UTC"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def score_list(value):
+    """personality_scores JSON as a list in STORY_TRAITS order, None where it cannot be read"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(value, dict):
+        return None
+    scores = []
+    for trait in STORY_TRAITS:
+        try:
+            scores.append(max(-128, min(127, int(value[trait]))))
+        except (KeyError, TypeError, ValueError):
+            scores.append(None)
+    return scores
+
+
+def _category(value):
+    return value.strip().lower() if isinstance(value, str) and value.strip() else None
+
+
+def _bool(value):
+    return None if value is None else bool(value)
+
+
+COLUMN_CONVERTERS = {
+    "character_mood": _category,
+    "user_mood": _category,
+    "story_phase": _category,
+    "provider": _category,
+    "personality_scores": score_list,
+    "is_final": _bool,
+    "arc_valid": _bool,
+    "simulated": _bool,
+    "start_time": parse_timestamp,
+    "timestamp": parse_timestamp,
+}
+
+
+def to_arrow(table, rows):
+    """Arrow table of a batch of rows with the export schema and the date and genre partition columns"""
+    schema = EXPORT_SCHEMAS[table]
+    columns = {}
+    for field in schema:
+        convert = COLUMN_CONVERTERS.get(field.name)
+        values = [row.get(field.name) for row in rows]
+        columns[field.name] = [convert(value) for value in values] if convert else values
+    columns["date"] = [timestamp.date() if timestamp else None for timestamp in columns[DATE_COLUMNS[table]]]
+    columns["genre"] = [row.get("genre") or "unknown" for row in rows]
+    return pa.Table.from_pydict(columns, schema=schema.append(pa.field("date", pa.date32())).append(pa.field("genre", pa.string())))
+
+
+class ExportState:
+    """Last exported id of each table and the ids exported within the overlap
+    window below it, saved after every written batch"""
+
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, STATE_FILE)
+        self.marks = {}
+        self.recent = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.marks = state["marks"]
+            self.recent = {table: set(ids) for table, ids in state["recent"].items()}
+
+    def mark(self, table):
+        return self.marks.get(table, 0)
+
+    def exported(self, table):
+        """Ids exported within the overlap window below the table's mark"""
+        return self.recent.get(table, set())
+
+    def advance(self, table, ids, overlap):
+        self.marks[table] = max(self.mark(table), max(ids))
+        self.recent[table] = {i for i in self.exported(table).union(ids) if i > self.marks[table] - overlap}
+        self._save()
+
+    def forget(self, table):
+        self.marks.pop(table, None)
+        self.recent.pop(table, None)
+
+    def _save(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({
+                "marks": self.marks,
+                "recent": {table: sorted(ids) for table, ids in self.recent.items()},
+            }, f, indent=2)
+        os.replace(temporary, self.path)
+
+
+def export_table(source, state, table, out_dir, batch_size=50000, overlap=DEFAULT_OVERLAP):
+    """Write every row not exported yet from overlap ids below the table's mark
+    upwards in batches, returning the number of rows written"""
+    written = 0
+    write_options = ds.ParquetFileFormat().make_write_options(compression="zstd")
+    after_id = max(0, state.mark(table) - overlap)
+    while True:
+        batch = source.read_batch(table, after_id, batch_size)
+        if not batch:
+            return written
+        after_id = batch[-1]["id"]
+        exported = state.exported(table)
+        rows = [row for row in batch if row["id"] > state.mark(table) or row["id"] not in exported]
+        if not rows:
+            if len(batch) < batch_size:
+                return written
+            continue
+        # Named after the batch's first new id, so a batch redone after a failed run replaces its own files
+        ds.write_dataset(
+            to_arrow(table, rows),
+            os.path.join(out_dir, table),
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{rows[0]['id']:012d}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_options=write_options,
+        )
+        state.advance(table, [row["id"] for row in rows], overlap)
+        written += len(rows)
+        if len(batch) < batch_size:
+            return written
+
+
+def read_export(out_dir, table, start=None, end=None, genre=None, columns=None):
+    """Exported rows of one table as an Arrow table, read from memory-mapped files.
+
+    start and end are inclusive dates; only the partitions they and genre
+    select are opened.
+    """
+    dataset = ds.dataset(
+        os.path.join(out_dir, table),
+        format="parquet",
+        partitioning=PARTITIONING,
+        filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True),
+    )
+    conditions = []
+    if start is not None:
+        conditions.append(pc.field("date") >= pa.scalar(start, pa.date32()))
+    if end is not None:
+        conditions.append(pc.field("date") <= pa.scalar(end, pa.date32()))
+    if genre is not None:
+        conditions.append(pc.field("genre") == genre)
+    condition = None
+    for expression in conditions:
+        condition = expression if condition is None else condition & expression
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def make_source(args):
+    if args.source == "sqlite":
+        return SQLiteSource(args.sqlite_path)
+    from supabase import create_client
+    return SupabaseSource(create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", choices=["sqlite", "supabase"], default="sqlite",
+                        help="supabase reads SUPABASE_URL and SUPABASE_KEY")
+    parser.add_argument("--sqlite-path", default="woven.db")
+    parser.add_argument("--out", default=DEFAULT_OUT, help="export directory")
+    parser.add_argument("--tables", nargs="+", choices=list(EXPORT_SCHEMAS), default=list(EXPORT_SCHEMAS))
+    parser.add_argument("--batch-size", type=int, default=50000, help="rows per read and per written batch")
+    parser.add_argument("--overlap", type=int, default=DEFAULT_OVERLAP,
+                        help="ids below the last exported id read again for rows that committed late")
+    parser.add_argument("--full", action="store_true", help="delete the exported tables and export everything again")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out, exist_ok=True)
+    state = ExportState(args.out)
+    if args.full:
+        for table in args.tables:
+            shutil.rmtree(os.path.join(args.out, table), ignore_errors=True)
+            state.forget(table)
+    source = make_source(args)
+    start = time.perf_counter()
+    summary = {}
+    try:
+        for table in args.tables:
+            summary[table] = {"rows": export_table(source, state, table, args.out, args.batch_size, args.overlap), "last_id": state.mark(table)}
+    finally:
+        source.close()
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+
+from aggregates import AGGREGATE_TABLE
+from storage import StorageBackend, TABLE_COLUMNS
+from story_parser import SECTION_DELIMITER
+
+# Deterministic stand-ins for the LLM providers and the database, used by
+# the benchmarks and simulations so whole stories run offline.
+
+FAKE_EMOTIONS = ["joy", "sadness", "anger", "fear", "trust", "surprise", "anticipation", "disgust", "neutral", "confusion"]
+FAKE_TRAITS = ["Risk Taker", "Optimism", "Social", "Analytical", "Fantasy Interest", "Introspective"]
+FAKE_WORDS = (
+    "the lantern flickered as she stepped across the quiet bridge and the river below carried "
+    "whispers of old songs while a stranger watched from the far bank holding a map drawn in "
+    "silver ink that seemed to move whenever the wind touched it"
+).split()
+FAKE_OPTIONS = [
+    ("follow the stranger", "stay by the river"),
+    ("open the map", "ask about the songs"),
+    ("cross the bridge", "wait for the morning"),
+    ("call out to them", "hide in the reeds"),
+]
+
+
+class FakeLLMClients:
+    """LLMClients stand-in returning well-formed responses after a set latency.
+
+    The response is derived from a hash of the prompt, so the same prompt
+    always gets the same response. latency is the time to the first chunk,
+    jitter adds up to that many seconds at random, and stream() spreads
+    chunk_latency seconds between chunks.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, chunk_size=40, chunk_latency=0.0, paragraph_words=120, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.paragraph_words = paragraph_words
+        self.seed = seed
+        self.calls = {"generate": 0, "stream": 0, "agenerate": 0, "astream": 0}
+        self._lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self.loop.run_forever, name="fake-llm-loop", daemon=True)
+        self._loop_thread.start()
+
+    def _rng(self, prompt, provider):
+        digest = hashlib.sha256(f"{self.seed}:{provider}:{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _delay(self, rng):
+        return self.latency + (rng.random() * self.jitter if self.jitter else 0.0)
+
+    def _count(self, method):
+        with self._lock:
+            self.calls[method] += 1
+
+    def response_for(self, prompt, provider="gemini", response_schema=None):
+        """The complete response this client gives for a prompt.
+
+        With a response_schema the same content comes back as a JSON object
+        in the structured-output format instead of ~~~~ sections.
+        """
+        rng = self._rng(prompt, provider)
+        final = "Write the FINAL part" in prompt
+        start = rng.randrange(len(FAKE_WORDS))
+        words = list(itertools.islice(itertools.cycle(FAKE_WORDS), start, start + self.paragraph_words))
+        paragraph = " ".join(words).capitalize() + "."
+        first, second = rng.choice(FAKE_OPTIONS)
+        question = "" if final else f"Do you {first}, or {second}?"
+        summary = " ".join(rng.sample(FAKE_WORDS, 20))
+        character_mood, user_mood = rng.choice(FAKE_EMOTIONS), rng.choice(FAKE_EMOTIONS)
+        scores = {trait: rng.randint(-5, 5) for trait in FAKE_TRAITS}
+        if response_schema is not None:
+            return json.dumps({
+                "paragraph": paragraph,
+                "question": question,
+                "summary": summary,
+                "character_mood": character_mood,
+                "user_mood": user_mood,
+                "personality_scores": {trait.lower().replace(" ", "_"): score for trait, score in scores.items()},
+            })
+        sections = [paragraph]
+        if not final:
+            sections.append(question)
+        sections += [
+            summary,
+            f"Current character mood: {character_mood}",
+            f"Current user mood: {user_mood}",
+            "\n".join(f"{trait}: {score}/5" for trait, score in scores.items()),
+        ]
+        return f"\n{SECTION_DELIMITER}\n".join(sections)
+
+    def _chunks(self, response):
+        return [response[i:i + self.chunk_size] for i in range(0, len(response), self.chunk_size)]
+
+    def generate(self, prompt, provider, system_message=None, temperature=0.7, response_schema=None):
+        self._count("generate")
+        rng = self._rng(prompt, provider)
+        time.sleep(self._delay(rng))
+        return self.response_for(prompt, provider, response_schema)
+
+    def stream(self, prompt, provider, system_message=None, temperature=0.7, response_schema=None):
+        self._count("stream")
+        rng = self._rng(prompt, provider)
+        time.sleep(self._delay(rng))
+        for chunk in self._chunks(self.response_for(prompt, provider, response_schema)):
+            yield chunk
+            if self.chunk_latency:
+                time.sleep(self.chunk_latency)
+
+    async def agenerate(self, prompt, provider, system_message=None, temperature=0.7, response_schema=None):
+        self._count("agenerate")
+        rng = self._rng(prompt, provider)
+        await asyncio.sleep(self._delay(rng))
+        return self.response_for(prompt, provider, response_schema)
+
+    async def astream(self, prompt, provider, system_message=None, temperature=0.7, response_schema=None):
+        self._count("astream")
+        rng = self._rng(prompt, provider)
+        await asyncio.sleep(self._delay(rng))
+        for chunk in self._chunks(self.response_for(prompt, provider, response_schema)):
+            yield chunk
+            if self.chunk_latency:
+                await asyncio.sleep(self.chunk_latency)
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout=timeout)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class FakeStorageBackend(StorageBackend):
+    """In-memory storage with an optional per-call latency"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.stories = {}
+        self.rows = {table: [] for table in TABLE_COLUMNS}
+        self.aggregates = {}
+        self.aggregate_turns = set()
+        self.calls = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls += 1
+
+    def create_story(self, story_meta):
+        with self._lock:
+            self._call()
+            story_id = next(self._ids)
+            self.stories[story_id] = dict(story_meta)
+            return story_id
+
+    def update_story(self, story_id, values):
+        with self._lock:
+            self._call()
+            self.stories[story_id].update(values)
+
+    def insert_rows(self, table, rows):
+        with self._lock:
+            self._call()
+            if table == AGGREGATE_TABLE:
+                # Each turn's increments are added once, like aggregate_turns in the real backends
+                for row in rows:
+                    key = (row["story_id"], row["turn_number"])
+                    if key in self.aggregate_turns:
+                        continue
+                    self.aggregate_turns.add(key)
+                    for increment in row["increments"]:
+                        self.aggregates[increment["metric"], increment["dims"]] = (
+                            self.aggregates.get((increment["metric"], increment["dims"]), 0) + increment["value"]
+                        )
+                return
+            self.rows[table].extend(dict(row) for row in rows)
+
+    def read_aggregates(self):
+        with self._lock:
+            return [{"metric": metric, "dims": dims, "value": value} for (metric, dims), value in self.aggregates.items()]
@@ -0,0 +1,175 @@
+import asyncio
+import queue
+import time
+
+from telemetry import TELEMETRY
+
+PROVIDERS = ("gemini", "openai")
+
+
+class EmptyResponseError(RuntimeError):
+    """Raised when a provider finished without producing any text"""
+
+
+class ProviderText(str):
+    """A response or stream chunk, tagged with the provider that actually produced it"""
+
+    def __new__(cls, text, provider):
+        tagged = super().__new__(cls, text)
+        tagged.provider = provider
+        return tagged
+
+
+def answered_by(text, requested_provider):
+    """Provider that produced a response or chunk; untagged text came from the one requested"""
+    return getattr(text, "provider", None) or requested_provider
+
+
+def _tag(response, provider):
+    return ProviderText(response, provider) if response else response
+
+
+class HedgedLLMClients:
+    """LLMClients wrapper that races a backup provider against a slow or failing primary.
+
+    If the primary has not produced its first chunk (stream) or its whole
+    response (generate) within the deadline, the same request is also sent
+    to the other provider and whichever answers first is used; the other
+    request is cancelled. With failover, a primary that fails or returns
+    nothing is retried on the other provider straight away. A deadline of
+    None disables hedging for that kind of call.
+
+    Responses and stream chunks are returned as ProviderText, so callers can
+    record which provider answered; see answered_by.
+
+    Counted as llm_hedges_total, llm_hedge_wins_total (by the winning
+    provider and whether it was the primary or backup) and
+    llm_failovers_total.
+    """
+
+    def __init__(self, clients, first_chunk_deadline=None, response_deadline=None, failover=True,
+                 providers=PROVIDERS, telemetry=TELEMETRY):
+        self.clients = clients
+        self.first_chunk_deadline = first_chunk_deadline
+        self.response_deadline = response_deadline
+        self.failover = failover
+        self.providers = providers
+        self.telemetry = telemetry
+
+    def __getattr__(self, name):
+        # loop, submit, run, close and anything else come from the wrapped clients
+        return getattr(self.clients, name)
+
+    def backup_for(self, provider):
+        return next((other for other in self.providers if other != provider), None)
+
+    def _record_win(self, winner, primary):
+        self.telemetry.count("llm_hedge_wins_total", provider=winner, role="primary" if winner == primary else "backup")
+
+    def _start_backup(self, primary, reason):
+        self.telemetry.count("llm_hedges_total" if reason == "hedge" else "llm_failovers_total", provider=primary)
+        print(f"Debug: {'Hedging' if reason == 'hedge' else 'Failing over'} {primary} request to {self.backup_for(primary)}")
+
+    def generate(self, prompt, provider, **kwargs):
+        if self.response_deadline is None and not self.failover:
+            return _tag(self.clients.generate(prompt, provider, **kwargs), provider)
+        return self.clients.run(self.agenerate(prompt, provider, **kwargs))
+
+    async def agenerate(self, prompt, provider, **kwargs):
+        backup = self.backup_for(provider)
+        if backup is None or (self.response_deadline is None and not self.failover):
+            return _tag(await self.clients.agenerate(prompt, provider, **kwargs), provider)
+
+        async def request(request_provider):
+            response = await self.clients.agenerate(prompt, request_provider, **kwargs)
+            if not response:
+                raise EmptyResponseError(f"Empty response from {request_provider.upper()} API")
+            return response
+
+        tasks = {asyncio.ensure_future(request(provider)): provider}
+        if self.response_deadline is not None:
+            done, _ = await asyncio.wait(tasks, timeout=self.response_deadline)
+            if not done:
+                self._start_backup(provider, "hedge")
+                tasks[asyncio.ensure_future(request(backup))] = backup
+        last_error = None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task_provider = tasks.pop(task)
+                    if task.exception() is None:
+                        self._record_win(task_provider, provider)
+                        return ProviderText(task.result(), task_provider)
+                    last_error = task.exception()
+                    print(f"Debug: {task_provider} request failed: {last_error}")
+                    if self.failover and task_provider == provider and backup not in tasks.values():
+                        self._start_backup(provider, "failover")
+                        tasks[asyncio.ensure_future(request(backup))] = backup
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stream(self, prompt, provider, **kwargs):
+        backup = self.backup_for(provider)
+        if backup is None or (self.first_chunk_deadline is None and not self.failover):
+            for chunk in self.clients.stream(prompt, provider, **kwargs):
+                yield ProviderText(chunk, provider)
+            return
+
+        # Each provider's stream runs on the clients' event loop and feeds one queue;
+        # the first provider to deliver a chunk wins and the other is cancelled
+        chunks = queue.Queue()
+
+        async def pump(request_provider):
+            try:
+                async for chunk in self.clients.astream(prompt, request_provider, **kwargs):
+                    chunks.put((request_provider, chunk, None))
+            except Exception as e:
+                chunks.put((request_provider, None, e))
+            else:
+                chunks.put((request_provider, None, None))
+
+        requests = {provider: self.clients.submit(pump(provider))}
+        deadline = None if self.first_chunk_deadline is None else time.monotonic() + self.first_chunk_deadline
+        winner = None
+        try:
+            while True:
+                timeout = None if winner or deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    source, chunk, error = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    deadline = None
+                    if backup not in requests:
+                        self._start_backup(provider, "hedge")
+                        requests[backup] = self.clients.submit(pump(backup))
+                    continue
+                if winner and source != winner:
+                    continue  # Leftovers of the cancelled request
+                if chunk is None:
+                    if winner:
+                        if error:
+                            raise error
+                        return
+                    # Failed or empty before its first chunk
+                    error = error or EmptyResponseError(f"Empty response from {source.upper()} API")
+                    print(f"Debug: {source} stream failed: {error}")
+                    requests.pop(source)
+                    if self.failover and source == provider and backup not in requests:
+                        deadline = None
+                        self._start_backup(provider, "failover")
+                        requests[backup] = self.clients.submit(pump(backup))
+                    if not requests:
+                        raise error
+                    continue
+                if winner is None:
+                    winner = source
+                    self._record_win(winner, provider)
+                    for other, request in requests.items():
+                        if other != winner:
+                            request.cancel()
+                yield ProviderText(chunk, winner)
+        finally:
+            for request in requests.values():
+                request.cancel()
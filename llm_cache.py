@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from llm_clients import GEMINI_MODEL, OPENAI_MODEL, SYSTEM_MESSAGE
+
+CACHE_MODES = ("passthrough", "record", "replay")
+PROVIDER_MODELS = {"openai": OPENAI_MODEL, "gemini": GEMINI_MODEL}
+
+
+class CacheMiss(KeyError):
+    """Raised in replay mode when a prompt has no recorded response"""
+
+
+def cache_key(provider, model, system_message, prompt, temperature, response_schema=None):
+    """Content address of one LLM request"""
+    request = [provider, model, system_message, prompt, temperature]
+    # Only structured requests include the schema, so keys recorded before it existed stay valid
+    if response_schema is not None:
+        request.append(response_schema)
+    payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseStore:
+    """Size-bounded on-disk store of responses, evicting least recently used entries.
+
+    Each response is one JSON file named by its key. File modification times
+    record the last use, so the LRU order survives restarts.
+    """
+
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # key -> [size, last used]
+        self._index = {}
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                if filename.endswith(".json"):
+                    stat = os.stat(os.path.join(root, filename))
+                    self._index[filename[:-5]] = [stat.st_size, stat.st_mtime]
+        self.total_bytes = sum(size for size, _ in self._index.values())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Return the stored response for a key, or None"""
+        with self._lock:
+            if key not in self._index:
+                return None
+            path = self._path(key)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+                now = time.time()
+                os.utime(path, (now, now))
+                self._index[key][1] = now
+            except (OSError, ValueError) as e:
+                print(f"Debug: Dropping unreadable cache entry {key}: {e}")
+                self._remove(key)
+                return None
+        return entry["response"]
+
+    def put(self, key, response, metadata=None):
+        """Store a response, evicting the least recently used entries if needed"""
+        data = json.dumps(dict(metadata or {}, response=response), ensure_ascii=False).encode("utf-8")
+        path = self._path(key)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            if key in self._index:
+                self.total_bytes -= self._index[key][0]
+            self._index[key] = [len(data), time.time()]
+            self.total_bytes += len(data)
+            self._evict()
+
+    def _remove(self, key):
+        size, _ = self._index.pop(key)
+        self.total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+            self._remove(key)
+            if self.total_bytes <= self.max_bytes:
+                break
+
+
+class CachedLLMClients:
+    """LLMClients wrapper that records and replays responses.
+
+    passthrough: every call goes to the provider and nothing is stored.
+    record: responses already stored are served, everything else is
+    fetched and stored, so a resubmitted prompt is only sent once.
+    replay: responses only come from the store; a miss raises CacheMiss.
+    """
+
+    def __init__(self, clients, store, mode="record"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode '{mode}', expected one of {', '.join(CACHE_MODES)}")
+        self.clients = clients
+        self.store = store
+        self.mode = mode
+        self.stats = {"hits": 0, "misses": 0}
+
+    def __getattr__(self, name):
+        # loop, submit, run, close and anything else come from the wrapped clients
+        return getattr(self.clients, name)
+
+    def _lookup(self, prompt, provider, system_message, temperature, response_schema=None):
+        key = cache_key(provider, PROVIDER_MODELS.get(provider), system_message, prompt, temperature, response_schema)
+        if self.mode == "passthrough":
+            return key, None
+        response = self.store.get(key)
+        if response is not None:
+            self.stats["hits"] += 1
+            return key, response
+        self.stats["misses"] += 1
+        if self.mode == "replay":
+            raise CacheMiss(f"No recorded {provider} response for this prompt ({key[:12]})")
+        return key, None
+
+    def _record(self, key, response, provider):
+        if self.mode == "record" and response:
+            self.store.put(key, response, {"provider": provider, "model": PROVIDER_MODELS.get(provider), "recorded_at": time.time()})
+
+    def generate(self, prompt, provider, system_message=SYSTEM_MESSAGE, temperature=0.7, response_schema=None):
+        key, response = self._lookup(prompt, provider, system_message, temperature, response_schema)
+        if response is not None:
+            return response
+        response = self.clients.generate(prompt, provider, system_message=system_message, temperature=temperature, response_schema=response_schema)
+        self._record(key, response, provider)
+        return response
+
+    def stream(self, prompt, provider, system_message=SYSTEM_MESSAGE, temperature=0.7, response_schema=None):
+        key, response = self._lookup(prompt, provider, system_message, temperature, response_schema)
+        if response is not None:
+            yield response
+            return
+        chunks = []
+        for chunk in self.clients.stream(prompt, provider, system_message=system_message, temperature=temperature, response_schema=response_schema):
+            chunks.append(chunk)
+            yield chunk
+        # Only complete streams are recorded
+        self._record(key, "".join(chunks), provider)
+
+    async def agenerate(self, prompt, provider, system_message=SYSTEM_MESSAGE, temperature=0.7, response_schema=None):
+        key, response = self._lookup(prompt, provider, system_message, temperature, response_schema)
+        if response is not None:
+            return response
+        response = await self.clients.agenerate(prompt, provider, system_message=system_message, temperature=temperature, response_schema=response_schema)
+        self._record(key, response, provider)
+        return response
+
+    async def astream(self, prompt, provider, system_message=SYSTEM_MESSAGE, temperature=0.7, response_schema=None):
+        key, response = self._lookup(prompt, provider, system_message, temperature, response_schema)
+        if response is not None:
+            yield response
+            return
+        chunks = []
+        async for chunk in self.clients.astream(prompt, provider, system_message=system_message, temperature=temperature, response_schema=response_schema):
+            chunks.append(chunk)
+            yield chunk
+        self._record(key, "".join(chunks), provider)
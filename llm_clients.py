@@ -0,0 +1,179 @@
+import asyncio
+import threading
+
+import google.generativeai as genai
+import httpx
+import openai
+
+from story_schema import SCHEMA_NAME, gemini_schema, openai_schema
+
+OPENAI_MODEL = "gpt-4-turbo-preview"
+GEMINI_MODEL = "gemini-2.0-flash-lite-preview"
+
+SYSTEM_MESSAGE = "You are a creative storytelling assistant that helps users write emotional stories. You MUST follow the exact output format specified in the prompt, including all sections separated by ~~~~."
+
+# OpenAI models that accept a strict JSON schema; older ones only get JSON mode
+STRICT_SCHEMA_MODELS = ("gpt-4o", "gpt-4.1", "o1", "o3", "o4")
+
+
+class LLMClients:
+    """Provider clients created once per process and shared by every session.
+
+    The OpenAI clients keep a pooled httpx connection pool (and so reuse TLS
+    sessions) and Gemini keeps its gRPC channel open. Sync callers use
+    generate/stream; async callers use agenerate/astream on the shared event
+    loop, either directly from a coroutine passed to submit() or through run().
+    """
+
+    def __init__(self, openai_api_key, gemini_api_key, max_connections=100,
+                 max_keepalive_connections=20, timeout=60.0):
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.openai = openai.OpenAI(
+            api_key=openai_api_key,
+            http_client=openai.DefaultHttpxClient(limits=limits, timeout=timeout),
+        )
+
+        # Async clients are bound to the event loop they are used on, so the
+        # process gets one long-lived loop running on a background thread
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self.loop.run_forever, name="llm-clients-loop", daemon=True)
+        self._loop_thread.start()
+        self.async_openai = openai.AsyncOpenAI(
+            api_key=openai_api_key,
+            http_client=openai.DefaultAsyncHttpxClient(limits=limits, timeout=timeout),
+        )
+
+        genai.configure(api_key=gemini_api_key)
+        self.gemini = genai.GenerativeModel(GEMINI_MODEL)
+        # Called with (provider, headers) after each OpenAI response, e.g. to track rate limit quota
+        self.header_listener = None
+        self._closed = False
+
+    def _openai_messages(self, prompt, system_message):
+        return [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _gemini_prompt(self, prompt, system_message):
+        # Gemini gets the system message as part of the prompt
+        return f"{system_message}\n\n{prompt}"
+
+    def _openai_create(self, **request):
+        raw_response = self.openai.chat.completions.with_raw_response.create(**request)
+        if self.header_listener:
+            self.header_listener("openai", raw_response.headers)
+        return raw_response.parse()
+
+    async def _async_openai_create(self, **request):
+        raw_response = await self.async_openai.chat.completions.with_raw_response.create(**request)
+        if self.header_listener:
+            self.header_listener("openai", raw_response.headers)
+        return raw_response.parse()
+
+    def _openai_format(self, response_schema):
+        """Extra request arguments asking OpenAI for JSON output"""
+        if response_schema is None:
+            return {}
+        if OPENAI_MODEL.startswith(STRICT_SCHEMA_MODELS):
+            return {"response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": SCHEMA_NAME, "schema": openai_schema(response_schema), "strict": True},
+            }}
+        return {"response_format": {"type": "json_object"}}
+
+    def _gemini_format(self, response_schema):
+        """Extra request arguments asking Gemini for JSON output"""
+        if response_schema is None:
+            return {}
+        return {"generation_config": {
+            "response_mime_type": "application/json",
+            "response_schema": gemini_schema(response_schema),
+        }}
+
+    def generate(self, prompt, provider, system_message=SYSTEM_MESSAGE, temperature=0.7, response_schema=None):
+        """Return the full completion text from the chosen provider"""
+        if provider == "openai":
+            response = self._openai_create(
+                model=OPENAI_MODEL,
+                messages=self._openai_messages(prompt, system_message),
+                temperature=temperature,
+                **self._openai_format(response_schema)
+            )
+            return response.choices[0].message.content
+        response = self.gemini.generate_content(self._gemini_prompt(prompt, system_message), **self._gemini_format(response_schema))
+        return response.text
+
+    def stream(self, prompt, provider, system_message=SYSTEM_MESSAGE, temperature=0.7, response_schema=None):
+        """Yield completion text chunks from the chosen provider as they arrive"""
+        if provider == "openai":
+            response = self._openai_create(
+                model=OPENAI_MODEL,
+                messages=self._openai_messages(prompt, system_message),
+                temperature=temperature,
+                stream=True,
+                **self._openai_format(response_schema)
+            )
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        else:
+            response = self.gemini.generate_content(self._gemini_prompt(prompt, system_message), stream=True, **self._gemini_format(response_schema))
+            for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+    async def agenerate(self, prompt, provider, system_message=SYSTEM_MESSAGE, temperature=0.7, response_schema=None):
+        """Async version of generate, to be awaited on self.loop"""
+        if provider == "openai":
+            response = await self._async_openai_create(
+                model=OPENAI_MODEL,
+                messages=self._openai_messages(prompt, system_message),
+                temperature=temperature,
+                **self._openai_format(response_schema)
+            )
+            return response.choices[0].message.content
+        response = await self.gemini.generate_content_async(self._gemini_prompt(prompt, system_message), **self._gemini_format(response_schema))
+        return response.text
+
+    async def astream(self, prompt, provider, system_message=SYSTEM_MESSAGE, temperature=0.7, response_schema=None):
+        """Async version of stream, to be iterated on self.loop"""
+        if provider == "openai":
+            response = await self._async_openai_create(
+                model=OPENAI_MODEL,
+                messages=self._openai_messages(prompt, system_message),
+                temperature=temperature,
+                stream=True,
+                **self._openai_format(response_schema)
+            )
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        else:
+            response = await self.gemini.generate_content_async(self._gemini_prompt(prompt, system_message), stream=True, **self._gemini_format(response_schema))
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+    def submit(self, coro):
+        """Schedule a coroutine on the shared loop and return a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the shared loop and wait for its result"""
+        return self.submit(coro).result(timeout=timeout)
+
+    def close(self):
+        """Close pooled connections and stop the event loop"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.run(self.async_openai.close(), timeout=5)
+        except Exception as e:
+            print(f"Debug: Error closing async OpenAI client: {e}")
+        self.openai.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
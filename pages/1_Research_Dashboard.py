@@ -0,0 +1,110 @@
+import streamlit as st
+
+from aggregates import EMOTION_LABELS, AggregateView
+
+# Cross-story research dashboard. It only reads the aggregate_counts rows
+# maintained as turns are saved, never the raw per-turn tables, so it costs
+# the same however many stories have been collected.
+
+st.set_page_config(page_title="Research Dashboard", layout="wide")
+
+app_config = st.secrets.get("app", {})
+
+@st.cache_resource
+def get_aggregate_backend():
+    """The storage backend the app writes to, as chosen by app.storage_backend"""
+    if app_config.get("storage_backend", "supabase") == "sqlite":
+        from storage import SQLiteBackend
+        return SQLiteBackend(app_config.get("sqlite_path", "woven.db"))
+    from storage import SupabaseBackend
+    from supabase import create_client
+    return SupabaseBackend(create_client(st.secrets["supabase"]["url"], st.secrets["supabase"]["key"]))
+
+@st.cache_data(ttl=app_config.get("dashboard_refresh_seconds", 30))
+def load_aggregates():
+    return get_aggregate_backend().read_aggregates()
+
+st.title("Research Dashboard")
+
+include_simulated = st.sidebar.checkbox("Include simulated stories", value=False)
+
+try:
+    view = AggregateView(load_aggregates(), include_simulated=include_simulated)
+except Exception as e:
+    st.error(f"Could not load aggregates: {str(e)}")
+    st.stop()
+
+if not view.total("turns"):
+    st.info("No stories have been saved yet.")
+    st.stop()
+
+import pandas as pd
+import plotly.graph_objects as go
+
+col1, col2, col3 = st.columns(3)
+col1.metric("Stories", f"{view.total('stories'):,.0f}")
+col2.metric("Turns", f"{view.total('turns'):,.0f}")
+col3.metric("Validation error rate", f"{view.total('validation_errors') / view.total('turns'):.1%}")
+
+# --- By genre and provider ---
+st.subheader("Stories by Genre and Provider")
+stats = pd.DataFrame(view.story_stats())
+st.dataframe(
+    stats.rename(columns={
+        "genre": "Genre",
+        "provider": "Provider",
+        "stories": "Stories",
+        "completed": "Completed",
+        "turns": "Turns",
+        "failover_turns": "Failed over turns",
+        "validation_error_rate": "Validation error rate",
+        "target_reached_rate": "Target emotion reached",
+    }),
+    hide_index=True,
+    use_container_width=True,
+    column_config={
+        "Validation error rate": st.column_config.NumberColumn(format="%.3f"),
+        "Target emotion reached": st.column_config.NumberColumn(format="%.3f"),
+    }
+)
+by_provider = stats.groupby("provider")[["turns"]].sum()
+by_provider["validation_errors"] = (stats["validation_error_rate"] * stats["turns"]).groupby(stats["provider"]).sum()
+st.markdown("**Validation error rate by provider:**")
+st.bar_chart(by_provider["validation_errors"] / by_provider["turns"])
+
+# --- Emotion transitions ---
+st.subheader("Character Mood Transitions")
+matrix = view.transition_matrix()
+row_totals = matrix.sum(axis=1, keepdims=True)
+share = pd.DataFrame(matrix / row_totals.clip(min=1), index=EMOTION_LABELS, columns=EMOTION_LABELS)
+fig = go.Figure(go.Heatmap(
+    z=share.values,
+    x=[emotion.capitalize() for emotion in EMOTION_LABELS],
+    y=[emotion.capitalize() for emotion in EMOTION_LABELS],
+    customdata=matrix,
+    colorscale="Blues",
+    hovertemplate="%{y} → %{x}<br>%{customdata:,.0f} transitions (%{z:.1%} of %{y})<extra></extra>"
+))
+fig.update_layout(xaxis_title="To", yaxis_title="From", yaxis_autorange="reversed", height=520)
+st.plotly_chart(fig, use_container_width=True)
+
+# --- Mood drift by genre ---
+st.subheader("Mood Drift by Story Phase")
+genre = st.selectbox("Genre", ["All genres"] + view.genres())
+metric = st.radio("Mood", ["Character", "User"], horizontal=True)
+distribution = view.mood_distribution(
+    "character_mood" if metric == "Character" else "user_mood",
+    None if genre == "All genres" else genre
+)
+phases = [phase for phase in ("beginning", "middle", "climax") if phase in distribution]
+drift = pd.DataFrame({phase: distribution[phase] for phase in phases}).reindex(EMOTION_LABELS).fillna(0)
+st.bar_chart(drift / drift.sum().clip(lower=1))
+
+# --- Personality score trajectories ---
+st.subheader("Mean Personality Scores by Turn")
+trajectories = view.score_trajectories()
+if trajectories:
+    scores = pd.DataFrame({
+        trait.replace("_", " ").title(): dict(points) for trait, points in trajectories.items()
+    }).sort_index()
+    st.line_chart(scores)
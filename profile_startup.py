@@ -0,0 +1,247 @@
+"""Measure the Streamlit script's cold start and rerun cost.
+
+Cold start runs the app in a fresh interpreter, so it includes every module
+import. Reruns repeat the script in the same process, the way Streamlit does
+on each widget interaction. Both use the start screen with placeholder
+secrets, so no provider is contacted.
+
+With --story-turns the app plays a story against the fake LLM backend and
+reports the size of the elements each turn's script run produces. AppTest
+always reruns the whole script, so this is the cost of a full rerun, not of
+a turn in the browser. --wire-turns instead runs a real Streamlit server,
+plays the story over its websocket the way the browser does (fragment
+reruns included) and reports the bytes the server sends for each turn.
+
+    python profile_startup.py --reruns 20
+    python profile_startup.py --story-turns 10
+    python profile_startup.py --wire-turns 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+PLACEHOLDER_SECRETS = {
+    "openai": {"api_key": "sk-placeholder"},
+    "gemini": {"api_key": "placeholder"},
+    "supabase": {"url": "https://placeholder.supabase.co", "key": "placeholder"},
+}
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "woven_app.py")
+
+HEAVY_MODULES = ["pandas", "plotly", "openai", "google.generativeai", "supabase", "httpx"]
+
+
+def element_bytes(node):
+    """Serialized size of an AppTest element tree"""
+    total = 0
+    proto = getattr(node, "proto", None)
+    if proto is not None and hasattr(proto, "ByteSize"):
+        total += proto.ByteSize()
+    for child in getattr(node, "children", {}).values():
+        total += element_bytes(child)
+    return total
+
+
+def run_story(total_turns):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file("woven_app.py", default_timeout=60)
+    for section, values in PLACEHOLDER_SECRETS.items():
+        app.secrets[section] = values
+    app.secrets["app"] = fake_app_config()
+    app.run()
+    app.text_input[0].input("Sam")
+    app.text_input[1].input("tired")
+    app.text_input[2].input("hopeful")
+    app.button[0].click().run()  # Start Your Story
+
+    turns = []
+    for turn in range(1, total_turns):
+        start = time.perf_counter()
+        app.text_input(key=f"response_{turn}").input("I follow the stranger").run()
+        turns.append({
+            "turn": turn,
+            "run_ms": round((time.perf_counter() - start) * 1000, 1),
+            "element_bytes": element_bytes(app._tree),
+            "elements": len(app.markdown),
+        })
+    return {"turns": turns, "exceptions": [str(exception.value) for exception in app.exception]}
+
+
+def fake_app_config():
+    return {
+        "llm_backend": "fake",
+        "stream_responses": False,
+        "storage_backend": "sqlite",
+        "sqlite_path": os.path.join(tempfile.mkdtemp(), "profile.db"),
+    }
+
+
+def start_server(workdir):
+    """A headless Streamlit server for the app with placeholder secrets, and its port"""
+    os.makedirs(os.path.join(workdir, ".streamlit"))
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        for section, values in dict(PLACEHOLDER_SECRETS, app=fake_app_config()).items():
+            f.write(f"[{section}]\n")
+            f.writelines(f"{key} = {json.dumps(value)}\n" for key, value in values.items())
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return server, port
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("Streamlit server did not start")
+
+
+class WireClient:
+    """Minimal browser stand-in speaking Streamlit's websocket protocol"""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.widgets = {}  # label -> (widget id, fragment id) of the latest widget with that label
+
+    async def run(self, widget_states=(), fragment_id=""):
+        """Request a script run and return (bytes, messages) received until it finishes"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        message.rerun_script.widget_states.widgets.extend(widget_states)
+        message.rerun_script.fragment_id = fragment_id
+        await self.ws.write_message(message.SerializeToString(), binary=True)
+        received = messages = 0
+        while True:
+            data = await self.ws.read_message()
+            if data is None:
+                raise RuntimeError("Server closed the websocket")
+            received += len(data)
+            messages += 1
+            forward = ForwardMsg()
+            forward.ParseFromString(data)
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                widget = getattr(element, element.WhichOneof("type"))
+                if hasattr(widget, "id") and hasattr(widget, "label") and widget.id:
+                    self.widgets[widget.label] = (widget.id, forward.delta.fragment_id)
+            elif kind == "script_finished" and forward.script_finished in (
+                ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY
+            ):
+                return received, messages
+
+    def state(self, label, **value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        return WidgetState(id=self.widgets[label][0], **value)
+
+
+async def play_wire_story(port, total_turns):
+    import tornado.websocket
+
+    ws = await tornado.websocket.websocket_connect(f"ws://127.0.0.1:{port}/_stcore/stream")
+    client = WireClient(ws)
+    start_bytes, _ = await client.run()
+    story_bytes, _ = await client.run([
+        client.state("What is your name?", string_value="Sam"),
+        client.state("How do you feel right now?", string_value="tired"),
+        client.state("What do you want to feel?", string_value="hopeful"),
+        client.state("Start Your Story", trigger_value=True),
+    ])
+    turns = []
+    for turn in range(1, total_turns):
+        widget_id, fragment_id = client.widgets["Your response"]
+        start = time.perf_counter()
+        received, messages = await client.run([client.state("Your response", string_value="I follow the stranger")], fragment_id)
+        turns.append({
+            "turn": turn,
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+            "bytes_sent": received,
+            "messages": messages,
+        })
+    ws.close()
+    return {"start_screen_bytes": start_bytes, "first_turn_bytes": story_bytes, "turns": turns}
+
+
+def run_wire_story(total_turns):
+    server, port = start_server(tempfile.mkdtemp())
+    try:
+        return asyncio.run(play_wire_story(port, total_turns))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run_app(reruns):
+    from streamlit.testing.v1 import AppTest
+
+    start = time.perf_counter()
+    app = AppTest.from_file("woven_app.py", default_timeout=60)
+    for section, values in PLACEHOLDER_SECRETS.items():
+        app.secrets[section] = values
+    app.run()
+    first_run = time.perf_counter() - start
+
+    rerun_times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        app.run()
+        rerun_times.append(time.perf_counter() - start)
+
+    return {
+        "first_run_ms": round(first_run * 1000, 1),
+        "rerun_median_ms": round(statistics.median(rerun_times) * 1000, 2) if rerun_times else None,
+        "rerun_max_ms": round(max(rerun_times) * 1000, 2) if rerun_times else None,
+        "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+        "exceptions": [str(exception.value) for exception in app.exception],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=20)
+    parser.add_argument("--story-turns", type=int, default=0, help="play a story of this many turns and report per-turn sizes")
+    parser.add_argument("--wire-turns", type=int, default=0, help="play a story through a real server and report bytes sent per turn")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.wire_turns:
+        print(json.dumps(run_wire_story(args.wire_turns), indent=2))
+        return 0
+    if args.story_turns:
+        print(json.dumps(run_story(args.story_turns), indent=2))
+        return 0
+    if args.child:
+        print(json.dumps(run_app(args.reruns)))
+        return 0
+
+    # A fresh interpreter per measurement so the cold start pays for its imports
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, __file__, "--child", "--reruns", str(args.reruns)],
+                            capture_output=True, text=True, check=True).stdout
+    process_ms = round((time.perf_counter() - start) * 1000, 1)
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = process_ms
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
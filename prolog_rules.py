@@ -0,0 +1,316 @@
+import hashlib
+import itertools
+import json
+import os
+import re
+import tempfile
+
+# Rules are read from the Prolog file once, materialised into plain tables and
+# cached on disk under the file's hash. Only the subset of Prolog the rule
+# file uses for these tables is evaluated: facts, conjunction, disjunction,
+# unification and arithmetic comparison. Rules that need other built-ins
+# (member, forall, findall) are parsed but never queried.
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "emotional_validator.pl")
+CACHE_VERSION = 1
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+|%[^\n]*)
+  | (?P<number>-?\d+(?:\.\d+)?)
+  | (?P<var>[A-Z_][A-Za-z0-9_]*)
+  | (?P<atom>[a-z][A-Za-z0-9_]*|'[^']*')
+  | (?P<op>:-|>=|=<|\\=|=|<|>)
+  | (?P<punct>[(),;\[\]|])
+  | (?P<end>\.(?=\s|$))
+""", re.VERBOSE)
+
+COMPARISONS = {
+    ">=": lambda a, b: a >= b,
+    "=<": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+}
+
+
+class PrologSyntaxError(ValueError):
+    """Raised when the rule file uses syntax the loader does not understand"""
+
+
+class Var:
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"Var({self.name})"
+
+
+def tokenize(source):
+    tokens = []
+    position = 0
+    while position < len(source):
+        match = TOKEN.match(source, position)
+        if not match:
+            raise PrologSyntaxError(f"Unexpected character {source[position]!r} at offset {position}")
+        position = match.end()
+        if match.lastgroup != "space":
+            tokens.append((match.lastgroup, match.group()))
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser for clauses; terms are atoms (str), numbers,
+    Var instances and compound terms as (functor, args) tuples"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][1] if self.position < len(self.tokens) else None
+
+    def take(self, expected=None):
+        if self.position >= len(self.tokens):
+            raise PrologSyntaxError("Unexpected end of rule file")
+        kind, value = self.tokens[self.position]
+        if expected is not None and value != expected:
+            raise PrologSyntaxError(f"Expected {expected!r}, found {value!r}")
+        self.position += 1
+        return kind, value
+
+    def clauses(self):
+        while self.position < len(self.tokens):
+            head = self.term()
+            body = None
+            if self.peek() == ":-":
+                self.take()
+                body = self.disjunction()
+            self.take(".")
+            yield head, body
+
+    def disjunction(self):
+        goal = self.conjunction()
+        while self.peek() == ";":
+            self.take()
+            goal = ("or", goal, self.conjunction())
+        return goal
+
+    def conjunction(self):
+        goal = self.comparison()
+        while self.peek() == ",":
+            self.take()
+            goal = ("and", goal, self.comparison())
+        return goal
+
+    def comparison(self):
+        if self.peek() == "(":
+            self.take()
+            goal = self.disjunction()
+            self.take(")")
+            return goal
+        left = self.term()
+        if self.peek() in ("=", "\\=", *COMPARISONS):
+            _, op = self.take()
+            return ("op", op, left, self.term())
+        return ("call", left)
+
+    def term(self):
+        kind, value = self.take()
+        if kind == "number":
+            return float(value) if "." in value else int(value)
+        if kind == "var":
+            return Var(value)
+        if kind == "atom":
+            name = value.strip("'")
+            if self.peek() == "(":
+                self.take()
+                args = [self.term()]
+                while self.peek() == ",":
+                    self.take()
+                    args.append(self.term())
+                self.take(")")
+                return (name, tuple(args))
+            return name
+        if value == "[":
+            # Lists as nested '.'(Head, Tail) terms ending in '[]'
+            items = []
+            tail = "[]"
+            while self.peek() not in ("]", "|"):
+                items.append(self.term())
+                if self.peek() == ",":
+                    self.take()
+            if self.peek() == "|":
+                self.take()
+                tail = self.term()
+            self.take("]")
+            for item in reversed(items):
+                tail = (".", (item, tail))
+            return tail
+        raise PrologSyntaxError(f"Unexpected token {value!r}")
+
+
+def _walk(term, bindings):
+    while isinstance(term, Var) and term in bindings:
+        term = bindings[term]
+    return term
+
+
+def _unify(a, b, bindings):
+    a, b = _walk(a, bindings), _walk(b, bindings)
+    if a is b:
+        return bindings
+    if isinstance(a, Var):
+        return {**bindings, a: b}
+    if isinstance(b, Var):
+        return {**bindings, b: a}
+    if isinstance(a, tuple) and isinstance(b, tuple):
+        if a[0] != b[0] or len(a[1]) != len(b[1]):
+            return None
+        for x, y in zip(a[1], b[1]):
+            bindings = _unify(x, y, bindings)
+            if bindings is None:
+                return None
+        return bindings
+    return bindings if a == b else None
+
+
+def _rename(term, mapping):
+    if isinstance(term, Var):
+        # Every anonymous variable is distinct
+        return Var("_") if term.name == "_" else mapping.setdefault(term.name, Var(term.name))
+    if isinstance(term, tuple):
+        if term[0] in ("and", "or"):
+            return (term[0], _rename(term[1], mapping), _rename(term[2], mapping))
+        if term[0] == "op":
+            return ("op", term[1], _rename(term[2], mapping), _rename(term[3], mapping))
+        if term[0] == "call":
+            return ("call", _rename(term[1], mapping))
+        return (term[0], tuple(_rename(arg, mapping) for arg in term[1]))
+    return term
+
+
+def _indicator(term):
+    return (term[0], len(term[1])) if isinstance(term, tuple) else (term, 0)
+
+
+class RuleProgram:
+    """Parsed clauses with a small resolver for ground queries"""
+
+    def __init__(self, source):
+        self.clauses = {}
+        for head, body in _Parser(tokenize(source)).clauses():
+            self.clauses.setdefault(_indicator(head), []).append((head, body))
+
+    def facts(self, name, arity):
+        """Argument tuples of every fact for a predicate"""
+        return [head[1] for head, body in self.clauses.get((name, arity), []) if body is None]
+
+    def holds(self, name, *args):
+        goal = ("call", (name, tuple(args)) if args else name)
+        return next(self._solve(goal, {}), None) is not None
+
+    def _solve(self, goal, bindings):
+        kind = goal[0]
+        if kind == "and":
+            for partial in self._solve(goal[1], bindings):
+                yield from self._solve(goal[2], partial)
+        elif kind == "or":
+            yield from self._solve(goal[1], bindings)
+            yield from self._solve(goal[2], bindings)
+        elif kind == "op":
+            _, op, left, right = goal
+            if op == "=":
+                unified = _unify(left, right, bindings)
+                if unified is not None:
+                    yield unified
+            elif op == "\\=":
+                if _unify(left, right, bindings) is None:
+                    yield bindings
+            else:
+                left, right = _walk(left, bindings), _walk(right, bindings)
+                if not isinstance(left, (int, float)) or not isinstance(right, (int, float)):
+                    raise PrologSyntaxError(f"Comparison {op} needs bound numbers")
+                if COMPARISONS[op](left, right):
+                    yield bindings
+        else:
+            term = _walk(goal[1], bindings)
+            indicator = _indicator(term)
+            if indicator not in self.clauses:
+                raise PrologSyntaxError(f"Unsupported or unknown predicate {indicator[0]}/{indicator[1]}")
+            for head, body in self.clauses[indicator]:
+                mapping = {}
+                head = _rename(head, mapping)
+                unified = _unify(head, term, bindings)
+                if unified is None:
+                    continue
+                if body is None:
+                    yield unified
+                else:
+                    yield from self._solve(_rename(body, mapping), unified)
+
+
+def compile_rules(source):
+    """Materialise the validator's tables from the rule file source"""
+    program = RuleProgram(source)
+    emotion_categories = {emotion: category for emotion, category in program.facts("emotion_category", 2)}
+    emotions = list(emotion_categories)
+    phase_progressions = {}
+    for phase, next_phase in program.facts("valid_phase_progression", 2):
+        phase_progressions.setdefault(phase, []).append(next_phase)
+    phases = list(dict.fromkeys(itertools.chain(phase_progressions, *phase_progressions.values())))
+
+    return {
+        "emotion_categories": emotion_categories,
+        "intensity_levels": {level: value for level, value in program.facts("intensity_level", 2)},
+        "valid_transitions": {
+            emotion: [to for to in emotions if program.holds("valid_transition", emotion, to)]
+            for emotion in emotions
+        },
+        "phase_progressions": phase_progressions,
+        # Phases without a clause place no constraint and are left out
+        "phase_emotions": {
+            phase: allowed for phase in phases
+            if (allowed := [emotion for emotion in emotions if program.holds("valid_emotional_progression", phase, emotion)])
+        },
+    }
+
+
+def _default_cache_path(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), ".rules_cache", os.path.basename(path) + ".json")
+
+
+_loaded = {}
+
+
+def load_rules(path=DEFAULT_RULES_PATH, cache_path=None):
+    """Compiled rule tables for a Prolog file, reused while the file's hash is unchanged"""
+    with open(path, "rb") as f:
+        source = f.read()
+    source_hash = hashlib.sha256(source).hexdigest()
+    if source_hash in _loaded:
+        return _loaded[source_hash]
+
+    cache_path = cache_path or _default_cache_path(path)
+    rules = None
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("source_hash") == source_hash and cached.get("version") == CACHE_VERSION:
+            rules = cached["rules"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if rules is None:
+        rules = compile_rules(source.decode("utf-8"))
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "source_hash": source_hash, "rules": rules}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Debug: Could not cache compiled rules at {cache_path}: {e}")
+
+    _loaded[source_hash] = rules
+    return rules
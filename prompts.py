@@ -0,0 +1,303 @@
+import hashlib
+
+from story_context import estimate_tokens, render_summary
+
+# The prompt is split into a static prefix and a per-turn suffix. Every
+# prefix is built once at import and is byte-for-byte identical between
+# turns of the same variant, so provider-side prompt caching can reuse it.
+# Anything that changes between turns or users belongs in the suffix.
+
+ALLOWED_EMOTIONS = """
+IMPORTANT - You must use ONLY these 10 emotions for character and user moods:
+1. joy (happiness, delight)
+2. sadness (grief, sorrow)
+3. anger (rage, frustration)
+4. fear (anxiety, terror)
+5. trust (confidence, faith)
+6. surprise (amazement, wonder)
+7. anticipation (expectation, hope)
+8. disgust (aversion, repulsion)
+9. neutral (balanced, calm)
+10. confusion (uncertainty, doubt)
+
+When describing moods, use ONLY these exact emotion words."""
+
+PERSONALITY_SCORES_FORMAT = """- Updated personality scores: [list each score on a new line in the format "Trait Name: X/5"]
+Example personality scores format:
+Risk Taker: 3/5
+Optimism: -2/5
+Social: 1/5
+Analytical: 4/5
+Fantasy Interest: 0/5
+Introspective: -1/5
+
+IMPORTANT: Each personality score must be on its own line and follow the exact format "Trait Name: X/5" where X is a number between -5 and 5."""
+
+FINAL_STRUCTURE = f"""Structure:
+- short paragraph
+- ~~~~
+- 20-word story summary
+- ~~~~
+- Current character mood: [MUST be one of the 10 allowed emotions]
+- ~~~~
+- Current user mood: [MUST be one of the 10 allowed emotions]
+- ~~~~
+{PERSONALITY_SCORES_FORMAT}"""
+
+TURN_STRUCTURE = f"""Structure:
+- short paragraph
+- ~~~~
+- either a situation or a question that feels natural in the conversation
+- ~~~~
+- 20-word story summary
+- ~~~~
+- Current character mood: [MUST be one of the 10 allowed emotions]
+- ~~~~
+- Current user mood: [MUST be one of the 10 allowed emotions]
+- ~~~~
+{PERSONALITY_SCORES_FORMAT}"""
+
+CLIMAX_STRUCTURE = TURN_STRUCTURE.replace(
+    "either a situation or a question that feels natural",
+    "either a situation or a personal question that feels natural"
+)
+
+FINAL_INSTRUCTIONS = """Write the FINAL part of the story:
+- Create a powerful emotional breakthrough moment that finally allows the character to fully experience their target emotion
+- This should be a specific, concrete event (not just an internal realization)
+- The event should feel like the culmination of the character's journey
+- Show how this event transforms the character's perspective
+- Tailor the nature of this breakthrough to match the character's established preferences and tendencies
+- Don't explicitly state the emotion - show it through the character's reactions, sensations, and thoughts
+- Keep it short and powerful
+- End with a sense of resolution or new beginning that feels earned
+- Use simple yet powerful words
+- Use the character's pronouns given in the story details
+- Acknowledge and build upon the user's last response in the story"""
+
+APPROACHING_CLIMAX_INSTRUCTIONS = """Write the next part of the story:
+- Set up the conditions for an emotional breakthrough in the next turn
+- Create a situation that challenges the character's current perspective
+- Use simple language for the story, simple and the kind of language that draws the user into the story.
+- Plant the seeds for a significant event that will transform how they feel
+- Don't rush the emotional change yet - build anticipation
+- Follow the fantasy guidance given in the story details
+- Add meaningful dialogue that reveals something important
+- Tailor this part to align with the character's established preferences and tendencies
+- Use the character's pronouns given in the story details
+- Acknowledge and build upon the user's last response in the story
+- End with either:
+  * A meaningful situation that forces the character to make a significant choice
+  * A deep, personal question from another character that:
+    - Is connected to the current situation
+    - Helps the main character reflect on their journey
+    - Reveals something important about their inner world
+    - Feels natural in the conversation
+    - Leads to self-discovery
+    - Moves the story toward the emotional breakthrough"""
+
+TURN_INSTRUCTIONS = """Write the next part of the story:
+- Show subtle shifts in the character's emotional state through their perceptions and actions
+- Don't explicitly mention the target emotion - create situations that move toward it indirectly
+- Use simple language for the story, simple and the kind of language that draws the user into the story.
+- Follow the fantasy guidance given in the story details
+- Include meaningful dialogue that reveals character and advances the emotional journey
+- Always act on user's prompt. Try to mirror the language they are using with the personality of the main character
+- Tailor the scene to align with the character's established preferences and tendencies
+- Use the character's pronouns given in the story details throughout the story
+- Acknowledge and build upon the user's last response in the story"""
+
+# Type of interaction to end on for each story phase
+INTERACTION_TYPES = {
+    "beginning": """- End with either:
+  * A light, engaging situation that introduces the world and characters
+  * A simple question about preferences or observations
+  * A choice between two interesting options
+  * A chance to explore the environment
+  * A casual conversation starter
+  * A small challenge or opportunity
+  * A moment of curiosity or wonder
+  * A chance to show personality through action
+  * A simple decision that reveals character
+  * A basic interaction with another character""",
+    "middle": """- End with either:
+  * A situation that challenges the character's comfort zone
+  * A meaningful choice with clear consequences
+  * A conversation that reveals more about the character
+  * A moment of connection with another character
+  * A decision that affects the story's direction
+  * A question that makes the character think
+  * A small conflict or tension
+  * A moment of growth or change
+  * A situation that tests the character's values
+  * A choice that reveals priorities""",
+    "climax": """- End with either:
+  * A significant situation that forces deep reflection
+  * A meaningful choice that reveals true character
+  * A conversation that touches on core values
+  * A moment that challenges beliefs
+  * A decision that affects relationships
+  * A question about personal growth
+  * A situation that tests resolve
+  * A moment of truth or realization
+  * A choice that defines character
+  * A question that leads to self-discovery""",
+}
+
+STORY_DETAILS_HEADER = "STORY DETAILS FOR THIS TURN:"
+
+
+# Structured-output mode: the same fields as one JSON object, matching story_schema.STORY_TURN_SCHEMA
+STRUCTURED_SCORES_FORMAT = """- "personality_scores": an object with an integer from -5 to 5 for each of "risk_taker", "optimism", "social", "analytical", "fantasy_interest" and "introspective"."""
+
+STRUCTURED_FINAL_STRUCTURE = f"""Respond with a single JSON object and nothing else, with these fields:
+- "paragraph": short paragraph
+- "question": an empty string
+- "summary": 20-word story summary
+- "character_mood": current character mood, MUST be one of the 10 allowed emotions
+- "user_mood": current user mood, MUST be one of the 10 allowed emotions
+{STRUCTURED_SCORES_FORMAT}"""
+
+STRUCTURED_TURN_STRUCTURE = f"""Respond with a single JSON object and nothing else, with these fields:
+- "paragraph": short paragraph
+- "question": either a situation or a question that feels natural in the conversation
+- "summary": 20-word story summary
+- "character_mood": current character mood, MUST be one of the 10 allowed emotions
+- "user_mood": current user mood, MUST be one of the 10 allowed emotions
+{STRUCTURED_SCORES_FORMAT}"""
+
+STRUCTURED_CLIMAX_STRUCTURE = STRUCTURED_TURN_STRUCTURE.replace(
+    "either a situation or a question that feels natural",
+    "either a situation or a personal question that feels natural"
+)
+
+
+def _compile_prefix(instructions, structure):
+    return f"{ALLOWED_EMOTIONS}\n\n{instructions}\n\n{structure}\n\n{STORY_DETAILS_HEADER}\n"
+
+
+# One static prefix per prompt variant, built once at import
+PROMPT_PREFIXES = {
+    "final": _compile_prefix(FINAL_INSTRUCTIONS, FINAL_STRUCTURE),
+    "approaching_climax": _compile_prefix(APPROACHING_CLIMAX_INSTRUCTIONS, CLIMAX_STRUCTURE),
+}
+STRUCTURED_PROMPT_PREFIXES = {
+    "final": _compile_prefix(FINAL_INSTRUCTIONS, STRUCTURED_FINAL_STRUCTURE),
+    "approaching_climax": _compile_prefix(APPROACHING_CLIMAX_INSTRUCTIONS, STRUCTURED_CLIMAX_STRUCTURE),
+}
+for _phase, _interaction_type in INTERACTION_TYPES.items():
+    PROMPT_PREFIXES[_phase] = _compile_prefix(f"{TURN_INSTRUCTIONS}\n{_interaction_type}", TURN_STRUCTURE)
+    STRUCTURED_PROMPT_PREFIXES[_phase] = _compile_prefix(f"{TURN_INSTRUCTIONS}\n{_interaction_type}", STRUCTURED_TURN_STRUCTURE)
+
+# Insight added to the prompt when a trait score reaches +3 or -3
+PERSONALIZATION_INSIGHTS = [
+    ("risk_taker", "The character is drawn to adventure and taking risks.", "The character prefers safety and careful consideration."),
+    ("optimism", "The character tends to look for hope and positivity.", "The character often notices challenges and potential problems."),
+    ("social", "The character values connection with others.", "The character appreciates solitude and independence."),
+    ("analytical", "The character approaches situations with logic and analysis.", "The character trusts their intuition and feelings."),
+    ("fantasy_interest", "The character is open to magical or fantastical elements.", "The character prefers grounded, realistic experiences."),
+    ("introspective", "The character values reflection and deeper meaning.", "The character prefers action and practical solutions."),
+]
+
+
+def get_story_phase(turn_count, total_turns):
+    """Story phase used to pick the interaction type for a turn"""
+    return "beginning" if turn_count < total_turns // 3 else "middle" if turn_count < (total_turns * 2) // 3 else "climax"
+
+
+def prompt_variant(story_state, final=False):
+    """Key of the static prefix used for this turn"""
+    if final:
+        return "final"
+    if story_state['turn_count'] >= story_state['total_turns'] - 2:
+        return "approaching_climax"
+    return get_story_phase(story_state['turn_count'], story_state['total_turns'])
+
+
+def build_story_summary(story_state):
+    """Story so far as sent in the prompt"""
+    if story_state.get('summary_context'):
+        return render_summary(story_state['summary_context'])
+    return ", ".join(story_state['summary'])
+
+
+def fantasy_guidance(variant, turn_count, use_fantasy):
+    if variant == "approaching_climax":
+        return 'Include subtle fantasy elements if they enhance the emotional journey' if use_fantasy else 'Keep the narrative grounded in human experience with a touch of wonder'
+    if turn_count == 0:
+        return 'Start with human characters in the first turn, only introducing fantasy elements if the player\'s choices suggest they want that.'
+    return 'Adjust the level of fantasy elements based on the character\'s preferences shown through their choices' if use_fantasy else 'Focus on human characters and real-world situations with authentic emotional depth.'
+
+
+def build_prompt_suffix(story_state, variant):
+    """Per-turn story details that follow the static prefix"""
+    preferences = story_state['user_preferences']
+    name = story_state['name']
+    pronouns = story_state['pronouns']
+    genre = story_state['genre']
+    current_emotion = story_state['current_emotion']
+    target_emotion = story_state['target_emotion']
+    last_user_input = story_state['last_user_input']
+
+    personalization = []
+    for trait, high_insight, low_insight in PERSONALIZATION_INSIGHTS:
+        if preferences[trait] >= 3:
+            personalization.append(high_insight)
+        elif preferences[trait] <= -3:
+            personalization.append(low_insight)
+    personalization_string = " ".join(personalization)
+
+    personality_scores = "\n".join([f"{trait.replace('_', ' ').title()}: {score}/5" for trait, score in preferences.items()])
+
+    if variant == "final":
+        journey = f"The character began feeling {current_emotion} and has been experiencing a journey toward {target_emotion}."
+    elif variant == "approaching_climax":
+        journey = f"The character began feeling {current_emotion} and is approaching a pivotal moment that will lead to experiencing {target_emotion}."
+    else:
+        journey = f"The character began feeling {current_emotion} and is on a journey that will gradually lead to feeling {target_emotion}."
+
+    character = f"Main Character is {name} ({pronouns})" if variant == "approaching_climax" else f"You are {name} ({pronouns})"
+    last_input_context = f"\nLast user response: {last_user_input}" if last_user_input else ""
+
+    suffix = f"""This is a {genre} story.
+Story so far: {build_story_summary(story_state)}
+{character}, a {story_state['age']}-year-old character.
+Pronouns: {pronouns}
+World: {genre}.
+{journey}
+Target emotion: {target_emotion}
+The user is currently feeling {story_state['user_mood']}, try to guide them towards {target_emotion}.{last_input_context}
+
+Character insights based on their choices:
+{personalization_string}
+
+Current personality scores:
+{personality_scores}
+"""
+    if variant != "final":
+        suffix += f"\nFantasy guidance: {fantasy_guidance(variant, story_state['turn_count'], preferences['fantasy_interest'] > 0)}\n"
+    return suffix
+
+
+def build_prompt_parts(story_state, final=False, structured=False):
+    """Return the (static prefix, per-turn suffix) pair for this turn"""
+    variant = prompt_variant(story_state, final)
+    prefixes = STRUCTURED_PROMPT_PREFIXES if structured else PROMPT_PREFIXES
+    return prefixes[variant], build_prompt_suffix(story_state, variant)
+
+
+def build_prompt(story_state, final=False, structured=False):
+    """Build the full prompt for this turn"""
+    prefix, suffix = build_prompt_parts(story_state, final, structured)
+    return prefix + suffix
+
+
+def prompt_report(prefix, suffix):
+    """Size of the cacheable prefix and the per-turn suffix of a prompt"""
+    return {
+        "prefix_hash": hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:12],
+        "prefix_chars": len(prefix),
+        "suffix_chars": len(suffix),
+        "prefix_tokens": estimate_tokens(prefix),
+        "suffix_tokens": estimate_tokens(suffix),
+    }
@@ -0,0 +1,335 @@
+import asyncio
+import email.utils
+import random
+import re
+import threading
+import time
+
+from story_context import estimate_tokens
+from telemetry import TELEMETRY
+
+# Process-wide admission control for LLM requests. Every session's calls to
+# a provider and model share one budget of requests and tokens per minute,
+# so at peak they queue for their share instead of each retrying 429s on
+# its own.
+
+DEFAULT_OUTPUT_TOKENS = 700     # Tokens reserved for a story turn's completion
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 1.0           # Seconds before the first retry when the provider gives no delay
+MAX_BACKOFF = 30.0
+DEFAULT_JITTER = 0.1            # Up to this fraction is added to every wait
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+# Gemini reports its delay in the error text, e.g. "retry_delay { seconds: 23 }" or "Please retry in 23.5s"
+RETRY_IN_MESSAGE = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)|retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+# Provider exception types for a rate limit or quota rejection: openai's
+# RateLimitError and google.api_core's ResourceExhausted / TooManyRequests.
+# Matched by name so neither SDK has to be imported here.
+RATE_LIMIT_ERRORS = {"RateLimitError", "ResourceExhausted", "TooManyRequests"}
+
+
+def parse_duration(value):
+    """Seconds in a provider duration such as '20ms', '1.5s' or '6m0s', or None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _headers(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None) or {}
+
+
+def is_rate_limit(error):
+    """Whether a provider error is a rate limit or quota rejection, judged by its status code or type"""
+    if getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429:
+        return True
+    return any(cls.__name__ in RATE_LIMIT_ERRORS for cls in type(error).__mro__)
+
+
+def retry_after_seconds(error):
+    """Delay the provider asked for before the next request, or None if it gave none"""
+    headers = _headers(error)
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        seconds = parse_duration(retry_after)
+        if seconds is None:
+            # HTTP date form
+            try:
+                seconds = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                seconds = None
+        if seconds is not None:
+            return max(0.0, seconds)
+    resets = [parse_duration(headers.get(name)) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [reset for reset in resets if reset is not None]
+    if resets:
+        return max(resets)
+    match = RETRY_IN_MESSAGE.search(str(error))
+    if match:
+        return float(match.group(1) or match.group(2))
+    return None
+
+
+class TokenBucket:
+    """A budget of `per_minute` units that refills continuously, holding at most one minute's worth.
+
+    Reservations may take the level below zero: each caller is told how
+    long to wait for its share, so concurrent callers are admitted in
+    arrival order instead of polling.
+    """
+
+    def __init__(self, per_minute, now):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = now
+
+    def _refill(self, now):
+        self.level = min(float(self.per_minute), self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """Take `amount` units and return the seconds until they are available"""
+        self._refill(now)
+        # A request larger than the whole bucket would never fit, it waits for a full one
+        self.level -= min(amount, self.per_minute)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount, now):
+        """Give back a reservation the provider rejected without using"""
+        self._refill(now)
+        self.level = min(float(self.per_minute), self.level + min(amount, self.per_minute))
+
+    def cap(self, remaining, now):
+        """Lower the level to what the provider says is left"""
+        self._refill(now)
+        self.level = min(self.level, float(remaining))
+
+
+class ModelRateLimit:
+    """Request and token budgets of one provider model, plus any pause the provider asked for"""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, jitter=DEFAULT_JITTER, clock=time.monotonic):
+        self.clock = clock
+        now = clock()
+        self.requests = TokenBucket(requests_per_minute, now) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, now) if tokens_per_minute else None
+        self.jitter = jitter
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Reserve one request of about `tokens` tokens; returns the seconds to wait before sending it"""
+        with self._lock:
+            now = self.clock()
+            wait = max(0.0, self.blocked_until - now)
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+        if wait and self.jitter:
+            # Spread out callers released by the same pause
+            wait += random.uniform(0, wait * self.jitter)
+        return wait
+
+    def refund(self, tokens):
+        """Return one request of `tokens` tokens reserved by reserve()"""
+        with self._lock:
+            now = self.clock()
+            if self.requests:
+                self.requests.refund(1, now)
+            if self.tokens:
+                self.tokens.refund(tokens, now)
+
+    def block(self, seconds):
+        """Hold back every request to this model for `seconds`"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+
+    def observe_headers(self, headers):
+        """Adopt the limits and remaining quota reported in a provider's response headers"""
+        with self._lock:
+            now = self.clock()
+            for kind in ("requests", "tokens"):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                bucket = getattr(self, kind)
+                if bucket is None and limit and limit.isdigit():
+                    # Learn the budget from the provider when none is configured
+                    bucket = TokenBucket(int(limit), now)
+                    setattr(self, kind, bucket)
+                if bucket is None or not remaining or not remaining.isdigit():
+                    continue
+                bucket.cap(int(remaining), now)
+                if int(remaining) == 0:
+                    reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    if reset:
+                        self.blocked_until = max(self.blocked_until, now + reset)
+
+
+class RateLimiter:
+    """Process-wide ModelRateLimit per (provider, model).
+
+    limits maps a provider, or "provider:model", to its requests_per_minute
+    and tokens_per_minute. Models without configured limits still honour
+    the provider's Retry-After and quota headers.
+    """
+
+    def __init__(self, limits=None, jitter=DEFAULT_JITTER, output_tokens=DEFAULT_OUTPUT_TOKENS):
+        self.limits = dict(limits or {})
+        self.jitter = jitter
+        self.output_tokens = output_tokens
+        self.models = {}
+        self._lock = threading.Lock()
+
+    def limit_for(self, provider, model=None):
+        key = (provider, model)
+        with self._lock:
+            limit = self.models.get(key)
+            if limit is None:
+                config = self.limits.get(f"{provider}:{model}") or self.limits.get(provider) or {}
+                limit = self.models[key] = ModelRateLimit(
+                    requests_per_minute=config.get("requests_per_minute"),
+                    tokens_per_minute=config.get("tokens_per_minute"),
+                    jitter=self.jitter
+                )
+        return limit
+
+    def request_tokens(self, prompt, system_message=None):
+        """Tokens reserved for a request: the prompt plus the expected completion"""
+        return estimate_tokens(prompt) + estimate_tokens(system_message or "") + self.output_tokens
+
+
+class RateLimitedLLMClients:
+    """LLMClients wrapper that admits every call through a shared RateLimiter.
+
+    Calls wait for their share of the model's budget before they are sent,
+    and rate-limited calls are retried after the delay the provider asked
+    for (or an exponential backoff), pausing every other caller of that
+    model too. Queue wait is reported as llm_queue_wait, separately from
+    the provider time in llm_request.
+    """
+
+    def __init__(self, clients, limiter, models=None, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff=DEFAULT_BACKOFF, telemetry=TELEMETRY):
+        self.clients = clients
+        self.limiter = limiter
+        self.models = models or {}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.telemetry = telemetry
+        if hasattr(clients, "header_listener"):
+            clients.header_listener = self._observe_headers
+
+    def __getattr__(self, name):
+        # loop, submit, run, close and anything else come from the wrapped clients
+        return getattr(self.clients, name)
+
+    def _observe_headers(self, provider, headers):
+        self.limiter.limit_for(provider, self.models.get(provider)).observe_headers(headers)
+
+    def _reserve(self, prompt, provider, kwargs):
+        limit = self.limiter.limit_for(provider, self.models.get(provider))
+        tokens = self.limiter.request_tokens(prompt, kwargs.get("system_message"))
+        return limit, tokens, limit.reserve(tokens)
+
+    def _record_wait(self, provider, wait):
+        self.telemetry.observe("llm_queue_wait", wait, {"provider": provider})
+
+    def _retry_delay(self, limit, tokens, provider, error, attempt):
+        """Pause the model after a rate limit; re-raises errors that should not be retried"""
+        if not is_rate_limit(error):
+            raise error
+        # A rejected call used none of its budget, so the retry reserves it afresh
+        limit.refund(tokens)
+        if attempt >= self.max_retries:
+            raise error
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = min(MAX_BACKOFF, self.backoff * (2 ** attempt))
+        self.telemetry.count("llm_retries_total", provider=provider)
+        print(f"Debug: {provider} rate limited, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+        limit.block(delay)
+
+    def generate(self, prompt, provider, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            limit, tokens, wait = self._reserve(prompt, provider, kwargs)
+            self._record_wait(provider, wait)
+            if wait:
+                time.sleep(wait)
+            try:
+                with self.telemetry.span("llm_request", provider=provider):
+                    return self.clients.generate(prompt, provider, **kwargs)
+            except Exception as e:
+                self._retry_delay(limit, tokens, provider, e, attempt)
+
+    def stream(self, prompt, provider, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            limit, tokens, wait = self._reserve(prompt, provider, kwargs)
+            self._record_wait(provider, wait)
+            if wait:
+                time.sleep(wait)
+            started = False
+            request_start = time.perf_counter()
+            try:
+                for chunk in self.clients.stream(prompt, provider, **kwargs):
+                    if not started:
+                        started = True
+                        self.telemetry.observe("llm_first_chunk", time.perf_counter() - request_start, {"provider": provider})
+                    yield chunk
+                return
+            except Exception as e:
+                # Text already shown cannot be taken back, so only failures before the first chunk are retried
+                if started:
+                    raise
+                self._retry_delay(limit, tokens, provider, e, attempt)
+
+    async def agenerate(self, prompt, provider, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            limit, tokens, wait = self._reserve(prompt, provider, kwargs)
+            self._record_wait(provider, wait)
+            if wait:
+                await asyncio.sleep(wait)
+            request_start = time.perf_counter()
+            try:
+                response = await self.clients.agenerate(prompt, provider, **kwargs)
+            except Exception as e:
+                self._retry_delay(limit, tokens, provider, e, attempt)
+                continue
+            self.telemetry.observe("llm_request", time.perf_counter() - request_start, {"provider": provider})
+            return response
+
+    async def astream(self, prompt, provider, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            limit, tokens, wait = self._reserve(prompt, provider, kwargs)
+            self._record_wait(provider, wait)
+            if wait:
+                await asyncio.sleep(wait)
+            started = False
+            request_start = time.perf_counter()
+            try:
+                async for chunk in self.clients.astream(prompt, provider, **kwargs):
+                    if not started:
+                        started = True
+                        self.telemetry.observe("llm_first_chunk", time.perf_counter() - request_start, {"provider": provider})
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                self._retry_delay(limit, tokens, provider, e, attempt)
@@ -0,0 +1,319 @@
+"""Headless story simulator for research datasets.
+
+Plays complete stories for every combination of genre, emotion pair and
+persona without the Streamlit UI. Stories are split across a pool of
+worker processes; each worker plays many stories at once on one event loop
+with async LLM calls. Finished stories are written to storage in batches
+by the parent process.
+
+    python simulate.py --stories 1000 --workers 8                       # offline, fake LLM
+    python simulate.py --llm live --stories 50 --concurrency 4 --rpm 200
+    python simulate.py --responses model --storage sqlite --sqlite-path sim.db
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import os
+import re
+import sys
+import time
+
+from aggregates import AGGREGATE_TABLE, turn_increments, turn_row
+from emotional_validator import EmotionalValidator
+from fake_backends import FakeLLMClients
+from speculation import extract_options
+from story_engine import StoryEngine, emotional_data_row, new_story_state
+from telemetry import Telemetry
+from ui_assets import GENRE_BACKGROUNDS
+
+DEFAULT_EMOTION_PAIRS = ["sadness:joy", "fear:trust", "anger:joy", "confusion:anticipation", "disgust:trust"]
+
+PERSONAS = [
+    {
+        "name": "Ava", "pronouns": "she/her", "age": 19,
+        "description": "an adventurous student who acts first and thinks later",
+        "replies": ["I take the risk and explore the unknown path", "Let's go for it, whatever happens"],
+    },
+    {
+        "name": "Jun", "pronouns": "he/him", "age": 42,
+        "description": "a careful engineer who wants to understand how things work",
+        "replies": ["I want to understand what is happening here first", "I study the details before deciding"],
+    },
+    {
+        "name": "Rowan", "pronouns": "they/them", "age": 31,
+        "description": "a warm, sociable person who cares about the people around them",
+        "replies": ["Let's go together and help them", "I ask the others how they feel"],
+    },
+    {
+        "name": "Mira", "pronouns": "she/they", "age": 57,
+        "description": "a quiet, reflective reader drawn to meaning and memory",
+        "replies": ["I stay quiet and think about what this means to me", "I remember something from long ago"],
+    },
+]
+
+USER_REPLY_SYSTEM_MESSAGE = (
+    "You are role-playing the reader of an interactive story. Reply to the story's question in one or "
+    "two short sentences, in the first person, the way the reader described would."
+)
+FIRST_SENTENCE = re.compile(r"^(.+?[.!?])(?:\s|$)")
+
+
+def story_specs(args):
+    """One story description per simulated story, cycling through every combination"""
+    genres = args.genres or list(GENRE_BACKGROUNDS)
+    pairs = [pair.split(":", 1) for pair in args.emotion_pairs]
+    combinations = itertools.cycle(itertools.product(genres, pairs, range(len(PERSONAS))))
+    specs = []
+    for index, (genre, (current_emotion, target_emotion), persona_index) in zip(range(args.stories), combinations):
+        persona = PERSONAS[persona_index]
+        specs.append({
+            "index": index,
+            "persona": persona_index,
+            "details": {
+                "name": persona["name"],
+                "pronouns": persona["pronouns"],
+                "age": persona["age"],
+                "genre": genre,
+                "current_emotion": current_emotion,
+                "target_emotion": target_emotion,
+                "total_turns": args.turns,
+                "model_choice": args.provider,
+                "started": True,
+                "simulated": True,
+            },
+        })
+    return specs
+
+
+def scripted_reply(persona, question, turn):
+    """Deterministic reply: one of the question's options when it offers any, else a persona reply"""
+    options = extract_options(question)
+    if options:
+        return options[turn % len(options)]
+    return persona["replies"][turn % len(persona["replies"])]
+
+
+def reply_prompt(persona, paragraph, question):
+    return (
+        f"The reader is {persona['name']} ({persona['pronouns']}), {persona['age']} years old, {persona['description']}.\n\n"
+        f"Story so far:\n{paragraph}\n\nQuestion: {question}\n\nThe reader's reply:"
+    )
+
+
+async def model_reply(llm_clients, settings, persona, turn_data):
+    """Reply written by the LLM in the persona's voice"""
+    response = await llm_clients.agenerate(
+        reply_prompt(persona, turn_data["paragraph"], turn_data["question"]),
+        settings["user_provider"],
+        system_message=USER_REPLY_SYSTEM_MESSAGE
+    )
+    reply = " ".join((response or "").split())[:300]
+    match = FIRST_SENTENCE.match(reply)
+    # Story-shaped text from the fake backend is cut down to its first sentence
+    if settings["llm"] == "fake" and match:
+        reply = match.group(1)
+    return reply or scripted_reply(persona, turn_data["question"], turn_data["turn_number"])
+
+
+async def play_story(engine, settings, spec):
+    """Play one story and return its rows and stats"""
+    persona = PERSONAS[spec["persona"]]
+    story_state = new_story_state(**spec["details"])
+    rows = []
+    aggregates = {}
+
+    def persist(_story_state, turn_data):
+        rows.append(emotional_data_row(turn_data, story_state["model_choice"]))
+        aggregates[turn_data["turn_number"]] = turn_increments(story_state, turn_data)
+
+    validation_errors = 0
+    turn_data = None
+    while story_state["turn_count"] < story_state["total_turns"] and not story_state.get("completed"):
+        turn = story_state["turn_count"]
+        if turn_data is not None:
+            if settings["responses"] == "model":
+                reply = await model_reply(engine.llm_clients, settings, persona, turn_data)
+            else:
+                reply = scripted_reply(persona, turn_data["question"], turn)
+            engine.respond(story_state, reply)
+        turn_data = await engine.aplay_turn(story_state, final=turn == story_state["total_turns"] - 1, persist=persist)
+        if turn_data is None:
+            return {"spec": spec, "rows": rows, "error": f"Turn {turn} produced no response"}
+        validation_errors += bool(turn_data["validation_error"])
+    return {"spec": spec, "rows": rows, "aggregates": aggregates, "validation_errors": validation_errors, "error": None}
+
+
+def make_llm_clients(settings):
+    if settings["llm"] == "fake":
+        return FakeLLMClients(latency=settings["fake_latency"], jitter=settings["fake_jitter"], seed=settings["seed"])
+    from llm_cache import PROVIDER_MODELS
+    from llm_clients import LLMClients
+    from rate_limit import RateLimitedLLMClients, RateLimiter
+
+    clients = LLMClients(openai_api_key=os.environ["OPENAI_API_KEY"], gemini_api_key=os.environ["GEMINI_API_KEY"])
+    # Each worker gets an equal share of the requests per minute
+    limits = {}
+    if settings["rpm"]:
+        per_worker = max(1, settings["rpm"] // settings["workers"])
+        limits = {provider: {"requests_per_minute": per_worker} for provider in PROVIDER_MODELS}
+    return RateLimitedLLMClients(clients, RateLimiter(limits), models=PROVIDER_MODELS)
+
+
+def run_worker(settings, specs):
+    """Play a share of the stories in this process, up to settings["concurrency"] at once"""
+    llm_clients = make_llm_clients(settings)
+    telemetry = Telemetry()
+    engine = StoryEngine(llm_clients, validator=EmotionalValidator(), telemetry=telemetry,
+                         structured=settings["structured"])
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(settings["concurrency"])
+
+        async def run_one(spec):
+            async with semaphore:
+                try:
+                    return await play_story(engine, settings, spec)
+                except Exception as e:
+                    return {"spec": spec, "rows": [], "error": f"{type(e).__name__}: {e}"}
+
+        return await asyncio.gather(*(run_one(spec) for spec in specs))
+
+    try:
+        # The validator and parser print debug lines on every turn
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if settings["verbose"] else devnull):
+            results = llm_clients.run(run_all())
+    finally:
+        llm_clients.close()
+    return results, telemetry.summary()
+
+
+def make_storage(args):
+    if args.storage == "none":
+        return None
+    if args.storage == "sqlite":
+        from storage import SQLiteBackend
+        return SQLiteBackend(args.sqlite_path)
+    from storage import SupabaseBackend
+    from supabase import create_client
+    return SupabaseBackend(create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"]))
+
+
+class BatchWriter:
+    """Creates each finished story and writes its turns in batches of batch_size rows.
+
+    The turns' aggregate increments are added to the stored aggregates with
+    each batch, keyed by story id and turn number like the app's.
+    """
+
+    def __init__(self, backend, batch_size=500):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.pending = []
+        self.aggregates = []
+        self.rows_written = 0
+
+    def add_story(self, result):
+        details = result["spec"]["details"]
+        story_id = self.backend.create_story({
+            "name": details["name"],
+            "genre": details["genre"],
+            "total_turns": details["total_turns"],
+            "start_time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "simulated": True,
+        })
+        self.pending.extend(dict(row, story_id=story_id) for row in result["rows"])
+        self.aggregates.extend(
+            turn_row(story_id, turn_number, increments) for turn_number, increments in result["aggregates"].items()
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.backend.insert_rows("emotional_data", self.pending)
+            self.rows_written += len(self.pending)
+            self.pending = []
+        if self.aggregates:
+            self.backend.insert_rows(AGGREGATE_TABLE, self.aggregates)
+            self.aggregates = []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=10, help="turns per story")
+    parser.add_argument("--genres", nargs="+", choices=sorted(GENRE_BACKGROUNDS), help="default: every genre")
+    parser.add_argument("--emotion-pairs", nargs="+", default=DEFAULT_EMOTION_PAIRS, help="current:target pairs")
+    parser.add_argument("--provider", choices=["gemini", "openai"], default="gemini", help="story model")
+    parser.add_argument("--llm", choices=["fake", "live"], default="fake", help="live reads OPENAI_API_KEY and GEMINI_API_KEY")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="fake LLM seconds per call")
+    parser.add_argument("--fake-jitter", type=float, default=0.0)
+    parser.add_argument("--responses", choices=["scripted", "model"], default="scripted", help="how the simulated reader replies")
+    parser.add_argument("--user-provider", choices=["gemini", "openai"], default="gemini", help="model writing the reader's replies")
+    parser.add_argument("--structured", action="store_true", help="use the structured JSON output mode")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--concurrency", type=int, default=32, help="stories in flight per worker")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute per provider across all workers (live only)")
+    parser.add_argument("--storage", choices=["none", "sqlite", "supabase"], default="none",
+                        help="supabase reads SUPABASE_URL and SUPABASE_KEY")
+    parser.add_argument("--sqlite-path", default="simulation.db")
+    parser.add_argument("--batch-size", type=int, default=500, help="emotional_data rows per insert")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="write the summary as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the engine's debug output")
+    args = parser.parse_args(argv)
+
+    for pair in args.emotion_pairs:
+        if ":" not in pair:
+            parser.error(f"Emotion pair '{pair}' must look like current:target")
+    specs = story_specs(args)
+    workers = max(1, min(args.workers, len(specs)))
+    settings = dict(vars(args), workers=workers)
+    writer = BatchWriter(make_storage(args), args.batch_size) if args.storage != "none" else None
+
+    # Interleaved shares, so every worker gets a mix of genres and personas
+    shares = [specs[worker::workers] for worker in range(workers)]
+    start = time.perf_counter()
+    results, stage_summaries = [], []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_worker, settings, share) for share in shares if share]
+        for future in concurrent.futures.as_completed(futures):
+            worker_results, stages = future.result()
+            stage_summaries.append(stages)
+            for result in worker_results:
+                results.append(result)
+                if writer and not result["error"]:
+                    writer.add_story(result)
+    if writer:
+        writer.flush()
+        writer.backend.close()
+    elapsed = time.perf_counter() - start
+
+    completed = [result for result in results if not result["error"]]
+    turns = sum(len(result["rows"]) for result in results)
+    summary = {
+        "stories": len(completed),
+        "failed": len(results) - len(completed),
+        "turns": turns,
+        "seconds": round(elapsed, 2),
+        "stories_per_minute": round(len(completed) / elapsed * 60, 1) if elapsed else None,
+        "turns_per_second": round(turns / elapsed, 1) if elapsed else None,
+        "validation_error_rate": round(sum(result["validation_errors"] for result in completed) / turns, 3) if turns else None,
+        "workers": workers,
+        "rows_written": writer.rows_written if writer else 0,
+    }
+    print(json.dumps(summary, indent=2))
+    for result in results:
+        if result["error"]:
+            print(f"Story {result['spec']['index']} failed: {result['error']}", file=sys.stderr)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "settings": settings, "stages": stage_summaries}, f, indent=2)
+    return 1 if len(completed) < len(results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
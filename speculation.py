@@ -0,0 +1,156 @@
+import concurrent.futures
+import difflib
+import re
+import threading
+
+# Leading words that turn an option into a question, e.g. "Do you open the door"
+QUESTION_LEADS = re.compile(
+    r"^(?:and\s+|so\s+)?(?:do|does|did|will|would|should|could|can|shall|must)\s+(?:you|they|he|she|we|i)\s+|"
+    r"^(?:would\s+you\s+rather|are\s+you\s+going\s+to|is\s+it\s+better\s+to)\s+",
+    re.IGNORECASE
+)
+LIST_ITEM = re.compile(r"^\s*(?:[-*•]|\d+[.)]|[a-z][.)])\s+(.+)$", re.IGNORECASE)
+WORD = re.compile(r"[a-z0-9']+")
+
+
+def _clean_option(option):
+    option = QUESTION_LEADS.sub("", option.strip().strip("\"'“”")).strip(" ,.?!:;")
+    return option
+
+
+def extract_options(question, max_options=2):
+    """Find the explicit options a story question offers, most explicit first"""
+    if not question:
+        return []
+    options = []
+
+    # Options listed one per line
+    for line in question.splitlines():
+        match = LIST_ITEM.match(line)
+        if match:
+            options.append(_clean_option(match.group(1)))
+
+    # "Do you X, Y, or Z?" in the last question sentence
+    if not options:
+        sentences = [sentence for sentence in re.split(r"(?<=[.!?])\s+", question.strip()) if sentence.endswith("?")]
+        if sentences:
+            last_question = sentences[-1].rstrip("?")
+            # Drop a lead-in clause such as "As the storm grows, ..."
+            if ":" in last_question:
+                last_question = last_question.rsplit(":", 1)[1]
+            parts = re.split(r",?\s+or\s+|,\s+", last_question)
+            if len(parts) > 1:
+                options.extend(_clean_option(part) for part in parts)
+
+    unique_options = []
+    for option in options:
+        if option and option.lower() not in [existing.lower() for existing in unique_options]:
+            unique_options.append(option)
+    return unique_options[:max_options]
+
+
+def normalize_response(text):
+    return " ".join(WORD.findall(text.lower()))
+
+
+def response_similarity(response, option):
+    """How close a typed response is to a speculated option, from 0 to 1"""
+    response = normalize_response(response)
+    option = normalize_response(option)
+    if not response or not option:
+        return 0.0
+    if response == option:
+        return 1.0
+    # Short replies that contain the whole option, e.g. "I open the door slowly"
+    if f" {option} " in f" {response} " and len(response.split()) <= len(option.split()) + 3:
+        return 0.9
+    ratio = difflib.SequenceMatcher(None, response, option).ratio()
+    response_words = set(response.split())
+    option_words = set(option.split())
+    overlap = len(response_words & option_words) / len(response_words | option_words)
+    return max(ratio, overlap)
+
+
+class SpeculationBudget:
+    """Process-wide cap on speculative generations running at the same time"""
+
+    def __init__(self, max_in_flight=20):
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+
+    def try_acquire(self):
+        return self._semaphore.acquire(blocking=False)
+
+    def release(self):
+        self._semaphore.release()
+
+
+class SpeculativeTurns:
+    """Background continuations of the next turn for one session.
+
+    While the user reads a question, the next turn is generated for each
+    explicit option it offers. If the user's reply is close enough to one of
+    them, that continuation is served instead of starting a new call; every
+    other branch is cancelled.
+    """
+
+    def __init__(self, llm_clients, budget, max_branches=2, match_threshold=0.8):
+        self.llm_clients = llm_clients
+        self.budget = budget
+        self.max_branches = max_branches
+        self.match_threshold = match_threshold
+        self.turn = None
+        self.branches = {}
+        self.stats = {"started": 0, "hits": 0, "misses": 0, "discarded": 0, "skipped_budget": 0}
+
+    def start(self, turn, branch_prompts, provider, **request_options):
+        """Start generating the next turn for each (option, prompt) pair.
+
+        request_options are passed on to agenerate, e.g. a response schema.
+        """
+        self.discard()
+        self.turn = turn
+        for option, prompt in branch_prompts[:self.max_branches]:
+            if not self.budget.try_acquire():
+                self.stats["skipped_budget"] += 1
+                continue
+            future = self.llm_clients.submit(self.llm_clients.agenerate(prompt, provider, **request_options))
+            future.add_done_callback(lambda _future: self.budget.release())
+            self.branches[option] = future
+            self.stats["started"] += 1
+
+    def match(self, response):
+        """Option closest to the response, if it is close enough"""
+        best_option, best_score = None, 0.0
+        for option in self.branches:
+            score = response_similarity(response, option)
+            if score > best_score:
+                best_option, best_score = option, score
+        return best_option if best_score >= self.match_threshold else None
+
+    def take(self, turn, response, timeout=None):
+        """Return the speculated raw response for this reply, or None on a miss"""
+        if turn != self.turn or not self.branches:
+            return None
+        option = self.match(response)
+        future = self.branches.pop(option, None) if option else None
+        self.discard()
+        if future is None:
+            self.stats["misses"] += 1
+            return None
+        try:
+            raw_response = future.result(timeout=timeout)
+        except (Exception, concurrent.futures.CancelledError) as e:
+            print(f"Debug: Speculative turn for '{option}' failed: {e}")
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        print(f"Debug: Serving speculative turn for option '{option}'")
+        return raw_response
+
+    def discard(self):
+        """Cancel every unused branch"""
+        for future in self.branches.values():
+            future.cancel()
+        self.stats["discarded"] += len(self.branches)
+        self.branches = {}
+        self.turn = None
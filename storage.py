@@ -0,0 +1,478 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+from aggregates import AGGREGATE_TABLE, merge_rows, turn_increments, turn_row, unique_turn_rows
+
+# Columns written by the app for each table, in insert order
+# simulated marks stories written by simulate.py, so research queries can leave them out
+STORY_COLUMNS = ["name", "genre", "total_turns", "start_time", "research_email", "simulated"]
+TABLE_COLUMNS = {
+    "emotional_data": [
+        "story_id", "turn_number", "character_mood", "user_mood", "story_summary", "question",
+        "personality_scores", "story_phase", "is_final", "provider", "timestamp"
+    ],
+    "mood_validations": ["story_id", "arc_valid", "comments", "timestamp"],
+    # The other provider's response to the same prompt, in comparison mode
+    "model_comparisons": [
+        "story_id", "turn_number", "primary_provider", "primary_latency_ms", "shadow_provider", "shadow_latency_ms",
+        "shadow_paragraph", "shadow_question", "shadow_character_mood", "shadow_user_mood",
+        "shadow_personality_scores", "shadow_error", "timestamp"
+    ],
+}
+
+
+def simulated_column(simulated):
+    """The stories' simulated value, left out for readers' stories so databases
+    without the SUPABASE_SIMULATED_SQL column still accept them"""
+    return {"simulated": True} if simulated else {}
+
+
+class StorageBackend:
+    """Interface for the stories table and the per-story tables in TABLE_COLUMNS"""
+
+    def create_story(self, story_meta):
+        """Insert a story row and return its id"""
+        raise NotImplementedError
+
+    def update_story(self, story_id, values):
+        """Update columns of an existing story row"""
+        raise NotImplementedError
+
+    def insert_rows(self, table, rows):
+        """Insert a batch of rows into one of the TABLE_COLUMNS tables, or apply turn rows to aggregate_counts.
+
+        Turn rows whose (story_id, turn_number) was applied before are
+        ignored, so a retried aggregate write never counts a turn twice.
+        """
+        raise NotImplementedError
+
+    def read_aggregates(self):
+        """Every aggregate_counts row"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# PostgREST error code for a call to a function that does not exist
+MISSING_FUNCTION = "PGRST202"
+
+
+class SupabaseBackend(StorageBackend):
+    """Hosted storage through the Supabase REST API"""
+
+    def __init__(self, client):
+        self.client = client
+        self.aggregates_enabled = True  # Turned off if SUPABASE_AGGREGATES_SQL has not been run
+
+    def create_story(self, story_meta):
+        result = self.client.table('stories').insert(story_meta).execute()
+        if not result.data:
+            return None
+        return result.data[0]['id']
+
+    def update_story(self, story_id, values):
+        self.client.table('stories').update(values, returning="minimal").eq("id", story_id).execute()
+
+    def insert_rows(self, table, rows):
+        if table == AGGREGATE_TABLE:
+            if not self.aggregates_enabled:
+                return
+            try:
+                # Added to the stored counts in one call of the SUPABASE_AGGREGATES_SQL function
+                self.client.rpc("add_turn_aggregates", {"turns": unique_turn_rows(rows)}).execute()
+            except Exception as e:
+                # Retrying cannot create the function, and would hold up the turns queued behind these rows
+                if getattr(e, "code", None) != MISSING_FUNCTION:
+                    raise
+                self.aggregates_enabled = False
+                print("Debug: add_turn_aggregates does not exist, aggregates are not saved until SUPABASE_AGGREGATES_SQL is run")
+            return
+        # Rows leave out optional columns they have no value for, and one insert needs the same columns in every row
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            # Nothing is read back, so skip returning the inserted rows
+            self.client.table(table).insert(group, returning="minimal").execute()
+
+    def read_aggregates(self):
+        return self.client.table(AGGREGATE_TABLE).select("metric, dims, value").execute().data
+
+
+# Run once in the Supabase SQL editor to store the cross-story aggregates.
+# aggregate_turns records the turns already added, and the function only adds
+# the increments of turns it could insert there, in the same transaction.
+SUPABASE_AGGREGATES_SQL = """
+CREATE TABLE IF NOT EXISTS aggregate_counts (
+    metric TEXT NOT NULL,
+    dims TEXT NOT NULL,
+    value DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, dims)
+);
+CREATE TABLE IF NOT EXISTS aggregate_turns (
+    story_id BIGINT NOT NULL,
+    turn_number INTEGER NOT NULL,
+    PRIMARY KEY (story_id, turn_number)
+);
+DROP FUNCTION IF EXISTS add_aggregate_counts(JSONB);
+CREATE OR REPLACE FUNCTION add_turn_aggregates(turns JSONB) RETURNS VOID AS $$
+    WITH applied AS (
+        INSERT INTO aggregate_turns (story_id, turn_number)
+        SELECT (turn->>'story_id')::BIGINT, (turn->>'turn_number')::INTEGER
+        FROM jsonb_array_elements(turns) AS turn
+        ON CONFLICT DO NOTHING
+        RETURNING story_id, turn_number
+    )
+    INSERT INTO aggregate_counts (metric, dims, value)
+    SELECT item->>'metric', item->>'dims', SUM((item->>'value')::DOUBLE PRECISION)
+    FROM jsonb_array_elements(turns) AS turn
+    JOIN applied ON applied.story_id = (turn->>'story_id')::BIGINT
+        AND applied.turn_number = (turn->>'turn_number')::INTEGER
+    CROSS JOIN jsonb_array_elements(turn->'increments') AS item
+    GROUP BY item->>'metric', item->>'dims'
+    ON CONFLICT (metric, dims) DO UPDATE SET value = aggregate_counts.value + EXCLUDED.value;
+$$ LANGUAGE SQL;
+"""
+
+# Run once in the Supabase SQL editor: the provider that wrote each turn,
+# which differs from the story's chosen model after a failover
+SUPABASE_TURN_PROVIDER_SQL = """
+ALTER TABLE emotional_data ADD COLUMN IF NOT EXISTS provider TEXT;
+"""
+
+# Run once in the Supabase SQL editor before writing simulated stories to it
+SUPABASE_SIMULATED_SQL = """
+ALTER TABLE stories ADD COLUMN IF NOT EXISTS simulated BOOLEAN NOT NULL DEFAULT FALSE;
+"""
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    genre TEXT,
+    total_turns INTEGER,
+    start_time TEXT,
+    research_email TEXT,
+    simulated INTEGER NOT NULL DEFAULT 0,
+    remote_id INTEGER,
+    needs_sync INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS emotional_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    story_id INTEGER NOT NULL REFERENCES stories(id),
+    turn_number INTEGER,
+    character_mood TEXT,
+    user_mood TEXT,
+    story_summary TEXT,
+    question TEXT,
+    personality_scores TEXT,
+    story_phase TEXT,
+    is_final INTEGER,
+    provider TEXT,
+    timestamp TEXT,
+    synced INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS mood_validations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    story_id INTEGER NOT NULL REFERENCES stories(id),
+    arc_valid INTEGER,
+    comments TEXT,
+    timestamp TEXT,
+    synced INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS model_comparisons (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    story_id INTEGER NOT NULL REFERENCES stories(id),
+    turn_number INTEGER,
+    primary_provider TEXT,
+    primary_latency_ms REAL,
+    shadow_provider TEXT,
+    shadow_latency_ms REAL,
+    shadow_paragraph TEXT,
+    shadow_question TEXT,
+    shadow_character_mood TEXT,
+    shadow_user_mood TEXT,
+    shadow_personality_scores TEXT,
+    shadow_error TEXT,
+    timestamp TEXT,
+    synced INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS aggregate_counts (
+    metric TEXT NOT NULL,
+    dims TEXT NOT NULL,
+    value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, dims)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS aggregate_turns (
+    story_id INTEGER NOT NULL,
+    turn_number INTEGER NOT NULL,
+    PRIMARY KEY (story_id, turn_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS emotional_data_unsynced ON emotional_data(synced) WHERE synced = 0;
+CREATE INDEX IF NOT EXISTS mood_validations_unsynced ON mood_validations(synced) WHERE synced = 0;
+CREATE INDEX IF NOT EXISTS model_comparisons_unsynced ON model_comparisons(synced) WHERE synced = 0;
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    """Node-local storage in an SQLite database running in WAL mode.
+
+    Statements are fixed parametrised SQL, so sqlite3's statement cache
+    reuses the prepared statements, and each batch is one transaction.
+    """
+
+    def __init__(self, path="woven.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent with NORMAL, only the last commits can be lost on power failure
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self._add_missing_columns()
+
+        self._story_insert = f"INSERT INTO stories ({', '.join(STORY_COLUMNS)}) VALUES ({', '.join('?' for _ in STORY_COLUMNS)})"
+        self._row_inserts = {
+            table: f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+            for table, columns in TABLE_COLUMNS.items()
+        }
+
+    def _add_missing_columns(self):
+        # Databases created before a column was added to TABLE_COLUMNS get it as a nullable column
+        for table, columns in TABLE_COLUMNS.items():
+            existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            for column in columns:
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+        if "simulated" not in {row[1] for row in self.conn.execute("PRAGMA table_info(stories)")}:
+            self.conn.execute("ALTER TABLE stories ADD COLUMN simulated INTEGER NOT NULL DEFAULT 0")
+
+    def create_story(self, story_meta):
+        with self._lock:
+            values = dict(story_meta, simulated=int(bool(story_meta.get("simulated"))))
+            cursor = self.conn.execute(self._story_insert, [values.get(column) for column in STORY_COLUMNS])
+            return cursor.lastrowid
+
+    def update_story(self, story_id, values):
+        columns = [column for column in values if column in STORY_COLUMNS]
+        if not columns:
+            return
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        with self._lock:
+            self.conn.execute(
+                f"UPDATE stories SET {assignments}, needs_sync = 1 WHERE id = ?",
+                [values[column] for column in columns] + [story_id]
+            )
+
+    def insert_rows(self, table, rows):
+        if table == AGGREGATE_TABLE:
+            self._add_aggregates(rows)
+            return
+        columns = TABLE_COLUMNS[table]
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(self._row_inserts[table], [[row.get(column) for column in columns] for row in rows])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _add_aggregates(self, rows):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                # Only turns not in aggregate_turns yet are added, in the same transaction that records them
+                applied = []
+                for row in rows:
+                    cursor = self.conn.execute(
+                        "INSERT OR IGNORE INTO aggregate_turns (story_id, turn_number) VALUES (?, ?)",
+                        (row["story_id"], row["turn_number"])
+                    )
+                    if cursor.rowcount:
+                        applied.extend(row["increments"])
+                self.conn.executemany(
+                    "INSERT INTO aggregate_counts (metric, dims, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (metric, dims) DO UPDATE SET value = value + excluded.value",
+                    [(row["metric"], row["dims"], row["value"]) for row in merge_rows(applied)]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def read_aggregates(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT metric, dims, value FROM aggregate_counts").fetchall()
+        return [{"metric": metric, "dims": dims, "value": value} for metric, dims, value in rows]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class SupabaseSync:
+    """Background copy of SQLite rows to Supabase.
+
+    Stories are inserted first to obtain their Supabase ids, then unsynced
+    rows of the TABLE_COLUMNS tables are sent in batches with their story
+    ids mapped to the remote ones.
+    """
+
+    def __init__(self, sqlite_backend, supabase_backend, interval=30.0, batch_size=500):
+        self.local = sqlite_backend
+        self.remote = supabase_backend
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="supabase-sync", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync_once()
+            except Exception as e:
+                print(f"Debug: SQLite to Supabase sync failed: {e}")
+
+    def sync_once(self):
+        """Copy everything not yet synced, returning the number of rows sent"""
+        sent = self._sync_stories()
+        for table in TABLE_COLUMNS:
+            sent += self._sync_table(table)
+        return sent
+
+    def _query(self, sql, params=()):
+        with self.local._lock:
+            return self.local.conn.execute(sql, params).fetchall()
+
+    def _execute(self, sql, params=()):
+        with self.local._lock:
+            self.local.conn.execute(sql, params)
+
+    def _sync_stories(self):
+        columns = ", ".join(STORY_COLUMNS)
+        stories = self._query(f"SELECT id, remote_id, {columns} FROM stories WHERE needs_sync = 1")
+        for story in stories:
+            local_id, remote_id, values = story[0], story[1], dict(zip(STORY_COLUMNS, story[2:]))
+            values.update(simulated_column(values.pop("simulated")))
+            if remote_id is None:
+                remote_id = self.remote.create_story(values)
+                if remote_id is None:
+                    continue
+            else:
+                self.remote.update_story(remote_id, values)
+            self._execute("UPDATE stories SET remote_id = ?, needs_sync = 0 WHERE id = ?", (remote_id, local_id))
+        return len(stories)
+
+    def _sync_table(self, table):
+        columns = TABLE_COLUMNS[table]
+        selected = ", ".join(f"t.{column}" for column in columns)
+        rows = self._query(
+            f"SELECT t.id, s.remote_id, {selected} FROM {table} t JOIN stories s ON s.id = t.story_id "
+            f"WHERE t.synced = 0 AND s.remote_id IS NOT NULL ORDER BY t.id LIMIT ?",
+            (self.batch_size,)
+        )
+        if not rows:
+            return 0
+        payload = []
+        for row in rows:
+            values = dict(zip(columns, row[2:]))
+            values["story_id"] = row[1]
+            for column in ("is_final", "arc_valid"):
+                if column in values and values[column] is not None:
+                    values[column] = bool(values[column])
+            # Only set after a failover, see emotional_data_row
+            if values.get("provider") is None:
+                values.pop("provider", None)
+            payload.append(values)
+        self.remote.insert_rows(table, payload)
+        ids = [row[0] for row in rows]
+        self._execute(f"UPDATE {table} SET synced = 1 WHERE id IN ({', '.join('?' for _ in ids)})", ids)
+        return len(rows)
+
+    def close(self, timeout=30):
+        """Stop the sync thread after one last sync"""
+        self._stop.set()
+        self._thread.join(timeout)
+        try:
+            self.sync_once()
+        except Exception as e:
+            print(f"Debug: Final SQLite to Supabase sync failed: {e}")
+
+
+class PersistenceSession:
+    """Persistence handle for one user's story.
+
+    Wraps the process-wide storage backend and keeps the id returned by the
+    story insert in the session's story state, so later writes never need to
+    look the story up again. With a write queue, per-turn rows are written
+    in the background and only the story insert stays on the caller's thread.
+    """
+
+    def __init__(self, backend, story_state, write_queue=None):
+        self.backend = backend
+        self.story_state = story_state
+        self.write_queue = write_queue
+
+    @property
+    def story_id(self):
+        return self.story_state.get("story_id")
+
+    def create_story(self, story_meta):
+        """Insert the story row and remember the id it was given"""
+        self.story_state["story_id"] = self.backend.create_story(story_meta)
+        return self.story_id
+
+    def ensure_story(self):
+        """Return the story id, creating the story row if it does not exist yet"""
+        if self.story_id is not None:
+            return self.story_id
+        return self.create_story({
+            "name": self.story_state["name"],
+            "genre": self.story_state["genre"],
+            "total_turns": self.story_state["total_turns"],
+            "start_time": datetime.now().isoformat(),
+            "research_email": self.story_state.get("research_email"),
+            **simulated_column(self.story_state.get("simulated"))
+        })
+
+    def _insert(self, table, row):
+        # Fall back to a direct insert when there is no queue or it is full
+        if self.write_queue is not None and self.write_queue.enqueue(table, row):
+            return
+        self.backend.insert_rows(table, [row])
+
+    def save_emotional_data(self, emotional_data):
+        """Insert one turn of emotional data for this story"""
+        self._insert('emotional_data', dict(emotional_data, story_id=self.story_id))
+
+    def save_turn_aggregates(self, turn_data):
+        """Add one persisted turn to the cross-story aggregates, once however often it is retried"""
+        self._insert(AGGREGATE_TABLE, turn_row(
+            self.story_id, turn_data["turn_number"], turn_increments(self.story_state, turn_data)
+        ))
+
+    def save_research_email(self, email):
+        """Attach a research email to this story, or keep it for the story insert"""
+        self.story_state["research_email"] = email
+        if self.story_id is not None:
+            self.backend.update_story(self.story_id, {"research_email": email})
+
+    def save_validation_data(self, validation_data):
+        """Insert a mood validation for this story"""
+        self._insert('mood_validations', dict(validation_data, story_id=self.story_id))
+
+    def save_model_comparison(self, comparison):
+        """Insert the other model's response to one of this story's turns"""
+        self._insert('model_comparisons', dict(comparison, story_id=self.story_id))
+
+    def flush(self, wait=False):
+        """Ask the write queue to write this story's pending rows now, False if it is backed up"""
+        if self.write_queue is not None:
+            return self.write_queue.flush(wait=wait)
+        return True
@@ -0,0 +1,81 @@
+# Defaults for the rolling story summary sent with each prompt
+RECENT_ENTRIES = 6      # Newest summary entries kept verbatim (about three turns)
+CHUNK_SIZE = 4          # Entries folded together into one condensed entry
+CHUNK_WORDS = 40        # Word budget of a condensed entry
+SUMMARY_BUDGET_TOKENS = 400
+
+
+def estimate_tokens(text):
+    """Rough token count for English text, about four characters per token"""
+    return (len(text) + 3) // 4
+
+
+def new_summary_context():
+    """Empty rolling summary, kept in story_state['summary_context']"""
+    # levels[0] holds condensed groups of raw entries, levels[1] condensed
+    # groups of levels[0] entries, and so on
+    return {"recent": [], "pending": [], "levels": []}
+
+
+def condense(entries, max_words=CHUNK_WORDS):
+    """Fold several summary entries into one, sharing the word budget between them"""
+    segments = []
+    for entry in entries:
+        segments.extend(segment.strip() for segment in entry.split("; ") if segment.strip())
+    # Once a turn is old, the plot summaries matter more than what the user typed
+    story_segments = [segment for segment in segments if " reflected: " not in segment]
+    if story_segments:
+        segments = story_segments
+    if not segments:
+        return ""
+
+    words_per_segment = max(3, max_words // len(segments))
+    condensed = []
+    for segment in segments:
+        words = segment.split()
+        if len(words) > words_per_segment:
+            segment = " ".join(words[:words_per_segment]).rstrip(".,;:") + "..."
+        condensed.append(segment)
+    return "; ".join(condensed)
+
+
+def add_summary_entry(context, entry, recent_entries=RECENT_ENTRIES, chunk_size=CHUNK_SIZE, chunk_words=CHUNK_WORDS):
+    """Add a new entry, folding the oldest verbatim entries into condensed levels"""
+    context["recent"].append(entry)
+    while len(context["recent"]) > recent_entries:
+        context["pending"].append(context["recent"].pop(0))
+
+    if len(context["pending"]) >= chunk_size:
+        folded = condense(context["pending"], chunk_words)
+        context["pending"] = []
+        level = 0
+        # Carry full levels upwards, like incrementing a counter
+        while True:
+            if level == len(context["levels"]):
+                context["levels"].append([])
+            context["levels"][level].append(folded)
+            if len(context["levels"][level]) < chunk_size:
+                break
+            folded = condense(context["levels"][level], chunk_words)
+            context["levels"][level] = []
+            level += 1
+    return context
+
+
+def render_summary(context, budget_tokens=SUMMARY_BUDGET_TOKENS):
+    """Story so far for the prompt, oldest condensed context first, within the token budget"""
+    parts = []
+    for level in reversed(context["levels"]):
+        parts.extend(level)
+    if context["pending"]:
+        parts.append(condense(context["pending"]))
+    parts.extend(context["recent"])
+
+    # Drop the oldest condensed context first, then trim old verbatim entries
+    total = sum(estimate_tokens(part) for part in parts)
+    while total > budget_tokens and len(parts) > 1:
+        total -= estimate_tokens(parts.pop(0))
+    if total > budget_tokens and parts:
+        words = parts[0].split()
+        parts[0] = " ".join(words[-(budget_tokens * 3 // 4):])
+    return ", ".join(part for part in parts if part)
@@ -0,0 +1,366 @@
+import copy
+import json
+import time
+from datetime import datetime
+
+from emotional_validator import EmotionalValidator
+from hedging import answered_by
+from prompts import build_prompt_parts, get_story_phase, prompt_report
+from storage import PersistenceSession
+from story_context import add_summary_entry, new_summary_context
+from story_parser import parse_personality_scores
+from story_schema import STORY_TURN_SCHEMA, STRUCTURED_SYSTEM_MESSAGE, parse_model_response
+from telemetry import TELEMETRY
+from trait_matcher import DEFAULT_MATCHER
+
+# The turn logic of a story without any UI, so it can run outside Streamlit
+
+DEFAULT_PREFERENCES = {
+    "risk_taker": 0,
+    "optimism": 0,
+    "social": 0,
+    "analytical": 0,
+    "fantasy_interest": 0,
+    "introspective": 0
+}
+
+LONG_STORY_OPTION = "Long (up to 17 turns, aims for target emotion)"
+
+
+def new_story_state(**details):
+    """Story state for a story that has not started, updated with any details given"""
+    story_state = {
+        "genre": None,
+        "name": None,
+        "pronouns": None,
+        "age": None,
+        "current_emotion": None,
+        "target_emotion": None,
+        "summary": [],
+        "summary_context": new_summary_context(),  # Bounded rolling summary used in prompts
+        "turn_count": 0,
+        "total_turns": 10,
+        "started": False,
+        "character_mood": None,
+        "user_mood": None,
+        "last_user_input": None,
+        "user_preferences": dict(DEFAULT_PREFERENCES),
+        "character_mood_arc": {},
+        "user_mood_arc": {},
+        "validation_errors": {},
+        "model_choice": "gemini",
+        "compare_models": False,  # Also send each prompt to the other provider and store its response
+        "simulated": False,  # Played by simulate.py rather than a reader
+        "story_id": None  # Set from the story insert on the first turn
+    }
+    story_state.update(details)
+    return story_state
+
+
+def is_final_turn_for(story_state, final=False):
+    """Whether the next turn ends the story"""
+    # Determine if this turn should be final based on reaching target emotion (for Long stories)
+    return final or (story_state.get("story_length_option") == LONG_STORY_OPTION and story_state.get("character_mood", "").lower() == story_state["target_emotion"].lower() and story_state["turn_count"] >= story_state["total_turns"] // 2)
+
+
+def update_preferences(preferences, choice_text, matcher=DEFAULT_MATCHER):
+    """Apply the trait keywords found in a lowercased choice to a preferences dict"""
+    for trait, delta in matcher.score(choice_text).items():
+        if trait in preferences:
+            preferences[trait] += delta
+    # Keep scores within -5 to 5 range
+    for trait in preferences:
+        preferences[trait] = max(-5, min(5, preferences[trait]))
+    return preferences
+
+
+def add_to_summary(story_state, entry):
+    """Record a summary entry and fold it into the rolling prompt summary"""
+    story_state['summary'].append(entry)
+    add_summary_entry(story_state['summary_context'], entry)
+
+
+def record_user_response(story_state, user_response):
+    """Store a user's response in the story state the next prompt is built from"""
+    story_state['last_user_input'] = user_response
+    # Add the response to the story summary
+    add_to_summary(story_state, f"{story_state['name']} reflected: {user_response}")
+
+
+def other_provider(provider):
+    return "openai" if provider == "gemini" else "gemini"
+
+
+def emotional_data_row(turn_data, model_choice=None):
+    """emotional_data row for one played turn.
+
+    provider is only set when a failover handed the turn to a provider other
+    than model_choice, so databases without the SUPABASE_TURN_PROVIDER_SQL
+    column still accept the turns of stories that never failed over.
+    """
+    row = {
+        "turn_number": turn_data["turn_number"],
+        "character_mood": turn_data["character_mood"],
+        "user_mood": turn_data["user_mood"],
+        "story_summary": turn_data["story_summary"],
+        "question": turn_data["question"],
+        "personality_scores": json.dumps(turn_data["personality_scores"]),
+        "story_phase": turn_data["story_phase"],
+        "is_final": turn_data["is_final"],
+        "timestamp": datetime.now().isoformat()
+    }
+    if turn_data.get("provider") and turn_data["provider"] != model_choice:
+        row["provider"] = turn_data["provider"]
+    return row
+
+
+def turn_provider(story_state, sections):
+    """Provider that wrote a turn, which differs from the story's model_choice after a failover"""
+    return sections.get("provider") or story_state["model_choice"]
+
+
+class StoryEngine:
+    """Plays story turns against a story state dict.
+
+    The app keeps one story state per session and renders what each turn
+    returns; benchmarks and simulations drive the same methods with fake
+    LLM clients and storage backends.
+    """
+
+    def __init__(self, llm_clients, validator=None, storage=None, write_queue=None, telemetry=TELEMETRY, matcher=DEFAULT_MATCHER,
+                 structured=False):
+        self.llm_clients = llm_clients
+        self.validator = validator or EmotionalValidator()
+        self.storage = storage
+        self.write_queue = write_queue
+        self.telemetry = telemetry
+        self.matcher = matcher
+        # Ask for one JSON object per turn instead of ~~~~ sections
+        self.structured = structured
+
+    def persistence(self, story_state):
+        return PersistenceSession(self.storage, story_state, write_queue=self.write_queue)
+
+    def request_options(self):
+        """Extra LLM client arguments for this engine's output format"""
+        if not self.structured:
+            return {}
+        return {"system_message": STRUCTURED_SYSTEM_MESSAGE, "response_schema": STORY_TURN_SCHEMA}
+
+    def parse_response(self, story_state, raw_response):
+        """Sections of a raw response and the provider that wrote it, counting structured responses that needed the fallback"""
+        sections, used_fallback = parse_model_response(raw_response, self.structured)
+        sections["provider"] = answered_by(raw_response, story_state["model_choice"])
+        if used_fallback:
+            self.telemetry.count("structured_fallback_total", provider=sections["provider"])
+        return sections
+
+    def build_prompt(self, story_state, final=False):
+        """Return this turn's prompt and the size report of its prefix and suffix"""
+        with self.telemetry.span("build_prompt", provider=story_state["model_choice"]):
+            prefix, suffix = build_prompt_parts(story_state, final=final, structured=self.structured)
+        report = prompt_report(prefix, suffix)
+        report["turn"] = story_state['turn_count']
+        return prefix + suffix, report
+
+    def respond(self, story_state, user_response):
+        """Apply a user's reply: remember it for the next prompt and update the trait scores"""
+        record_user_response(story_state, user_response)
+        choice_text = user_response.lower()
+        update_preferences(story_state["user_preferences"], choice_text, self.matcher)
+        return choice_text
+
+    def hypothetical_prompt(self, story_state, user_response):
+        """Prompt the next turn would have if the user replied with this response"""
+        hypothetical_state = copy.deepcopy(story_state)
+        self.respond(hypothetical_state, user_response)
+        prefix, suffix = build_prompt_parts(hypothetical_state, final=is_final_turn_for(hypothetical_state), structured=self.structured)
+        return prefix + suffix
+
+    def apply_response(self, story_state, sections, is_final_turn, persist=None):
+        """Record a parsed response in the story state, validate and persist it.
+
+        persist is called with the turn data and defaults to saving through
+        the engine's storage backend, if it has one. Returns the turn data.
+        """
+        provider = turn_provider(story_state, sections)
+        current_turn = story_state["turn_count"]
+
+        # Store moods in the arc dictionaries
+        story_state['character_mood_arc'][current_turn] = sections["character_mood"]
+        story_state['user_mood_arc'][current_turn] = sections["user_mood"]
+
+        # Parse personality scores
+        with self.telemetry.span("parse_scores", provider=provider):
+            parsed_personality_scores = parse_personality_scores(sections["personality_scores"], story_state['user_preferences'])
+        story_state['user_preferences'] = parsed_personality_scores
+
+        # Validate the character turn and emotional progression
+        story_phase = get_story_phase(current_turn, story_state["total_turns"])
+        with self.telemetry.span("validate", provider=provider):
+            validation_error = self.validator.validate_turn(
+                turn_number=current_turn,
+                character_mood_arc=story_state['character_mood_arc'],
+                story_phase=story_phase,
+                personality_scores=list(story_state['user_preferences'].values()),
+                is_final=is_final_turn
+            )
+        if validation_error:
+            story_state['validation_errors'][current_turn] = validation_error
+
+        turn_data = {
+            "turn_number": current_turn + 1,
+            "paragraph": sections["paragraph"],
+            "character_mood": sections["character_mood"],
+            "user_mood": sections["user_mood"],
+            "story_summary": sections["summary"],
+            "question": sections["question"] if not is_final_turn else None,
+            "personality_scores": parsed_personality_scores,
+            "story_phase": story_phase,
+            "is_final": is_final_turn,
+            "validation_error": validation_error,
+            "provider": provider
+        }
+
+        # Persist this turn, the story entry is created on the first one
+        (persist or self.save_turn)(story_state, turn_data)
+
+        # Update summary and turn count
+        with self.telemetry.span("state_update", provider=provider):
+            if sections["summary"]:
+                add_to_summary(story_state, sections["summary"])
+            story_state['turn_count'] += 1
+            if is_final_turn:
+                story_state["completed"] = True
+        return turn_data
+
+    def start_shadow_turn(self, story_state, prompt, llm_clients=None):
+        """Send this turn's prompt to the other provider in the background.
+
+        Returns a concurrent Future of (raw response, seconds taken). Use
+        clients that do not hedge or fail over, so the response really comes
+        from the other provider.
+        """
+        clients = llm_clients or self.llm_clients
+        provider = other_provider(story_state["model_choice"])
+        request_options = self.request_options()
+
+        async def shadow_request():
+            start = time.perf_counter()
+            raw_response = await clients.agenerate(prompt, provider, **request_options)
+            return raw_response, time.perf_counter() - start
+
+        return clients.submit(shadow_request())
+
+    def comparison_row(self, story_state, turn_data, shadow, primary_latency, previous_scores, timeout=None):
+        """model_comparisons row for a played turn, waiting for the shadow response if needed.
+
+        previous_scores are the personality scores the turn started from, so
+        the shadow's scores are parsed the same way as the primary's. Returns
+        None when the turn failed over to the shadow's provider, since both
+        responses then come from the same model.
+        """
+        provider = turn_data.get("provider") or story_state["model_choice"]
+        shadow_provider = other_provider(story_state["model_choice"])
+        if provider == shadow_provider:
+            shadow.cancel()
+            self.telemetry.count("comparisons_skipped_total", provider=provider)
+            return None
+        row = {
+            "turn_number": turn_data["turn_number"],
+            "primary_provider": provider,
+            "primary_latency_ms": round(primary_latency * 1000, 1),
+            "shadow_provider": shadow_provider,
+            "shadow_latency_ms": None,
+            "shadow_error": None,
+            "timestamp": datetime.now().isoformat()
+        }
+        try:
+            raw_response, shadow_latency = shadow.result(timeout=timeout)
+        except Exception as e:
+            shadow.cancel()
+            row["shadow_error"] = str(e) or type(e).__name__
+            self.telemetry.count("shadow_errors_total", provider=row["shadow_provider"])
+            return row
+        row["shadow_latency_ms"] = round(shadow_latency * 1000, 1)
+        if not raw_response:
+            row["shadow_error"] = "Empty response"
+            return row
+        sections, _ = parse_model_response(raw_response, self.structured)
+        row.update({
+            "shadow_paragraph": sections["paragraph"],
+            "shadow_question": sections["question"] if not turn_data["is_final"] else None,
+            "shadow_character_mood": sections["character_mood"],
+            "shadow_user_mood": sections["user_mood"],
+            "shadow_personality_scores": json.dumps(parse_personality_scores(sections["personality_scores"], previous_scores)),
+        })
+        return row
+
+    def save_comparison(self, story_state, comparison):
+        """Save a turn's model comparison through the storage backend"""
+        if self.storage is None or comparison is None:
+            return
+        with self.telemetry.span("save_model_comparison"):
+            persistence = self.persistence(story_state)
+            persistence.ensure_story()
+            persistence.save_model_comparison(comparison)
+            if story_state.get("completed"):
+                persistence.flush()
+
+    def save_turn(self, story_state, turn_data):
+        """Save a turn's emotional data through the storage backend"""
+        if self.storage is None:
+            return
+        with self.telemetry.span("save_emotional_data"):
+            persistence = self.persistence(story_state)
+            persistence.ensure_story()
+            persistence.save_emotional_data(emotional_data_row(turn_data, story_state["model_choice"]))
+            persistence.save_turn_aggregates(turn_data)
+            if turn_data["is_final"]:
+                persistence.flush()
+
+    async def aplay_turn(self, story_state, final=False, persist=None):
+        """play_turn for an event loop, so many stories can share one process.
+
+        Only the LLM call is awaited; comparison mode is not supported here.
+        """
+        provider = story_state["model_choice"]
+        is_final_turn = is_final_turn_for(story_state, final)
+        prompt, report = self.build_prompt(story_state, final=is_final_turn)
+        start = time.perf_counter()
+        raw_response = await self.llm_clients.agenerate(prompt, provider, **self.request_options())
+        self.telemetry.observe("llm_call", time.perf_counter() - start, {"provider": provider, "mode": "agenerate"})
+        if not raw_response:
+            return None
+        with self.telemetry.span("parse_response", provider=answered_by(raw_response, provider)):
+            sections = self.parse_response(story_state, raw_response)
+        turn_data = self.apply_response(story_state, sections, is_final_turn, persist=persist)
+        turn_data["prompt_report"] = report
+        return turn_data
+
+    def play_turn(self, story_state, final=False, raw_response=None):
+        """Play one turn without a UI and return its turn data, or None without a response"""
+        provider = story_state["model_choice"]
+        with self.telemetry.span("turn", provider=provider) as turn_span:
+            is_final_turn = is_final_turn_for(story_state, final)
+            prompt, report = self.build_prompt(story_state, final=is_final_turn)
+            shadow = self.start_shadow_turn(story_state, prompt) if story_state.get("compare_models") else None
+            previous_scores = dict(story_state["user_preferences"])
+            start = time.perf_counter()
+            if raw_response is None:
+                with self.telemetry.span("llm_call", provider=provider, mode="generate"):
+                    raw_response = self.llm_clients.generate(prompt, provider, **self.request_options())
+            primary_latency = time.perf_counter() - start
+            if not raw_response:
+                if shadow:
+                    shadow.cancel()
+                return None
+            with self.telemetry.span("parse_response", provider=answered_by(raw_response, provider)):
+                sections = self.parse_response(story_state, raw_response)
+            turn_data = self.apply_response(story_state, sections, is_final_turn)
+            turn_span.set("answered_by", turn_data["provider"])
+            turn_data["prompt_report"] = report
+            if shadow:
+                turn_data["comparison"] = self.comparison_row(story_state, turn_data, shadow, primary_latency, previous_scores)
+                self.save_comparison(story_state, turn_data["comparison"])
+            return turn_data
@@ -0,0 +1,136 @@
+SECTION_DELIMITER = "~~~~"
+
+# Order of the sections in a ~~~~ delimited story response
+SECTION_NAMES = [
+    "paragraph",
+    "question",
+    "summary",
+    "character_mood",
+    "user_mood",
+    "personality_scores",
+]
+
+# Labels the model repeats at the start of some sections
+SECTION_LABELS = {
+    "character_mood": "Current character mood:",
+    "user_mood": "Current user mood:",
+    "personality_scores": "Updated personality scores:",
+}
+
+DEFAULT_QUESTION = "What are you feeling in this moment?"
+
+
+def clean_section(name, text):
+    """Strip whitespace and the repeated format label from a section"""
+    text = text.strip()
+    label = SECTION_LABELS.get(name)
+    if label:
+        text = text.replace(label, "").strip()
+    return text
+
+
+def parse_personality_scores(personality_scores_text, current_scores):
+    """Parse 'Trait Name: X/5' lines, starting from the current scores.
+
+    Scores that were already parsed from a structured response arrive as a
+    dict and are applied directly.
+    """
+    parsed_scores = dict(current_scores)
+    if isinstance(personality_scores_text, dict):
+        parsed_scores.update((trait, score) for trait, score in personality_scores_text.items() if trait in parsed_scores)
+        return parsed_scores
+    try:
+        for line in personality_scores_text.split('\n'):
+            line = line.strip()
+            if ':' in line:
+                trait, score = line.split(':', 1)
+                trait = trait.strip().lower().replace(' ', '_')
+                try:
+                    score = int(score.strip().split('/')[0])
+                    if trait in parsed_scores:
+                        parsed_scores[trait] = score
+                except ValueError:
+                    print(f"Debug: Could not parse personality score for line: {line}")
+    except Exception as e:
+        print(f"Debug: Error parsing personality scores: {e}\nRaw scores: {personality_scores_text}")
+    return parsed_scores
+
+
+def parse_story_response(raw_response):
+    """Split a complete ~~~~ delimited response into its named sections"""
+    return sections_from_parts(raw_response.split(SECTION_DELIMITER))
+
+
+def sections_from_parts(parts):
+    """Build the named sections from the raw delimited parts"""
+    parts = list(parts)
+
+    # Ensure we have all parts, if not, create empty defaults
+    while len(parts) < len(SECTION_NAMES):
+        parts.append("")
+
+    sections = {name: clean_section(name, parts[i]) for i, name in enumerate(SECTION_NAMES)}
+    if not sections["question"]:
+        sections["question"] = DEFAULT_QUESTION
+    return sections
+
+
+class StoryStreamParser:
+    """Incrementally parse a streamed story response as chunks arrive.
+
+    The story paragraph is available while it is still being written, and
+    each later section is parsed as soon as its closing delimiter appears.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.completed = []  # Raw text of every section closed so far
+        self._section_start = 0
+
+    def feed(self, chunk):
+        """Add a chunk of text and return the names of newly completed sections"""
+        newly_completed = []
+        if not chunk:
+            return newly_completed
+
+        # A delimiter may have been split across chunks, so rescan its overlap
+        scan_from = max(self._section_start, len(self.buffer) - len(SECTION_DELIMITER) + 1)
+        self.buffer += chunk
+
+        while True:
+            index = self.buffer.find(SECTION_DELIMITER, scan_from)
+            if index == -1:
+                break
+            self.completed.append(self.buffer[self._section_start:index])
+            self._section_start = index + len(SECTION_DELIMITER)
+            scan_from = self._section_start
+            if len(self.completed) <= len(SECTION_NAMES):
+                newly_completed.append(SECTION_NAMES[len(self.completed) - 1])
+        return newly_completed
+
+    def section(self, name):
+        """Return a cleaned completed section, or None if it has not closed yet"""
+        index = SECTION_NAMES.index(name)
+        if index >= len(self.completed):
+            return None
+        return clean_section(name, self.completed[index])
+
+    @property
+    def paragraph_done(self):
+        return len(self.completed) > 0
+
+    @property
+    def paragraph_text(self):
+        """The story paragraph so far, without any partially received delimiter"""
+        if self.completed:
+            return self.completed[0].strip()
+        text = self.buffer
+        # Hold back trailing '~' characters that may be the start of a delimiter
+        trailing = len(text) - len(text.rstrip("~"))
+        if trailing:
+            text = text[:-trailing]
+        return text.strip()
+
+    def finish(self):
+        """Return all sections once the stream has ended"""
+        return sections_from_parts(self.completed + [self.buffer[self._section_start:]])
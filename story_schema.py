@@ -0,0 +1,157 @@
+import json
+
+from story_parser import DEFAULT_QUESTION, parse_story_response
+from trait_matcher import TRAIT_PATTERNS
+
+# Structured-output mode: the model returns one JSON object per turn instead
+# of ~~~~ delimited text. The same schema is sent to OpenAI (JSON schema) and
+# Gemini (response schema), and responses are checked here before use.
+
+STORY_EMOTIONS = ["joy", "sadness", "anger", "fear", "trust", "surprise", "anticipation", "disgust", "neutral", "confusion"]
+STORY_TRAITS = list(TRAIT_PATTERNS)
+SCORE_RANGE = (-5, 5)
+
+STORY_TURN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "paragraph": {"type": "string"},
+        "question": {"type": "string"},
+        "summary": {"type": "string"},
+        "character_mood": {"type": "string", "enum": STORY_EMOTIONS},
+        "user_mood": {"type": "string", "enum": STORY_EMOTIONS},
+        "personality_scores": {
+            "type": "object",
+            "properties": {
+                trait: {"type": "integer", "minimum": SCORE_RANGE[0], "maximum": SCORE_RANGE[1]} for trait in STORY_TRAITS
+            },
+            "required": STORY_TRAITS,
+            "additionalProperties": False,
+        },
+    },
+    "required": ["paragraph", "question", "summary", "character_mood", "user_mood", "personality_scores"],
+    "additionalProperties": False,
+}
+SCHEMA_NAME = "story_turn"
+STRUCTURED_SYSTEM_MESSAGE = (
+    "You are a creative storytelling assistant that helps users write emotional stories."
+    " You MUST respond with a single JSON object with exactly the fields specified in the prompt."
+)
+
+# Keywords each provider's schema support rejects; scores are range-checked here instead
+GEMINI_UNSUPPORTED_KEYS = {"additionalProperties", "minimum", "maximum"}
+OPENAI_UNSUPPORTED_KEYS = {"minimum", "maximum"}
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a structured response is not valid JSON or does not match the schema"""
+
+
+def _without_keys(schema, keys):
+    if isinstance(schema, dict):
+        return {key: _without_keys(value, keys) for key, value in schema.items() if key not in keys}
+    if isinstance(schema, list):
+        return [_without_keys(item, keys) for item in schema]
+    return schema
+
+
+def gemini_schema(schema=STORY_TURN_SCHEMA):
+    """The schema restricted to the subset Gemini's response_schema understands"""
+    return _without_keys(schema, GEMINI_UNSUPPORTED_KEYS)
+
+
+def openai_schema(schema=STORY_TURN_SCHEMA):
+    """The schema restricted to the subset OpenAI's strict structured outputs accept"""
+    return _without_keys(schema, OPENAI_UNSUPPORTED_KEYS)
+
+
+def _string(data, name):
+    value = data.get(name)
+    if not isinstance(value, str):
+        raise StructuredOutputError(f"'{name}' must be a string, got {type(value).__name__}")
+    return value.strip()
+
+
+def _mood(data, name):
+    mood = _string(data, name).lower()
+    if mood not in STORY_EMOTIONS:
+        raise StructuredOutputError(f"'{name}' must be one of the allowed emotions, got '{mood}'")
+    return mood
+
+
+def _scores(data):
+    scores = data.get("personality_scores")
+    if not isinstance(scores, dict):
+        raise StructuredOutputError("'personality_scores' must be an object")
+    parsed = {}
+    for trait in STORY_TRAITS:
+        score = scores.get(trait)
+        if isinstance(score, float) and score.is_integer():
+            score = int(score)
+        if not isinstance(score, int) or isinstance(score, bool) or not SCORE_RANGE[0] <= score <= SCORE_RANGE[1]:
+            raise StructuredOutputError(f"Personality score '{trait}' must be an integer from {SCORE_RANGE[0]} to {SCORE_RANGE[1]}, got {score!r}")
+        parsed[trait] = score
+    return parsed
+
+
+def parse_structured_response(raw_response):
+    """Validate a JSON story response and return the same sections as the ~~~~ parser.
+
+    personality_scores is a dict of validated integer scores rather than text.
+    """
+    try:
+        data = json.loads(raw_response)
+    except (TypeError, ValueError) as e:
+        raise StructuredOutputError(f"Response is not valid JSON: {e}") from None
+    if not isinstance(data, dict):
+        raise StructuredOutputError("Response must be a JSON object")
+    sections = {
+        "paragraph": _string(data, "paragraph"),
+        "question": _string(data, "question") or DEFAULT_QUESTION,
+        "summary": _string(data, "summary"),
+        "character_mood": _mood(data, "character_mood"),
+        "user_mood": _mood(data, "user_mood"),
+        "personality_scores": _scores(data),
+    }
+    if not sections["paragraph"]:
+        raise StructuredOutputError("'paragraph' is empty")
+    return sections
+
+
+def _lenient_sections(data):
+    """Best-effort sections from a JSON object that failed validation"""
+    scores = data.get("personality_scores")
+    scores = scores if isinstance(scores, dict) else {}
+    return {
+        "paragraph": str(data.get("paragraph") or "").strip(),
+        "question": str(data.get("question") or "").strip() or DEFAULT_QUESTION,
+        "summary": str(data.get("summary") or "").strip(),
+        "character_mood": str(data.get("character_mood") or "").strip().lower(),
+        "user_mood": str(data.get("user_mood") or "").strip().lower(),
+        # Out of range or non-integer scores are dropped so the current score is kept
+        "personality_scores": {
+            trait: score for trait, score in scores.items()
+            if trait in STORY_TRAITS and isinstance(score, int) and not isinstance(score, bool) and SCORE_RANGE[0] <= score <= SCORE_RANGE[1]
+        },
+    }
+
+
+def parse_model_response(raw_response, structured=False):
+    """Parse a response in either format; returns (sections, used_fallback).
+
+    In structured mode a response that fails validation falls back to a
+    lenient read of its JSON, or to the legacy ~~~~ format when it is not
+    JSON at all, since models sometimes ignore the schema.
+    """
+    if not structured:
+        return parse_story_response(raw_response), False
+    try:
+        return parse_structured_response(raw_response), False
+    except StructuredOutputError as e:
+        print(f"Debug: Structured response rejected: {e}")
+    try:
+        data = json.loads(raw_response)
+    except (TypeError, ValueError):
+        data = None
+    if isinstance(data, dict) and data.get("paragraph"):
+        return _lenient_sections(data), True
+    return parse_story_response(raw_response), True
@@ -0,0 +1,233 @@
+import bisect
+import contextlib
+import functools
+import http.server
+import json
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets, from 0.1 ms to 2 minutes
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0
+)
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "woven"
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket, as histogram_quantile does"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower  # Beyond the largest bucket
+                return lower + (self.buckets[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class Span:
+    """One timed stage; attributes set on it go to the JSONL record only"""
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.attributes = {}
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+
+class Telemetry:
+    """Process-wide latency spans aggregated into per-stage histograms.
+
+    Each span is observed into a histogram keyed by its stage name and
+    labels (keep labels low-cardinality, e.g. provider). Finished spans can
+    also be appended to a JSONL file, and the aggregates rendered in the
+    Prometheus text format.
+    """
+
+    def __init__(self, jsonl_path=None):
+        self.jsonl_path = jsonl_path
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._jsonl = None
+
+    def set_jsonl_path(self, path):
+        with self._lock:
+            if self._jsonl:
+                self._jsonl.close()
+                self._jsonl = None
+            self.jsonl_path = path
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        """Time the enclosed block as one observation of stage `name`"""
+        span = Span(name, labels)
+        stack = self._local.__dict__.setdefault("stack", [])
+        parent = stack[-1].name if stack else None
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.set("error", type(e).__name__)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            self.observe(name, duration, labels, parent=parent, attributes=span.attributes)
+
+    def timed(self, name, **labels):
+        """Decorator timing every call of a function as stage `name`"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name, seconds, labels=None, parent=None, attributes=None):
+        labels = labels or {}
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+            if self.jsonl_path:
+                self._write_record({
+                    "ts": time.time(),
+                    "span": name,
+                    "parent": parent,
+                    "duration_ms": round(seconds * 1000, 3),
+                    **labels,
+                    **(attributes or {}),
+                })
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        """Set the current value of a gauge, e.g. a queue's depth"""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def _write_record(self, record):
+        try:
+            if self._jsonl is None:
+                self._jsonl = open(self.jsonl_path, "a", encoding="utf-8", buffering=1)
+            self._jsonl.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            print(f"Debug: Could not write span to {self.jsonl_path}: {e}")
+            self.jsonl_path = None
+
+    def summary(self):
+        """p50/p95/p99 in milliseconds for each stage and label set"""
+        with self._lock:
+            rows = []
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                row = {"stage": name, **dict(labels), "count": histogram.count,
+                       "mean_ms": round(histogram.sum / histogram.count * 1000, 3)}
+                for q in QUANTILES:
+                    row[f"p{int(q * 100)}_ms"] = round(histogram.quantile(q) * 1000, 3)
+                rows.append(row)
+            return rows
+
+    def render_prometheus(self):
+        """All histograms and counters in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_seconds Latency of each story pipeline stage",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                label_text = _format_labels((("stage", name),) + labels)
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{_format_labels((("stage", name),) + labels + (("le", le),))} {cumulative}')
+                lines.append(f"{METRIC_PREFIX}_stage_seconds_sum{label_text} {histogram.sum}")
+                lines.append(f"{METRIC_PREFIX}_stage_seconds_count{label_text} {histogram.count}")
+            counter_names = sorted({name for name, _ in self.counters})
+            for counter_name in counter_names:
+                lines.append(f"# TYPE {METRIC_PREFIX}_{counter_name} counter")
+                for (name, labels), value in sorted(self.counters.items()):
+                    if name == counter_name:
+                        lines.append(f"{METRIC_PREFIX}_{name}{_format_labels(labels)} {value}")
+            for gauge_name in sorted({name for name, _ in self.gauges}):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{gauge_name} gauge")
+                for (name, labels), value in sorted(self.gauges.items()):
+                    if name == gauge_name:
+                        lines.append(f"{METRIC_PREFIX}_{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        with self._lock:
+            if self._jsonl:
+                self._jsonl.close()
+                self._jsonl = None
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def serve_metrics(telemetry, port=9464, host="127.0.0.1"):
+    """Serve /metrics in the Prometheus text format from a daemon thread"""
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = telemetry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would flood the app log
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-endpoint", daemon=True).start()
+    return server
+
+
+# Shared by every session in the process
+TELEMETRY = Telemetry()
@@ -0,0 +1,99 @@
+import benchmark
+from aggregates import AGGREGATE_TABLE, AggregateView, turn_increments, turn_row
+from fake_backends import FakeStorageBackend
+from storage import MISSING_FUNCTION, SQLiteBackend, SupabaseBackend
+from story_engine import new_story_state
+
+
+def turn_data(turn_number, **overrides):
+    data = {
+        "turn_number": turn_number,
+        "character_mood": "joy",
+        "user_mood": "curiosity",
+        "is_final": False,
+        "personality_scores": {"adventure": 3},
+        "validation_error": None,
+    }
+    data.update(overrides)
+    return data
+
+
+def story_state(**details):
+    return new_story_state(genre="fantasy", name="Ada", total_turns=10, model_choice="gemini", **details)
+
+
+def test_fake_backend_applies_each_turn_once():
+    backend = FakeStorageBackend()
+    state = story_state()
+    first = turn_row(1, 1, turn_increments(state, turn_data(1)))
+    second = turn_row(1, 2, turn_increments(state, turn_data(2)))
+    backend.insert_rows(AGGREGATE_TABLE, [first])
+    # A retried batch repeats the first turn
+    backend.insert_rows(AGGREGATE_TABLE, [first, second])
+    view = AggregateView(backend.read_aggregates())
+    assert view.total("turns") == 2
+    assert view.total("stories") == 1
+
+
+def test_benchmark_runs_against_the_fake_backends(tmp_path, capsys):
+    assert benchmark.main(["--repeat", "1", "--lengths", "10", "--baseline", str(tmp_path / "baseline.json")]) == 0
+    assert "total wall" in capsys.readouterr().out
+
+
+class MissingFunctionClient:
+    """Supabase client stand-in whose RPCs fail like PostgREST does for an unknown function"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def rpc(self, name, params):
+        self.calls += 1
+        return self
+
+    def execute(self):
+        error = Exception("Could not find the function public.add_turn_aggregates(turns)")
+        error.code = MISSING_FUNCTION
+        raise error
+
+
+def test_missing_aggregate_function_is_not_retried():
+    client = MissingFunctionClient()
+    backend = SupabaseBackend(client)
+    rows = [turn_row(1, 1, turn_increments(story_state(), turn_data(1)))]
+    backend.insert_rows(AGGREGATE_TABLE, rows)
+    backend.insert_rows(AGGREGATE_TABLE, rows)
+    assert client.calls == 1
+    assert not backend.aggregates_enabled
+
+
+def test_sqlite_backend_applies_each_turn_once(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "woven.db"))
+    state = story_state()
+    rows = [turn_row(7, turn, turn_increments(state, turn_data(turn))) for turn in (1, 2)]
+    backend.insert_rows(AGGREGATE_TABLE, rows)
+    # The same turns again, as after a write that committed but timed out, and a duplicate within one batch
+    backend.insert_rows(AGGREGATE_TABLE, rows + [rows[0]])
+    view = AggregateView(backend.read_aggregates())
+    backend.close()
+    assert view.total("turns") == 2
+    assert view.total("stories") == 1
+
+
+def test_failed_over_turns_count_under_the_answering_provider():
+    state = story_state()
+    increments = turn_increments(state, turn_data(1, provider="openai", validation_error="mood"))
+    view = AggregateView(turn_row(1, 1, increments)["increments"])
+    stats = {row["provider"]: row for row in view.story_stats()}
+    assert stats["openai"]["turns"] == 1
+    assert stats["openai"]["validation_error_rate"] == 1.0
+    assert stats["gemini"]["stories"] == 1
+    assert stats["gemini"]["failover_turns"] == 1
+
+
+def test_simulated_counts_are_kept_apart():
+    rows = (
+        turn_row(1, 1, turn_increments(story_state(), turn_data(1)))["increments"]
+        + turn_row(2, 1, turn_increments(story_state(simulated=True), turn_data(1)))["increments"]
+    )
+    assert AggregateView(rows).total("turns") == 1
+    assert AggregateView(rows, include_simulated=True).total("turns") == 2
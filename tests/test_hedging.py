@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import pytest
+
+from fake_backends import FakeLLMClients
+from hedging import HedgedLLMClients, ProviderText, answered_by
+from telemetry import Telemetry
+
+
+class ProviderClients(FakeLLMClients):
+    """Fake clients where each provider has its own latency and may be down"""
+
+    def __init__(self, latencies=None, failing=()):
+        super().__init__()
+        self.latencies = latencies or {}
+        self.failing = set(failing)
+
+    def _response(self, provider):
+        if provider in self.failing:
+            raise RuntimeError(f"{provider} is down")
+        return f"{provider} tells the story"
+
+    def generate(self, prompt, provider, **kwargs):
+        time.sleep(self.latencies.get(provider, 0.0))
+        return self._response(provider)
+
+    async def agenerate(self, prompt, provider, **kwargs):
+        await asyncio.sleep(self.latencies.get(provider, 0.0))
+        return self._response(provider)
+
+    async def astream(self, prompt, provider, **kwargs):
+        await asyncio.sleep(self.latencies.get(provider, 0.0))
+        for word in self._response(provider).split(" "):
+            yield word + " "
+
+
+@pytest.fixture
+def make_hedged():
+    created = []
+
+    def make(latencies=None, failing=(), **options):
+        clients = ProviderClients(latencies, failing)
+        created.append(clients)
+        telemetry = Telemetry()
+        return HedgedLLMClients(clients, telemetry=telemetry, **options), telemetry
+
+    yield make
+    for clients in created:
+        clients.close()
+
+
+def counters(telemetry):
+    return {name: value for (name, _), value in telemetry.counters.items()}
+
+
+def test_answered_by_falls_back_to_the_requested_provider():
+    assert answered_by("plain text", "gemini") == "gemini"
+    assert answered_by(ProviderText("tagged", "openai"), "gemini") == "openai"
+    assert answered_by(None, "gemini") == "gemini"
+
+
+def test_pass_through_tags_the_requested_provider(make_hedged):
+    hedged, _ = make_hedged(failover=False)
+    response = hedged.generate("prompt", "gemini")
+    assert response == "gemini tells the story"
+    assert answered_by(response, "gemini") == "gemini"
+
+
+def test_failover_reports_the_backup_provider(make_hedged):
+    hedged, telemetry = make_hedged(failing={"gemini"})
+    response = hedged.generate("prompt", "gemini")
+    assert response == "openai tells the story"
+    assert answered_by(response, "gemini") == "openai"
+    assert counters(telemetry)["llm_failovers_total"] == 1
+
+
+def test_slow_primary_is_hedged(make_hedged):
+    hedged, telemetry = make_hedged(latencies={"gemini": 1.0}, response_deadline=0.05, failover=False)
+    start = time.perf_counter()
+    response = hedged.generate("prompt", "gemini")
+    assert time.perf_counter() - start < 0.5
+    assert answered_by(response, "gemini") == "openai"
+    assert counters(telemetry)["llm_hedges_total"] == 1
+
+
+def test_both_providers_failing_raises(make_hedged):
+    hedged, _ = make_hedged(failing={"gemini", "openai"})
+    with pytest.raises(RuntimeError):
+        hedged.generate("prompt", "gemini")
+
+
+def test_stream_failover_tags_every_chunk(make_hedged):
+    hedged, _ = make_hedged(failing={"gemini"})
+    chunks = list(hedged.stream("prompt", "gemini"))
+    assert "".join(chunks).strip() == "openai tells the story"
+    assert {answered_by(chunk, "gemini") for chunk in chunks} == {"openai"}
+
+
+def test_stream_hedge_uses_the_first_provider_to_answer(make_hedged):
+    hedged, _ = make_hedged(latencies={"gemini": 1.0}, first_chunk_deadline=0.05, failover=False)
+    chunks = list(hedged.stream("prompt", "gemini"))
+    assert "".join(chunks).strip() == "openai tells the story"
+    assert {chunk.provider for chunk in chunks} == {"openai"}
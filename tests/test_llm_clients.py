@@ -0,0 +1,105 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from llm_clients import OPENAI_MODEL, SYSTEM_MESSAGE, LLMClients
+from story_schema import STORY_TURN_SCHEMA
+
+
+def completion(text):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def delta(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class RawResponse:
+    def __init__(self, parsed, headers):
+        self.parsed = parsed
+        self.headers = headers
+
+    def parse(self):
+        return self.parsed
+
+
+class FakeGemini:
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False, **options):
+        self.prompts.append(prompt)
+        if stream:
+            return [SimpleNamespace(text="Once "), SimpleNamespace(text=""), SimpleNamespace(text="upon")]
+        return SimpleNamespace(text="gemini story")
+
+    async def generate_content_async(self, prompt, stream=False, **options):
+        self.prompts.append(prompt)
+        return SimpleNamespace(text="async gemini story")
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    clients = LLMClients(openai_api_key="test-key", gemini_api_key="test-key")
+    clients.gemini = FakeGemini()
+    clients.requests = []
+
+    def create(**request):
+        clients.requests.append(request)
+        if request.get("stream"):
+            return RawResponse([delta("Once "), delta(None), delta("upon")], {"x-ratelimit-remaining-requests": "9"})
+        return RawResponse(completion("openai story"), {"x-ratelimit-remaining-requests": "9"})
+
+    async def async_create(**request):
+        return create(**request)
+
+    monkeypatch.setattr(clients.openai.chat.completions.with_raw_response, "create", create)
+    monkeypatch.setattr(clients.async_openai.chat.completions.with_raw_response, "create", async_create)
+    yield clients
+    clients.close()
+
+
+def test_generate_sends_the_system_message_to_each_provider(clients):
+    assert clients.generate("Tell a story", "openai") == "openai story"
+    request = clients.requests[-1]
+    assert request["model"] == OPENAI_MODEL
+    assert request["messages"] == [{"role": "system", "content": SYSTEM_MESSAGE}, {"role": "user", "content": "Tell a story"}]
+
+    assert clients.generate("Tell a story", "gemini") == "gemini story"
+    assert clients.gemini.prompts[-1] == f"{SYSTEM_MESSAGE}\n\nTell a story"
+
+
+def test_stream_skips_empty_chunks(clients):
+    assert list(clients.stream("Tell a story", "openai")) == ["Once ", "upon"]
+    assert list(clients.stream("Tell a story", "gemini")) == ["Once ", "upon"]
+
+
+def test_openai_headers_reach_the_listener(clients):
+    seen = []
+    clients.header_listener = lambda provider, headers: seen.append((provider, headers))
+    clients.generate("Tell a story", "openai")
+    assert seen == [("openai", {"x-ratelimit-remaining-requests": "9"})]
+
+
+def test_structured_requests_ask_for_json(clients):
+    clients.generate("Tell a story", "openai", response_schema=STORY_TURN_SCHEMA)
+    assert "response_format" in clients.requests[-1]
+
+
+def test_async_calls_run_on_the_shared_loop(clients):
+    threads = []
+
+    async def call():
+        threads.append(threading.current_thread().name)
+        return await clients.agenerate("Tell a story", "openai"), await clients.agenerate("Tell a story", "gemini")
+
+    assert clients.run(call(), timeout=5) == ("openai story", "async gemini story")
+    assert threads == ["llm-clients-loop"]
+
+
+def test_close_stops_the_loop_once(clients):
+    clients.close()
+    clients.close()
+    clients._loop_thread.join(timeout=5)
+    assert not clients.loop.is_running()
@@ -0,0 +1,59 @@
+from fake_backends import FakeStorageBackend
+from storage import PersistenceSession
+from story_engine import new_story_state
+from write_behind import WriteBehindQueue
+
+
+def story_state():
+    return new_story_state(genre="fantasy", name="Ada", total_turns=10)
+
+
+def test_story_is_created_once_and_its_id_kept_in_the_session():
+    backend = FakeStorageBackend()
+    state = story_state()
+    persistence = PersistenceSession(backend, state)
+    story_id = persistence.ensure_story()
+    assert state["story_id"] == story_id
+    # A new handle for the same session reuses the id instead of creating or looking up a story
+    assert PersistenceSession(backend, state).ensure_story() == story_id
+    assert len(backend.stories) == 1
+    assert "simulated" not in backend.stories[story_id]
+
+
+def test_rows_carry_the_session_story_id():
+    backend = FakeStorageBackend()
+    persistence = PersistenceSession(backend, story_state())
+    story_id = persistence.ensure_story()
+    persistence.save_emotional_data({"turn_number": 1})
+    persistence.save_validation_data({"arc_valid": True})
+    assert backend.rows["emotional_data"] == [{"turn_number": 1, "story_id": story_id}]
+    assert backend.rows["mood_validations"] == [{"arc_valid": True, "story_id": story_id}]
+
+
+def test_research_email_waits_for_the_story_or_updates_it():
+    backend = FakeStorageBackend()
+    state = story_state()
+    persistence = PersistenceSession(backend, state)
+    persistence.save_research_email("early@example.com")
+    story_id = persistence.ensure_story()
+    assert backend.stories[story_id]["research_email"] == "early@example.com"
+    persistence.save_research_email("late@example.com")
+    assert backend.stories[story_id]["research_email"] == "late@example.com"
+
+
+def test_rows_go_through_the_write_queue():
+    backend = FakeStorageBackend()
+    write_queue = WriteBehindQueue(backend.insert_rows, flush_interval=5.0)
+    persistence = PersistenceSession(backend, story_state(), write_queue=write_queue)
+    persistence.ensure_story()
+    persistence.save_emotional_data({"turn_number": 1})
+    assert backend.rows["emotional_data"] == []
+    assert persistence.flush(wait=True)
+    assert len(backend.rows["emotional_data"]) == 1
+    write_queue.close()
+
+
+def test_simulated_stories_are_marked():
+    backend = FakeStorageBackend()
+    story_id = PersistenceSession(backend, new_story_state(genre="fantasy", name="Ada", simulated=True)).ensure_story()
+    assert backend.stories[story_id]["simulated"] is True
@@ -0,0 +1,102 @@
+import re
+
+import numpy as np
+import pytest
+
+import prolog_rules
+from emotional_validator import STORY_PHASES, EmotionalValidator
+from prolog_rules import DEFAULT_RULES_PATH, PrologSyntaxError, RuleProgram, compile_rules, load_rules
+from prompts import get_story_phase
+
+with open(DEFAULT_RULES_PATH, encoding="utf-8") as f:
+    SOURCE = f.read()
+
+
+def pl_facts(name):
+    """Ground facts name(a, b). read straight from the rule file with a regex"""
+    return re.findall(rf"^{name}\((\w+), (-?\w+)\)\.", SOURCE, re.MULTILINE)
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return compile_rules(SOURCE)
+
+
+def test_facts_match_the_rule_file(rules):
+    assert rules["emotion_categories"] == dict(pl_facts("emotion_category"))
+    assert rules["intensity_levels"] == {level: int(value) for level, value in pl_facts("intensity_level")}
+    progressions = {}
+    for phase, next_phase in pl_facts("valid_phase_progression"):
+        progressions.setdefault(phase, []).append(next_phase)
+    assert rules["phase_progressions"] == progressions
+
+
+def test_transitions_follow_valid_transition(rules):
+    categories = dict(pl_facts("emotion_category"))
+    for source, source_category in categories.items():
+        expected = [
+            target for target, target_category in categories.items()
+            if source_category == target_category
+            or (source_category, target_category) == ("negative", "positive")
+            or source_category == "neutral"
+            or target_category == "neutral"
+        ]
+        assert rules["valid_transitions"][source] == expected
+
+
+def test_phase_emotions_follow_valid_emotional_progression(rules):
+    categories = dict(pl_facts("emotion_category"))
+    assert rules["phase_emotions"] == {
+        "beginning": list(categories),
+        "middle": [emotion for emotion, category in categories.items() if category in ("positive", "negative")],
+        "climax": [emotion for emotion, category in categories.items() if category == "positive"],
+    }
+
+
+def test_load_rules_caches_the_same_tables(tmp_path, monkeypatch, rules):
+    # Start without the tables other tests already loaded in this process
+    monkeypatch.setattr(prolog_rules, "_loaded", {})
+    cache_path = tmp_path / "rules.json"
+    rules_path = tmp_path / "rules.pl"
+    rules_path.write_text(SOURCE, encoding="utf-8")
+    assert load_rules(str(rules_path), cache_path=str(cache_path)) == rules
+    assert cache_path.exists()
+
+
+def test_resolver_handles_the_supported_subset():
+    program = RuleProgram("""
+        size(small, 1).
+        size(large, 3).
+        big(X) :- size(X, N), N >= 2.
+        either(X) :- (X = a; X = b), X \\= b.
+    """)
+    assert program.holds("big", "large")
+    assert not program.holds("big", "small")
+    assert program.holds("either", "a")
+    assert not program.holds("either", "b")
+
+
+def test_syntax_errors_are_reported():
+    with pytest.raises(PrologSyntaxError):
+        RuleProgram("broken(a :- .")
+
+
+def test_batch_validation_matches_the_live_path():
+    validator = EmotionalValidator()
+    rng = np.random.default_rng(0)
+    moods = validator.emotions + ["happy"]
+    for total_turns in (5, 10, 17):
+        arcs = [[moods[i] for i in rng.integers(len(moods), size=total_turns)] for _ in range(20)]
+        batch = validator.validate_arcs(validator.encode_arcs(arcs), total_turns=total_turns)
+        for arc, flags in zip(arcs, batch):
+            live = [
+                validator.check_turn(
+                    turn,
+                    validator.encode_mood(mood),
+                    validator.encode_mood(arc[turn - 1]) if turn else -1,
+                    story_phase=get_story_phase(turn, total_turns),
+                )
+                for turn, mood in enumerate(arc)
+            ]
+            assert flags.tolist() == live
+    assert set(STORY_PHASES) == {get_story_phase(turn, 10) for turn in range(10)}
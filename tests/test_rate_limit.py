@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from rate_limit import (ModelRateLimit, RateLimitedLLMClients, RateLimiter, TokenBucket, is_rate_limit,
+                        parse_duration, retry_after_seconds)
+from telemetry import Telemetry
+
+
+class RateLimitError(Exception):
+    """Named like openai's, which is how is_rate_limit recognises it"""
+
+
+class StatusError(Exception):
+    def __init__(self, message, status_code=None, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+
+class FlakyClients:
+    """Clients that are rate limited a set number of times before answering"""
+
+    def __init__(self, failures, error=None):
+        self.failures = failures
+        self.error = error or StatusError("slow down", status_code=429, headers={"retry-after-ms": "10"})
+        self.calls = 0
+
+    def generate(self, prompt, provider, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "story"
+
+    async def agenerate(self, prompt, provider, **kwargs):
+        return self.generate(prompt, provider, **kwargs)
+
+
+def test_token_bucket_waits_for_its_share_and_refunds():
+    bucket = TokenBucket(60, now=0.0)
+    assert bucket.reserve(60, now=0.0) == 0.0
+    assert bucket.reserve(30, now=0.0) == pytest.approx(30.0)
+    bucket.refund(30, now=0.0)
+    assert bucket.level == pytest.approx(0.0)
+    # Refills at one unit a second and never holds more than a minute's worth
+    bucket.reserve(0, now=120.0)
+    assert bucket.level == pytest.approx(60.0)
+
+
+def test_model_rate_limit_refund_returns_the_reservation():
+    now = [0.0]
+    limit = ModelRateLimit(requests_per_minute=1, tokens_per_minute=1000, jitter=0, clock=lambda: now[0])
+    assert limit.reserve(500) == 0.0
+    limit.refund(500)
+    assert limit.reserve(500) == 0.0
+    assert limit.reserve(500) == pytest.approx(60.0)
+
+
+@pytest.mark.parametrize("error, expected", [
+    (StatusError("Too many", status_code=429), True),
+    (RateLimitError("quota"), True),
+    (StatusError("Server error", status_code=500), False),
+    (ValueError("Invalid value 429 in request"), False),
+])
+def test_is_rate_limit_uses_the_status_or_type(error, expected):
+    assert is_rate_limit(error) is expected
+
+
+def test_retry_after_reads_headers_and_messages():
+    assert retry_after_seconds(StatusError("", headers={"retry-after-ms": "250"})) == pytest.approx(0.25)
+    assert retry_after_seconds(StatusError("", headers={"retry-after": "3"})) == pytest.approx(3.0)
+    assert retry_after_seconds(StatusError("", headers={"x-ratelimit-reset-tokens": "6m0s"})) == pytest.approx(360.0)
+    assert retry_after_seconds(RateLimitError("Please retry in 23.5s")) == pytest.approx(23.5)
+    assert retry_after_seconds(RateLimitError("no hint")) is None
+    assert parse_duration("1.5s") == 1.5
+
+
+def make_clients(clients, max_retries=3, limits=None):
+    limiter = RateLimiter(limits or {"gemini": {"requests_per_minute": 60, "tokens_per_minute": 100000}}, jitter=0)
+    return RateLimitedLLMClients(clients, limiter, max_retries=max_retries, telemetry=Telemetry()), limiter
+
+
+def test_rate_limited_calls_are_retried_and_refunded():
+    clients = FlakyClients(failures=2)
+    limited, limiter = make_clients(clients)
+    assert limited.generate("prompt", "gemini") == "story"
+    assert clients.calls == 3
+    # Only the call that succeeded used up a request
+    assert limiter.limit_for("gemini").requests.level == pytest.approx(59.0, abs=0.1)
+
+
+def test_other_errors_are_not_retried():
+    clients = FlakyClients(failures=1, error=StatusError("bad request", status_code=400))
+    limited, _ = make_clients(clients)
+    with pytest.raises(StatusError):
+        limited.generate("prompt", "gemini")
+    assert clients.calls == 1
+
+
+def test_retries_give_up_after_max_retries():
+    clients = FlakyClients(failures=10)
+    limited, limiter = make_clients(clients, max_retries=2)
+    with pytest.raises(StatusError):
+        asyncio.run(limited.agenerate("prompt", "gemini"))
+    assert clients.calls == 3
+    assert limiter.limit_for("gemini").requests.level == pytest.approx(60.0, abs=0.1)
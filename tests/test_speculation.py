@@ -0,0 +1,66 @@
+import pytest
+
+from fake_backends import FakeLLMClients
+from speculation import SpeculationBudget, SpeculativeTurns, extract_options, response_similarity
+
+
+@pytest.mark.parametrize("question, options", [
+    ("Do you follow the stranger, or stay by the river?", ["follow the stranger", "stay by the river"]),
+    ("As the storm grows: will you run, hide, or wait?", ["run", "hide"]),
+    ("What next?\n1. Open the map\n2. Ask about the songs", ["Open the map", "Ask about the songs"]),
+    ("How do you feel right now?", []),
+    (None, []),
+])
+def test_extract_options(question, options):
+    assert extract_options(question) == options
+
+
+def test_response_similarity():
+    assert response_similarity("Follow the stranger!", "follow the stranger") == 1.0
+    assert response_similarity("I follow the stranger quietly", "follow the stranger") == 0.9
+    assert response_similarity("I go home", "follow the stranger") < 0.8
+    assert response_similarity("", "follow the stranger") == 0.0
+
+
+@pytest.fixture
+def clients():
+    clients = FakeLLMClients()
+    yield clients
+    clients.close()
+
+
+def branch_prompts(*options):
+    return [(option, f"Continue after the reader chose: {option}") for option in options]
+
+
+def test_matching_reply_is_served_and_other_branches_cancelled(clients):
+    budget = SpeculationBudget(max_in_flight=4)
+    speculation = SpeculativeTurns(clients, budget)
+    speculation.start(3, branch_prompts("follow the stranger", "stay by the river"), "gemini")
+    response = speculation.take(3, "I follow the stranger", timeout=5)
+    assert response == clients.response_for("Continue after the reader chose: follow the stranger", "gemini")
+    assert speculation.branches == {}
+    assert speculation.stats["hits"] == 1
+    assert speculation.stats["discarded"] == 1
+
+
+def test_unmatched_reply_or_other_turn_is_a_miss(clients):
+    speculation = SpeculativeTurns(clients, SpeculationBudget())
+    speculation.start(3, branch_prompts("follow the stranger", "stay by the river"), "gemini")
+    assert speculation.take(4, "follow the stranger") is None
+    assert speculation.take(3, "I climb the tower", timeout=5) is None
+    assert speculation.stats["misses"] == 1
+
+
+def test_budget_caps_branches_across_sessions(clients):
+    budget = SpeculationBudget(max_in_flight=1)
+    first = SpeculativeTurns(clients, budget)
+    second = SpeculativeTurns(clients, budget)
+    clients.latency = 0.5
+    first.start(1, branch_prompts("open the map", "ask about the songs"), "gemini")
+    second.start(1, branch_prompts("cross the bridge"), "gemini")
+    assert first.stats["started"] == 1
+    assert first.stats["skipped_budget"] == 1
+    assert second.stats["skipped_budget"] == 1
+    first.discard()
+    second.discard()
@@ -0,0 +1,75 @@
+import sqlite3
+
+import pytest
+
+from fake_backends import FakeStorageBackend
+from storage import SQLiteBackend, SupabaseSync
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "woven.db"))
+    yield backend
+    backend.close()
+
+
+def turn_row(story_id, turn_number, **values):
+    return dict({"story_id": story_id, "turn_number": turn_number, "character_mood": "joy", "is_final": False}, **values)
+
+
+def test_stories_and_rows_are_stored(backend):
+    story_id = backend.create_story({"name": "Ada", "genre": "fantasy", "total_turns": 10})
+    backend.insert_rows("emotional_data", [turn_row(story_id, 1), turn_row(story_id, 2, provider="openai")])
+    backend.update_story(story_id, {"research_email": "ada@example.com"})
+    rows = backend.conn.execute("SELECT turn_number, provider, synced FROM emotional_data ORDER BY id").fetchall()
+    assert rows == [(1, None, 0), (2, "openai", 0)]
+    assert backend.conn.execute("SELECT research_email, simulated, needs_sync FROM stories").fetchone() == ("ada@example.com", 0, 1)
+    assert backend.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_failed_batch_is_rolled_back(backend):
+    story_id = backend.create_story({"name": "Ada"})
+    with pytest.raises(sqlite3.IntegrityError):
+        backend.insert_rows("emotional_data", [turn_row(story_id, 1), turn_row(story_id + 100, 2)])
+    assert backend.conn.execute("SELECT COUNT(*) FROM emotional_data").fetchone()[0] == 0
+
+
+def test_old_databases_get_new_columns(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE stories (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, genre TEXT, total_turns INTEGER,
+            start_time TEXT, research_email TEXT, remote_id INTEGER, needs_sync INTEGER NOT NULL DEFAULT 1);
+        CREATE TABLE emotional_data (id INTEGER PRIMARY KEY AUTOINCREMENT, story_id INTEGER NOT NULL, turn_number INTEGER,
+            character_mood TEXT, user_mood TEXT, story_summary TEXT, question TEXT, personality_scores TEXT,
+            story_phase TEXT, is_final INTEGER, timestamp TEXT, synced INTEGER NOT NULL DEFAULT 0);
+    """)
+    conn.close()
+    backend = SQLiteBackend(path)
+    story_id = backend.create_story({"name": "Ada", "simulated": True})
+    backend.insert_rows("emotional_data", [turn_row(story_id, 1, provider="gemini")])
+    assert backend.conn.execute("SELECT provider FROM emotional_data").fetchone() == ("gemini",)
+    assert backend.conn.execute("SELECT simulated FROM stories").fetchone() == (1,)
+    backend.close()
+
+
+def test_sync_copies_stories_and_rows_with_remote_ids(backend):
+    remote = FakeStorageBackend()
+    remote.create_story({"name": "someone else"})
+    story_id = backend.create_story({"name": "Ada", "genre": "fantasy", "total_turns": 10})
+    backend.insert_rows("emotional_data", [turn_row(story_id, 1), turn_row(story_id, 2, provider="openai")])
+    sync = SupabaseSync(backend, remote, interval=3600)
+    try:
+        assert sync.sync_once() == 3
+        assert sync.sync_once() == 0
+    finally:
+        sync.close()
+    remote_id = backend.conn.execute("SELECT remote_id FROM stories").fetchone()[0]
+    assert remote_id == 2
+    assert "simulated" not in remote.stories[remote_id]
+    first, second = remote.rows["emotional_data"]
+    assert first["story_id"] == second["story_id"] == remote_id
+    # Turns the chosen model wrote are sent without a provider
+    assert "provider" not in first
+    assert second["provider"] == "openai"
+    assert first["is_final"] is False
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from fake_backends import FakeLLMClients
+from story_parser import SECTION_NAMES, StoryStreamParser, parse_story_response
+
+RESPONSE = (
+    "The lantern flickered on the bridge.\n~~~~\nDo you cross, or wait?\n~~~~\nA summary.\n~~~~\n"
+    "Current character mood: joy\n~~~~\nCurrent user mood: trust\n~~~~\nRisk Taker: 3/5\nOptimism: 2/5"
+)
+
+
+def chunked(text, sizes):
+    position = 0
+    for size in sizes:
+        yield text[position:position + size]
+        position += size
+    if position < len(text):
+        yield text[position:]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 40, len(RESPONSE)])
+def test_streamed_sections_match_the_complete_parse(chunk_size):
+    parser = StoryStreamParser()
+    completed = []
+    for chunk in chunked(RESPONSE, [chunk_size] * len(RESPONSE)):
+        completed += parser.feed(chunk)
+    assert completed == SECTION_NAMES[:-1]
+    assert parser.finish() == parse_story_response(RESPONSE)
+    assert parser.section("character_mood") == "joy"
+
+
+def test_paragraph_never_shows_part_of_a_delimiter():
+    parser = StoryStreamParser()
+    for chunk in chunked(RESPONSE, [1] * len(RESPONSE)):
+        parser.feed(chunk)
+        assert "~" not in parser.paragraph_text
+        assert "The lantern flickered on the bridge.".startswith(parser.paragraph_text)
+    assert parser.paragraph_done
+
+
+def test_random_chunking_of_fake_responses():
+    clients = FakeLLMClients()
+    try:
+        rng = random.Random(7)
+        for i in range(50):
+            response = clients.response_for(f"prompt {i}" + (" Write the FINAL part" if i % 5 == 0 else ""))
+            parser = StoryStreamParser()
+            for chunk in chunked(response, [rng.randint(1, 12) for _ in range(len(response))]):
+                parser.feed(chunk)
+            assert parser.finish() == parse_story_response(response)
+    finally:
+        clients.close()
+
+
+def test_unclosed_sections_are_none_until_their_delimiter_arrives():
+    parser = StoryStreamParser()
+    assert parser.feed("Once upon a time~~") == []
+    assert parser.section("paragraph") is None
+    assert parser.paragraph_text == "Once upon a time"
+    assert parser.feed("~~next") == ["paragraph"]
+    assert parser.section("paragraph") == "Once upon a time"
@@ -0,0 +1,33 @@
+import pytest
+
+from trait_matcher import TraitMatcher
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return TraitMatcher()
+
+
+@pytest.mark.parametrize("text, keywords", [
+    ("i want to make friends", ["friend"]),
+    ("i am exploring the cave", ["explore"]),
+    ("hoping for the best", ["hope"]),
+    ("moving on", ["move"]),
+    ("the explorers return", ["explore"]),
+    ("i step carefully", ["careful"]),
+    ("imagining dragons", ["imagine", "dragon"]),
+])
+def test_inflected_keywords_match(matcher, text, keywords):
+    assert matcher.matches(text) == keywords
+
+
+@pytest.mark.parametrize("text", ["open the door", "really", "a small hop"])
+def test_other_words_do_not_match(matcher, text):
+    assert matcher.matches(text) == []
+
+
+def test_batch_scores_match_single_scores(matcher):
+    responses = ["I am exploring alone", "Really hoping to help friends", "moving on quietly", "", None]
+    batch = matcher.score_batch(responses)
+    for row, response in zip(batch, responses):
+        assert row.tolist() == list(matcher.score(("" if response is None else response).lower()).values())
@@ -0,0 +1,97 @@
+import threading
+import time
+
+from telemetry import Telemetry
+from write_behind import WriteBehindQueue
+
+
+class Recorder:
+    """write_rows stand-in recording each batch, optionally failing or blocking first"""
+
+    def __init__(self, failures=0, gate=None):
+        self.batches = []
+        self.failures = failures
+        self.gate = gate
+
+    def __call__(self, table, rows):
+        if self.gate is not None:
+            self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        self.batches.append((table, list(rows)))
+
+
+def make_queue(writer, **options):
+    options.setdefault("flush_interval", 0.05)
+    options.setdefault("base_backoff", 0.001)
+    return WriteBehindQueue(writer, **options)
+
+
+def test_rows_are_batched_per_table_in_order():
+    writer = Recorder()
+    write_queue = make_queue(writer, flush_interval=5.0)
+    for i in range(3):
+        write_queue.enqueue("emotional_data", {"turn_number": i})
+    write_queue.enqueue("mood_validations", {"arc_valid": True})
+    assert write_queue.flush(wait=True, timeout=5)
+    assert writer.batches == [
+        ("emotional_data", [{"turn_number": 0}, {"turn_number": 1}, {"turn_number": 2}]),
+        ("mood_validations", [{"arc_valid": True}]),
+    ]
+    write_queue.close()
+
+
+def test_close_writes_everything_and_refuses_new_rows():
+    writer = Recorder()
+    write_queue = make_queue(writer, flush_interval=5.0)
+    for i in range(10):
+        write_queue.enqueue("emotional_data", {"turn_number": i})
+    write_queue.close(timeout=5)
+    assert sum(len(rows) for _, rows in writer.batches) == 10
+    assert not write_queue.enqueue("emotional_data", {"turn_number": 10})
+    assert write_queue.stats()["rows_written"] == 10
+
+
+def test_flush_and_close_give_up_on_a_stalled_database():
+    gate = threading.Event()
+    write_queue = make_queue(Recorder(gate=gate), max_queue_size=2, put_timeout=0.05)
+    write_queue.enqueue("emotional_data", {"turn_number": 0})
+    time.sleep(0.2)  # The worker is now stuck writing the first batch
+    write_queue.enqueue("emotional_data", {"turn_number": 1})
+    write_queue.enqueue("emotional_data", {"turn_number": 2})
+    assert not write_queue.enqueue("emotional_data", {"turn_number": 3})
+
+    start = time.monotonic()
+    assert not write_queue.flush(wait=True, timeout=0.1)
+    write_queue.close(timeout=0.1)
+    assert time.monotonic() - start < 1.0
+    gate.set()
+
+
+def test_failed_batches_are_retried_then_dropped():
+    writer = Recorder(failures=2)
+    write_queue = make_queue(writer, max_retries=3)
+    write_queue.enqueue("emotional_data", {"turn_number": 0})
+    assert write_queue.flush(wait=True, timeout=5)
+    assert writer.batches == [("emotional_data", [{"turn_number": 0}])]
+    assert write_queue.stats()["retries"] == 2
+
+    writer.failures = 3
+    write_queue.enqueue("emotional_data", {"turn_number": 1})
+    assert write_queue.flush(wait=True, timeout=5)
+    stats = write_queue.stats()
+    assert stats["rows_failed"] == 1
+    assert stats["rows_written"] == 1
+    write_queue.close()
+
+
+def test_flush_latency_and_depth_reach_telemetry():
+    telemetry = Telemetry()
+    write_queue = make_queue(Recorder(), telemetry=telemetry)
+    write_queue.enqueue("emotional_data", {"turn_number": 0})
+    write_queue.flush(wait=True, timeout=5)
+    write_queue.close()
+    assert telemetry.histograms[("write_flush", (("table", "emotional_data"),))].count == 1
+    assert telemetry.gauges[("write_queue_depth", ())] == 0
+    assert "woven_write_queue_depth 0" in telemetry.render_prometheus()
@@ -0,0 +1,142 @@
+import re
+
+import numpy as np
+
+# Default choice patterns to look for (can be expanded)
+TRAIT_PATTERNS = {
+    "risk_taker": {
+        "increase": ["risk", "adventure", "try", "explore", "challenge", "brave", "new", "unknown", "dangerous"],
+        "decrease": ["safe", "cautious", "careful", "wait", "hesitate", "home", "familiar", "secure", "protect"]
+    },
+    "optimism": {
+        "increase": ["hope", "bright", "better", "good", "positive", "happy", "joy", "light", "smile", "laugh"],
+        "decrease": ["dark", "sad", "worry", "concern", "fear", "doubt", "negative", "problem", "trouble"]
+    },
+    "social": {
+        "increase": ["together", "friend", "people", "group", "help", "others", "talk", "share", "join", "team"],
+        "decrease": ["alone", "solitary", "myself", "quiet", "away", "distance", "independent", "solo"]
+    },
+    "analytical": {
+        "increase": ["think", "plan", "analyze", "understand", "reason", "logic", "consider", "examine", "study"],
+        "decrease": ["feel", "sense", "heart", "emotion", "gut", "intuition", "instinct", "immediate"]
+    },
+    "fantasy_interest": {
+        "increase": ["magic", "wonder", "dream", "imagine", "fantasy", "dragon", "fairy", "enchanted", "mysterious"],
+        "decrease": ["real", "practical", "actual", "realistic", "concrete", "ordinary", "everyday", "normal"]
+    },
+    "introspective": {
+        "increase": ["reflect", "ponder", "contemplate", "inner", "meaning", "thought", "deep", "soul", "mind"],
+        "decrease": ["act", "move", "go", "run", "jump", "do", "action", "immediate", "physical"]
+    }
+}
+
+# Inflections a keyword may carry, so "friends" and "carefully" match but "door" does not match "do"
+KEYWORD_SUFFIXES = r"(?:s|es|ed|d|ing|er|ers|ly|ful|ness)?"
+# Keywords this short take no "ly", which would make "really" a "real"
+SHORT_KEYWORD_LENGTH = 4
+SHORT_KEYWORD_SUFFIXES = r"(?:s|es|ed|d|ing|er|ers|ful|ness)?"
+# Suffixes that replace a keyword's final "e", as in "exploring", "hoping" and "moving"
+E_DROPPING_SUFFIXES = r"(?:ing|er|ers)"
+
+
+class TraitMatcher:
+    """Trait lexicons compiled into one word-boundary-aware regex.
+
+    A choice is scored in a single pass over its text. As before, each
+    trait moves at most one step up and one step down per choice.
+    """
+
+    def __init__(self, patterns=TRAIT_PATTERNS):
+        self.traits = list(patterns)
+        self.keywords = sorted({keyword for lexicon in patterns.values() for words in lexicon.values() for keyword in words})
+        keyword_index = {keyword: i for i, keyword in enumerate(self.keywords)}
+
+        # keyword x trait matrices of which direction each keyword moves each trait
+        self.increase = np.zeros((len(self.keywords), len(self.traits)), dtype=bool)
+        self.decrease = np.zeros((len(self.keywords), len(self.traits)), dtype=bool)
+        for t, trait in enumerate(self.traits):
+            for keyword in patterns[trait].get("increase", []):
+                self.increase[keyword_index[keyword], t] = True
+            for keyword in patterns[trait].get("decrease", []):
+                self.decrease[keyword_index[keyword], t] = True
+
+        # The stem left when a keyword drops its final "e", e.g. "explor" for "explore"
+        self._stems = {keyword[:-1]: keyword for keyword in self.keywords if keyword.endswith("e") and len(keyword) > 2}
+
+        def alternation(words):
+            # Longest words first so the alternation prefers the most specific match
+            return "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+        long_keywords = [keyword for keyword in self.keywords if len(keyword) > SHORT_KEYWORD_LENGTH]
+        short_keywords = [keyword for keyword in self.keywords if len(keyword) <= SHORT_KEYWORD_LENGTH]
+        self.regex = re.compile(
+            rf"\b(?:({alternation(long_keywords)}){KEYWORD_SUFFIXES}"
+            rf"|({alternation(short_keywords)}){SHORT_KEYWORD_SUFFIXES}"
+            rf"|({alternation(self._stems)}){E_DROPPING_SUFFIXES})\b"
+        )
+        self._keyword_index = keyword_index
+
+    def _keyword(self, match):
+        long_keyword, short_keyword, stem = match.groups()
+        return long_keyword or short_keyword or self._stems[stem]
+
+    def matches(self, choice_text):
+        """Keywords found in a lowercased choice"""
+        return [self._keyword(match) for match in self.regex.finditer(choice_text)]
+
+    def score(self, choice_text):
+        """Trait deltas (-1, 0 or +1) for one lowercased choice"""
+        hit = np.zeros(len(self.keywords), dtype=bool)
+        for keyword in self.matches(choice_text):
+            hit[self._keyword_index[keyword]] = True
+        deltas = (hit @ self.increase).astype(np.int8) - (hit @ self.decrease).astype(np.int8)
+        return dict(zip(self.traits, deltas.tolist()))
+
+    def score_batch(self, responses, chunk_size=100000):
+        """Trait deltas for many responses at once, as an (n_responses, n_traits) int8 array.
+
+        Each chunk of responses is lowercased into one buffer and scanned with
+        a single regex pass; matches are mapped back to their rows by offset.
+        """
+        responses = ["" if response is None else str(response).lower() for response in responses]
+        if len(responses) > chunk_size:
+            return np.concatenate([
+                self._score_chunk(responses[i:i + chunk_size]) for i in range(0, len(responses), chunk_size)
+            ])
+        return self._score_chunk(responses)
+
+    def _score_chunk(self, responses):
+        lengths = np.fromiter((len(response) + 1 for response in responses), dtype=np.int64, count=len(responses))
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        corpus = "\n".join(responses)
+
+        positions = []
+        keyword_ids = []
+        for match in self.regex.finditer(corpus):
+            positions.append(match.start())
+            keyword_ids.append(self._keyword_index[self._keyword(match)])
+
+        hits = np.zeros((len(responses), len(self.keywords)), dtype=bool)
+        if positions:
+            rows = np.searchsorted(starts, np.asarray(positions), side="right") - 1
+            hits[rows, np.asarray(keyword_ids)] = True
+        return (hits @ self.increase).astype(np.int8) - (hits @ self.decrease).astype(np.int8)
+
+
+def cumulative_preferences(deltas, start=None, low=-5, high=5):
+    """Replay per-turn deltas into capped preference scores after each turn.
+
+    deltas is (..., n_turns, n_traits); leading axes such as stories are
+    processed together, the loop only runs over turns.
+    """
+    deltas = np.asarray(deltas, dtype=np.int16)
+    scores = np.zeros(deltas.shape[:-2] + deltas.shape[-1:], dtype=np.int16) if start is None else np.array(start, dtype=np.int16)
+    history = np.empty_like(deltas)
+    for turn in range(deltas.shape[-2]):
+        scores = np.clip(scores + deltas[..., turn, :], low, high)
+        history[..., turn, :] = scores
+    return history
+
+
+# Compiled once at import
+DEFAULT_MATCHER = TraitMatcher()
@@ -0,0 +1,228 @@
+import functools
+import json
+import os
+import re
+
+# Page assets built once per process at import, not on every Streamlit rerun
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# URL prefix of Streamlit's static file serving (server.enableStaticServing)
+STATIC_URL = "app/static"
+MANIFEST_PATH = os.path.join(STATIC_DIR, "build", "manifest.json")
+
+# Original background for each genre and the start screen ("home"), used
+# until build_assets.py has produced the optimised variants
+GENRE_BACKGROUNDS = {
+    "fantasy": "fantasy.jpg",
+    "mystery": "mystery.jpg",
+    "dreamlike": "dreamlike.jpg",
+    "sci-fi": "scifi.jpg",
+    "horror": "horror.jpg",
+    "romance": "romance.jpg",
+    "comedy": "comedy.png",
+    "adventure": "adventure.jpg"
+}
+HOME_BACKGROUND = "home"
+BACKGROUND_FILES = dict(GENRE_BACKGROUNDS, **{HOME_BACKGROUND: "home.jpg"})
+
+# Backgrounds cover the viewport, so the browser picks a width for the window size
+BACKGROUND_SIZES = "100vw"
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """The build manifest written by build_assets.py, or an empty one"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"mime_types": {}, "backgrounds": {}}
+
+
+ASSET_MANIFEST = load_manifest()
+
+
+def background_sources(key, manifest=ASSET_MANIFEST):
+    """(mime type, srcset) for each built format of a background, best format first"""
+    entry = manifest["backgrounds"].get(key)
+    if not entry:
+        return []
+    sources = []
+    for image_format, variants in entry["variants"].items():
+        srcset = ", ".join(f"{STATIC_URL}/build/{variant['file']} {variant['width']}w" for variant in variants)
+        sources.append((manifest["mime_types"][image_format], srcset))
+    return sources
+
+
+def background_html(key, manifest=ASSET_MANIFEST):
+    """Full-page background: a blurred inline placeholder under a responsive picture"""
+    entry = manifest["backgrounds"].get(key)
+    sources = background_sources(key, manifest)
+    if not sources:
+        return f'<div class="fullscreen-bg"><img src="{STATIC_URL}/backgrounds/{BACKGROUND_FILES[key]}" alt=""></div>'
+    source_tags = "".join(f'<source type="{mime}" srcset="{srcset}" sizes="{BACKGROUND_SIZES}">' for mime, srcset in sources)
+    fallback_srcset = sources[-1][1]
+    fallback_src = fallback_srcset.split(", ")[0].split(" ")[0]
+    return (
+        f'<div class="fullscreen-bg" style="background-image: url(\'{entry["placeholder"]}\');">'
+        f'<picture>{source_tags}<img src="{fallback_src}" srcset="{fallback_srcset}" sizes="{BACKGROUND_SIZES}" alt="" decoding="async"></picture>'
+        '</div>'
+    )
+
+
+def preload_html(key, manifest=ASSET_MANIFEST):
+    """Preload hint for a background the next page will show"""
+    sources = background_sources(key, manifest)
+    if not sources:
+        return f'<link rel="preload" as="image" href="{STATIC_URL}/backgrounds/{BACKGROUND_FILES[key]}">'
+    # The first (best) format; browsers skip a preload whose type they cannot decode
+    mime, srcset = sources[0]
+    return f'<link rel="preload" as="image" type="{mime}" imagesrcset="{srcset}" imagesizes="{BACKGROUND_SIZES}">'
+
+
+# Built once per process, so reruns only look them up
+BACKGROUND_HTML = {key: background_html(key) for key in BACKGROUND_FILES}
+PRELOAD_HTML = {key: preload_html(key) for key in BACKGROUND_FILES}
+
+# Styling with full-page background and translucent elements
+APP_CSS = """
+<style>
+    /* Override Streamlit's default background */
+    .stApp {
+        background-color: transparent;
+    }
+    
+    /* Full page background */
+    .fullscreen-bg {
+        position: fixed;
+        top: 0;
+        left: 0;
+        width: 100%;
+        height: 100%;
+        background-size: cover;
+        background-position: center;
+        z-index: -1;
+        filter: brightness(0.7);
+    }
+    
+    /* Responsive background image over its blurred placeholder */
+    .fullscreen-bg picture, .fullscreen-bg img {
+        display: block;
+        width: 100%;
+        height: 100%;
+        object-fit: cover;
+    }
+    
+    /* Main content container */
+    .app-container {
+        margin: 0 auto;
+        max-width: 800px;
+        padding: 20px;
+    }
+    
+    /* Story paragraph styling */
+    .story-text {
+        background-color: rgba(20, 20, 20, 0.8);
+        padding: 25px;
+        border-radius: 10px;
+        font-size: 20px;
+        line-height: 1.6;
+        font-family: 'Arial', sans-serif;
+        color: #f8f8f8;
+        text-shadow: 1px 1px 2px #000;
+        margin-bottom: 25px;
+        backdrop-filter: blur(3px);
+        border: 1px solid rgba(80, 80, 80, 0.3);
+    }
+    
+    /* Question styling */
+    .story-question {
+        background-color: rgba(40, 40, 40, 0.9);
+        padding: 20px;
+        border-radius: 8px;
+        font-weight: bold;
+        color: white;
+        text-shadow: 1px 1px 2px #000;
+        font-size: 18px;
+        margin-top: 25px;
+        margin-bottom: 20px;
+        backdrop-filter: blur(5px);
+        border-left: 4px solid rgba(200, 200, 200, 0.5);
+    }
+    
+    /* Input field styling */
+    .stTextInput > div > div > input {
+        background-color: rgba(30, 30, 30, 0.7);
+        color: white;
+        border: 1px solid rgba(100, 100, 100, 0.3);
+        padding: 12px;
+        border-radius: 5px;
+        backdrop-filter: blur(3px);
+    }
+    
+    /* Placeholder text */
+    .stTextInput input::placeholder {
+        color: rgba(200, 200, 200, 0.6);
+    }
+    
+    /* Headings */
+    h1, h2, h3 {
+        color: white;
+        text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.5);
+    }
+    
+    /* Button styling */
+    .stButton > button {
+        background-color: rgba(60, 60, 60, 0.7);
+        color: white;
+        border: 1px solid rgba(120, 120, 120, 0.3);
+        backdrop-filter: blur(3px);
+    }
+    
+    /* Input form styling */
+    .stForm {
+        background-color: rgba(30, 30, 30, 0.7);
+        padding: 20px;
+        border-radius: 10px;
+        backdrop-filter: blur(5px);
+    }
+    
+    /* Success message */
+    .stSuccess {
+        background-color: rgba(40, 120, 40, 0.7);
+        color: white;
+        backdrop-filter: blur(3px);
+    }
+</style>
+"""
+
+
+def minify_css(css):
+    """Drop comments and collapse whitespace in a style block"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};:,>])\s*", r"\1", css).strip()
+
+
+# Sent on every rerun, so keep it small
+APP_STYLE = minify_css(APP_CSS)
+
+
+def story_paragraph_html(paragraph):
+    return f'<div class="story-text">{paragraph}</div>'
+
+
+@functools.lru_cache(maxsize=1024)
+def personality_scores_html(scores):
+    """One compact block of progress bars for a tuple of (trait, score) pairs"""
+    rows = []
+    for trait, score in scores:
+        # Normalize score to 0-100 range (from -5 to 5)
+        normalized_score = ((score + 5) / 10) * 100
+        rows.append(
+            '<div style="margin-bottom:10px;">'
+            f'<div style="display:flex;justify-content:space-between;"><span>{trait.replace("_", " ").title()}</span><span>{score}/5</span></div>'
+            '<div style="background-color:rgba(255,255,255,0.1);height:8px;border-radius:4px;">'
+            f'<div style="width:{normalized_score}%;height:100%;background-color:#4CAF50;border-radius:4px;"></div>'
+            '</div></div>'
+        )
+    return "".join(rows)
@@ -0,0 +1,202 @@
+import queue
+import random
+import threading
+import time
+
+
+class _Marker:
+    """Queue entry asking the worker to write everything enqueued before it"""
+
+    def __init__(self, stop=False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class WriteBehindQueue:
+    """Background queue that takes row inserts off the Streamlit script thread.
+
+    Rows are coalesced into one multi-row insert per table for up to
+    flush_interval seconds or max_batch_size rows, whichever comes first.
+    Failed batches are retried with exponential backoff and jitter. The queue
+    is bounded, so a stalled database applies backpressure instead of growing
+    memory without limit.
+
+    With a telemetry, the worker records each batch's write latency as the
+    write_flush stage, row and retry counts, and the queue depth as the
+    write_queue_depth gauge after every batch.
+    """
+
+    def __init__(self, write_rows, max_batch_size=100, flush_interval=1.0, max_queue_size=10000,
+                 max_retries=5, base_backoff=0.5, put_timeout=0.5, telemetry=None):
+        self.write_rows = write_rows  # Called as write_rows(table, rows)
+        self.telemetry = telemetry
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {
+            "rows_enqueued": 0,
+            "rows_written": 0,
+            "rows_failed": 0,
+            "batches_written": 0,
+            "retries": 0,
+            "last_flush_latency": None,
+            "max_flush_latency": 0.0,
+            "total_flush_latency": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, table, row):
+        """Queue a row for insert, returning False if the queue stayed full"""
+        if self._closed:
+            return False
+        try:
+            self._queue.put((table, row), timeout=self.put_timeout)
+        except queue.Full:
+            return False
+        with self._lock:
+            self._stats["rows_enqueued"] += 1
+        return True
+
+    def flush(self, wait=True, timeout=None):
+        """Write everything queued so far, optionally waiting until it is written.
+
+        Returns False if the marker could not be queued or written within
+        timeout (put_timeout when None), so a stalled database never blocks
+        the caller indefinitely.
+        """
+        if self._closed:
+            return True
+        marker = _Marker()
+        return self._put_marker(marker, self.put_timeout if timeout is None else timeout, wait)
+
+    def close(self, timeout=30):
+        """Flush remaining rows and stop the worker thread"""
+        if self._closed:
+            return
+        # Closed first, so no enqueue starting from now can land behind the stop marker
+        self._closed = True
+        if not self._put_marker(_Marker(stop=True), timeout, wait=True):
+            print(f"Debug: Write-behind queue did not drain within {timeout}s, {self.depth()} entries left")
+
+    def _put_marker(self, marker, timeout, wait):
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        if wait:
+            return marker.done.wait(max(0.0, deadline - time.monotonic()))
+        return True
+
+    def depth(self):
+        """Approximate number of entries waiting to be written"""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Queue depth, row counts and flush latency in seconds"""
+        with self._lock:
+            stats = dict(self._stats)
+        total_latency = stats.pop("total_flush_latency")
+        stats["avg_flush_latency"] = total_latency / stats["batches_written"] if stats["batches_written"] else None
+        stats["queue_depth"] = self.depth()
+        return stats
+
+    def _run(self):
+        while True:
+            batch, marker = self._collect()
+            if batch:
+                self._write_batch(batch)
+                self._report_depth()
+            if marker:
+                if marker.stop:
+                    # Rows from an enqueue that was already past the closed check
+                    self._write_batch(self._drain())
+                marker.done.set()
+                if marker.stop:
+                    return
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if isinstance(item, _Marker):
+                item.done.set()
+            else:
+                batch.append(item)
+
+    def _collect(self):
+        """Gather a batch of rows, returning early if a flush marker arrives"""
+        batch = []
+        item = self._queue.get()
+        if isinstance(item, _Marker):
+            return batch, item
+        batch.append(item)
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if isinstance(item, _Marker):
+                return batch, item
+            batch.append(item)
+        return batch, None
+
+    def _write_batch(self, batch):
+        # One multi-row insert per table, keeping rows in arrival order
+        rows_by_table = {}
+        for table, row in batch:
+            rows_by_table.setdefault(table, []).append(row)
+
+        for table, rows in rows_by_table.items():
+            start = time.perf_counter()
+            if self._write_with_retries(table, rows):
+                latency = time.perf_counter() - start
+                with self._lock:
+                    self._stats["rows_written"] += len(rows)
+                    self._stats["batches_written"] += 1
+                    self._stats["last_flush_latency"] = latency
+                    self._stats["max_flush_latency"] = max(self._stats["max_flush_latency"], latency)
+                    self._stats["total_flush_latency"] += latency
+                if self.telemetry:
+                    self.telemetry.observe("write_flush", latency, {"table": table})
+                    self.telemetry.count("write_rows_total", len(rows), table=table, outcome="written")
+            else:
+                with self._lock:
+                    self._stats["rows_failed"] += len(rows)
+                if self.telemetry:
+                    self.telemetry.count("write_rows_total", len(rows), table=table, outcome="failed")
+
+    def _report_depth(self):
+        if self.telemetry:
+            self.telemetry.gauge("write_queue_depth", self.depth())
+
+    def _write_with_retries(self, table, rows):
+        for attempt in range(self.max_retries):
+            try:
+                self.write_rows(table, rows)
+                return True
+            except Exception as e:
+                print(f"Debug: Write of {len(rows)} rows to {table} failed (attempt {attempt + 1}/{self.max_retries}): {e}")
+                if attempt < self.max_retries - 1:
+                    with self._lock:
+                        self._stats["retries"] += 1
+                    if self.telemetry:
+                        self.telemetry.count("write_retries_total", table=table)
+                    time.sleep(self.base_backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+        print(f"Debug: Dropping {len(rows)} rows for {table} after {self.max_retries} failed attempts")
+        return False